@@ -1,24 +1,198 @@
+import hashlib
+import datetime as dt
+
+from django.conf import settings
 from django.contrib import admin
+from django.contrib.admin.options import IncorrectLookupParameters
+from django.core.cache import cache
+from django.core.paginator import Paginator
+from django.db import connections
+from django.utils import timezone
+from django.utils.functional import cached_property
+
+from delivery_project.metrics import record_cache
+from references.cache import get_reference_names
+from references.models import CargoType, DeliveryStatus, TransportModel
 from .models import Delivery
 
 
+MONTH_NAMES = (
+    'Январь', 'Февраль', 'Март', 'Апрель', 'Май', 'Июнь',
+    'Июль', 'Август', 'Сентябрь', 'Октябрь', 'Ноябрь', 'Декабрь',
+)
+
+
+class EstimatedCountPaginator(Paginator):
+    """
+    Пагинатор списка в админ-панели без точного подсчета большой таблицы
+
+    Для списка без фильтров в PostgreSQL берется оценка количества строк
+    из статистики (pg_class.reltuples), если она больше
+    DELIVERY_ADMIN_ESTIMATE_THRESHOLD. В остальных случаях точное количество
+    кэшируется на DELIVERY_ADMIN_COUNT_CACHE_SECONDS секунд по тексту
+    запроса, поэтому новые записи могут появиться в счетчике с задержкой.
+    """
+
+    @cached_property
+    def count(self):
+        queryset = self.object_list
+        if not queryset.query.where:
+            estimate = self.estimate_table_rows(queryset)
+            if estimate is not None and estimate >= settings.DELIVERY_ADMIN_ESTIMATE_THRESHOLD:
+                return estimate
+
+        sql, params = queryset.query.sql_with_params()
+        digest = hashlib.md5(f'{queryset.db}:{sql}:{params!r}'.encode()).hexdigest()
+        key = f'admin:count:{queryset.model._meta.label_lower}:{digest}'
+        count = cache.get(key)
+        record_cache('admin_count', count is not None)
+        if count is None:
+            count = queryset.count()
+            cache.set(key, count, settings.DELIVERY_ADMIN_COUNT_CACHE_SECONDS)
+        return count
+
+    def estimate_table_rows(self, queryset):
+        """
+        Оценка количества строк таблицы по статистике PostgreSQL или None
+        """
+        connection = connections[queryset.db]
+        if connection.vendor != 'postgresql':
+            return None
+        with connection.cursor() as cursor:
+            cursor.execute(
+                'SELECT reltuples::bigint FROM pg_class WHERE oid = %s::regclass',
+                [queryset.model._meta.db_table],
+            )
+            row = cursor.fetchone()
+        # -1 - таблица еще не анализировалась
+        if row is None or row[0] < 0:
+            return None
+        return row[0]
+
+
+class CachedReferenceFilter(admin.SimpleListFilter):
+    """
+    Фильтр по справочнику с вариантами из кэша названий справочников
+
+    В отличие от стандартного фильтра по внешнему ключу не загружает
+    таблицу справочника при каждом открытии списка.
+    """
+    field_name = None
+    reference_model = None
+
+    def lookups(self, request, model_admin):
+        names = get_reference_names(self.reference_model)
+        return sorted(names.items(), key=lambda item: item[1])
+
+    def queryset(self, request, queryset):
+        if not self.value():
+            return queryset
+        if not self.value().isdigit():
+            raise IncorrectLookupParameters(f'Некорректное значение фильтра {self.parameter_name}')
+        return queryset.filter(**{f'{self.field_name}_id': int(self.value())})
+
+
+class StatusFilter(CachedReferenceFilter):
+    title = 'Статус'
+    parameter_name = 'status'
+    field_name = 'status'
+    reference_model = DeliveryStatus
+
+
+class TransportModelFilter(CachedReferenceFilter):
+    title = 'Модель транспорта'
+    parameter_name = 'transport_model'
+    field_name = 'transport_model'
+    reference_model = TransportModel
+
+
+class CargoTypeFilter(CachedReferenceFilter):
+    title = 'Тип груза'
+    parameter_name = 'cargo_type'
+    field_name = 'cargo_type'
+    reference_model = CargoType
+
+
+class DepartureDateFilter(admin.SimpleListFilter):
+    """
+    Выбор года, затем месяца отправления
+
+    Замена date_hierarchy: вместо DISTINCT по датам всей таблицы годы
+    берутся из диапазона от самой ранней до самой поздней даты отправления
+    (два запроса по индексу, результат кэшируется), месяцы выбранного года
+    перечисляются без запросов. Фильтр - диапазон по индексу departure_time.
+    """
+    title = 'Дата отправления'
+    parameter_name = 'departure'
+
+    def get_year_range(self, queryset):
+        key = f'admin:departure_years:{queryset.db}'
+        years = cache.get(key)
+        if years is None:
+            dates = queryset.model._default_manager.using(queryset.db).order_by('departure_time')
+            first = dates.values_list('departure_time', flat=True).first()
+            last = dates.reverse().values_list('departure_time', flat=True).first()
+            years = (first.year, last.year) if first and last else None
+            cache.set(key, years, settings.DELIVERY_ADMIN_COUNT_CACHE_SECONDS)
+        return years
+
+    def lookups(self, request, model_admin):
+        value = self.value() or ''
+        if len(value) >= 4 and value[:4].isdigit():
+            year = value[:4]
+            return [(year, f'{year} (весь год)')] + [
+                (f'{year}-{month:02d}', f'{name} {year}') for month, name in enumerate(MONTH_NAMES, 1)
+            ]
+        years = self.get_year_range(model_admin.get_queryset(request))
+        if years is None:
+            return []
+        return [(str(year), str(year)) for year in range(years[1], years[0] - 1, -1)]
+
+    def queryset(self, request, queryset):
+        value = self.value()
+        if not value:
+            return queryset
+        year, _, month = value.partition('-')
+        try:
+            if month:
+                start = dt.datetime(int(year), int(month), 1)
+                end = dt.datetime(int(year) + int(month) // 12, int(month) % 12 + 1, 1)
+            else:
+                start = dt.datetime(int(year), 1, 1)
+                end = dt.datetime(int(year) + 1, 1, 1)
+        except (ValueError, OverflowError):
+            raise IncorrectLookupParameters(f'Некорректное значение фильтра {self.parameter_name}')
+        tz = timezone.get_current_timezone()
+        return queryset.filter(
+            departure_time__gte=timezone.make_aware(start, tz),
+            departure_time__lt=timezone.make_aware(end, tz),
+        )
+
+
 @admin.register(Delivery)
 class DeliveryAdmin(admin.ModelAdmin):
     """
     Администрирование доставок
     
     Предоставляет интерфейс для управления доставками через админ-панель Django.
+    Список рассчитан на большие таблицы: справочники присоединяются одним
+    запросом, количество строк оценивается (EstimatedCountPaginator),
+    фильтры не загружают справочники и не группируют даты всей таблицы,
+    а справочники и услуги в форме выбираются через автодополнение.
     """
     list_display = (
         'number', 'transport_model', 'status', 
         'departure_time', 'arrival_time', 'travel_time_hours',
         'distance', 'condition'
     )
-    list_filter = ('status', 'condition', 'transport_model', 'cargo_type')
+    list_select_related = ('transport_model', 'status')
+    list_filter = (DepartureDateFilter, StatusFilter, 'condition', TransportModelFilter, CargoTypeFilter)
     search_fields = ('number', 'notes')
     readonly_fields = ('created_at', 'updated_at', 'created_by', 'updated_by')
-    filter_horizontal = ('services',)
-    date_hierarchy = 'departure_time'
+    autocomplete_fields = ('transport_model', 'status', 'packaging', 'cargo_type', 'services')
+    paginator = EstimatedCountPaginator
+    # Без второго подсчета всех строк таблицы для "N из M"
+    show_full_result_count = False
     
     fieldsets = (
         ('Основная информация', {
@@ -39,6 +213,15 @@ class DeliveryAdmin(admin.ModelAdmin):
         }),
     )
     
+    def get_queryset(self, request):
+        """
+        Служебные пользователи формы присоединяются к доставке одним запросом
+        """
+        queryset = super().get_queryset(request)
+        if request.resolver_match and request.resolver_match.url_name.endswith('_change'):
+            queryset = queryset.select_related('created_by', 'updated_by')
+        return queryset
+    
     def save_model(self, request, obj, form, change):
         """
         Сохраняет информацию о пользователе при создании/изменении
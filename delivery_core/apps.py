@@ -11,3 +11,9 @@ class DeliveryCoreConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'delivery_core'
     verbose_name = 'Доставки'
+    
+    def ready(self):
+        """
+        Подключает обработчики сигналов доставок
+        """
+        from . import signals
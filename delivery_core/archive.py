@@ -0,0 +1,158 @@
+"""
+Архив доставок (горячие и холодные данные)
+
+Выполненные доставки старше заданной даты переносятся командой
+archive_deliveries из оперативной таблицы в архивные таблицы
+(ArchivedDelivery, ArchivedDeliveryService), которые могут находиться
+в отдельной базе. Перенос выполняется пачками: каждая пачка сначала
+фиксируется в архиве, затем удаляется из оперативной таблицы, поэтому
+прерванный перенос можно безопасно запустить повторно.
+"""
+import heapq
+from functools import total_ordering
+from itertools import islice
+
+from django.db import router, transaction
+
+from . import events
+from .models import Delivery, ArchivedDelivery, ArchivedDeliveryService, DeliveryTombstone
+from .storage import add_references
+from .sync import suppress_tombstones, record_tombstones
+
+
+DELIVERY_COLUMNS = [field.attname for field in Delivery._meta.concrete_fields]
+
+
+def get_archive_database():
+    """
+    Возвращает псевдоним базы, в которой хранятся архивные доставки
+    """
+    return router.db_for_write(ArchivedDelivery)
+
+
+def archive_chunk(queryset, delivery_ids):
+    """
+    Переносит доставки с указанными id и их услуги в архив
+
+    queryset - условия отбора доставок для архивации. Они проверяются
+    повторно уже внутри транзакции (строки блокируются select_for_update),
+    поэтому доставка, измененная после выбора id, не переносится.
+
+    Возвращает количество перенесенных доставок. Если архив находится
+    в основной базе, вставка и удаление выполняются в одной транзакции;
+    если в отдельной - архивная транзакция фиксируется раньше удаления.
+    """
+    archive_db = get_archive_database()
+    with transaction.atomic():
+        rows = list(
+            queryset.filter(id__in=delivery_ids).select_for_update().order_by().values(*DELIVERY_COLUMNS)
+        )
+        if not rows:
+            return 0
+
+        ids = [row['id'] for row in rows]
+        links = Delivery.services.through.objects.filter(
+            delivery_id__in=ids
+        ).values_list('delivery_id', 'service_id')
+
+        with transaction.atomic(using=archive_db):
+            ArchivedDelivery.objects.using(archive_db).bulk_create(
+                [ArchivedDelivery(**row) for row in rows],
+                ignore_conflicts=True,
+            )
+            ArchivedDeliveryService.objects.using(archive_db).bulk_create(
+                [
+                    ArchivedDeliveryService(delivery_id=delivery_id, service_id=service_id)
+                    for delivery_id, service_id in links
+                ],
+                ignore_conflicts=True,
+            )
+        with suppress_tombstones():
+            Delivery.objects.filter(id__in=ids).delete()
+        # Клиенты синхронизации удаляют перенесенные доставки из локальных копий
+        record_tombstones(
+            [(row['id'], row['number']) for row in rows], reason=DeliveryTombstone.REASON_ARCHIVED
+        )
+        payloads = [
+            {
+                'id': row['id'],
+                'number': row['number'],
+                'status': row['status_id'],
+                'transport_model': row['transport_model_id'],
+                'reason': DeliveryTombstone.REASON_ARCHIVED,
+            }
+            for row in rows
+        ]
+        transaction.on_commit(lambda: events.publish_many(events.EVENT_DELETED, payloads))
+        # Удаление из оперативной таблицы уменьшило счетчики ссылок медиа-файлов,
+        # но архивные копии продолжают ссылаться на те же блобы
+        add_references([row['media_file'] for row in rows])
+
+    return len(ids)
+
+
+@total_ordering
+class _Descending:
+    """
+    Обертка значения для сортировки по убыванию в ключе heapq.merge
+    """
+    __slots__ = ('value',)
+
+    def __init__(self, value):
+        self.value = value
+
+    def __eq__(self, other):
+        return self.value == other.value
+
+    def __lt__(self, other):
+        return other.value < self.value
+
+
+class HotColdResults:
+    """
+    Объединение оперативных и архивных доставок в общем порядке сортировки
+
+    Поддерживает count() и срезы, поэтому подходит для стандартной
+    пагинации DRF. Обе части сортируются сортировкой запроса (с id для
+    однозначности), срез собирается слиянием первых stop записей каждой
+    части - стоимость страницы растет с ее номером. Поля сортировки
+    должны быть загружены в обоих запросах и не содержать NULL.
+    """
+
+    def __init__(self, hot, cold):
+        ordering = list(hot.query.order_by or hot.model._meta.ordering)
+        if not {'id', 'pk', '-id', '-pk'} & set(ordering):
+            ordering.append('pk')
+        self.hot = hot.order_by(*ordering)
+        self.cold = cold.order_by(*ordering)
+        self.ordering = [
+            (name.lstrip('-'), name.startswith('-')) for name in ordering
+        ]
+        self._hot_count = None
+        self._cold_count = None
+
+    def count(self):
+        if self._hot_count is None:
+            self._hot_count = self.hot.count()
+            self._cold_count = self.cold.count()
+        return self._hot_count + self._cold_count
+
+    def __len__(self):
+        return self.count()
+
+    def _sort_key(self, obj):
+        return tuple(
+            _Descending(getattr(obj, name)) if descending else getattr(obj, name)
+            for name, descending in self.ordering
+        )
+
+    def __getitem__(self, item):
+        if not isinstance(item, slice):
+            return self[item:item + 1][0]
+
+        start = item.start or 0
+        stop = item.stop if item.stop is not None else self.count()
+        if stop <= start:
+            return []
+        merged = heapq.merge(self.hot[:stop], self.cold[:stop], key=self._sort_key)
+        return list(islice(merged, start, stop))
@@ -0,0 +1,54 @@
+"""
+Вспомогательные функции для нагрузочных замеров
+
+Используются management-командами bench_* для подсчета перцентилей
+задержки и подготовки пользователя, от имени которого выполняются запросы.
+"""
+import math
+
+from django.contrib.auth.models import User
+
+
+BENCHMARK_USERNAME = 'benchmark'
+
+
+def percentile(values, pct):
+    """
+    Возвращает перцентиль pct (0-100) по методу ближайшего ранга
+    """
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    rank = max(1, math.ceil(pct / 100 * len(ordered)))
+    return ordered[rank - 1]
+
+
+def summarize_latencies(latencies, elapsed=None):
+    """
+    Сводка по списку задержек в секундах: перцентили в миллисекундах
+    и пропускная способность, если известно общее время замера
+    """
+    summary = {
+        'requests': len(latencies),
+        'p50_ms': round(percentile(latencies, 50) * 1000, 2),
+        'p95_ms': round(percentile(latencies, 95) * 1000, 2),
+        'p99_ms': round(percentile(latencies, 99) * 1000, 2),
+        'max_ms': round(max(latencies, default=0) * 1000, 2),
+    }
+    if elapsed:
+        summary['throughput_rps'] = round(len(latencies) / elapsed, 2)
+    return summary
+
+
+def get_benchmark_user():
+    """
+    Возвращает служебного пользователя для замеров (создает при отсутствии)
+    """
+    user, created = User.objects.get_or_create(
+        username=BENCHMARK_USERNAME,
+        defaults={'is_staff': True},
+    )
+    if created:
+        user.set_unusable_password()
+        user.save(update_fields=['password'])
+    return user
@@ -0,0 +1,270 @@
+"""
+Уменьшенные копии изображений доставок (миниатюры и превью)
+
+После сохранения доставки с новым изображением его имя ставится в очередь,
+которую разбирает фоновый поток процесса, - запрос не ждет обработки.
+Копии строятся Pillow с учетом EXIF-ориентации и сохраняются на диск рядом
+с медиа-файлами под именем, зависящим только от исходного файла, поэтому
+повторная обработка не нужна. Для блобов хранилища с адресацией по
+содержимому копии общие у всех доставок с одинаковым файлом.
+
+Если очередь переполнена или процесс был перезапущен, недостающие копии
+строит команда build_media_derivatives.
+
+Копии строятся за один проход, и последней записывается самая маленькая,
+поэтому ее наличие означает, что построены все. Источники с построенными
+копиями запоминаются в процессе - список доставок не проверяет файлы копий
+на диске для уже известных изображений.
+"""
+import hashlib
+import io
+import logging
+import os
+import queue
+import threading
+
+from django.conf import settings
+from PIL import Image, ImageOps, features
+
+from .storage import get_delivery_media_storage, is_blob_name
+
+
+logger = logging.getLogger(__name__)
+
+DERIVATIVES_PREFIX = 'delivery_files/derivatives'
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.webp', '.gif', '.bmp', '.tif', '.tiff')
+
+# Имя копии -> (максимальные ширина и высота, формат). Копии строятся
+# от большей к меньшей, каждая следующая - из предыдущей
+DERIVATIVE_SPECS = {
+    'preview': ((1280, 1280), 'JPEG'),
+    'thumbnail': ((320, 320), 'WEBP'),
+    'thumbnail_small': ((96, 96), 'WEBP'),
+}
+FORMAT_EXTENSIONS = {'JPEG': 'jpg', 'WEBP': 'webp'}
+# Копия, которая записывается последней
+LAST_SPEC = min(DERIVATIVE_SPECS, key=lambda spec: DERIVATIVE_SPECS[spec][0][0])
+
+# Ограничение количества источников, для которых запомнено, что копии построены
+BUILT_LIMIT = 10000
+
+_built = set()
+_built_lock = threading.Lock()
+
+
+def is_image(name):
+    return bool(name) and os.path.splitext(name)[1].lower() in IMAGE_EXTENSIONS
+
+
+def _get_format(image_format):
+    if image_format == 'WEBP' and not features.check('webp'):
+        return 'JPEG'
+    return image_format
+
+
+def _source_key(name):
+    if is_blob_name(name):
+        # Имя блоба уже содержит хэш содержимого
+        return os.path.splitext(os.path.basename(name))[0]
+    return hashlib.sha256(name.encode()).hexdigest()
+
+
+def derivative_name(name, spec):
+    """
+    Возвращает имя копии изображения в хранилище
+    """
+    image_format = _get_format(DERIVATIVE_SPECS[spec][1])
+    key = _source_key(name)
+    return f'{DERIVATIVES_PREFIX}/{key[:2]}/{key}/{spec}.{FORMAT_EXTENSIONS[image_format]}'
+
+
+def _mark_built(key):
+    with _built_lock:
+        if len(_built) >= BUILT_LIMIT:
+            _built.clear()
+        _built.add(key)
+
+
+def has_derivatives(name):
+    """
+    Проверяет, построены ли копии изображения
+    """
+    if not is_image(name):
+        return False
+    key = _source_key(name)
+    if key in _built:
+        return True
+    storage = get_delivery_media_storage()
+    if not os.path.exists(storage.path(derivative_name(name, LAST_SPEC))):
+        return False
+    _mark_built(key)
+    return True
+
+
+def get_derivative_names(name):
+    """
+    Возвращает имена построенных копий изображения: {вид: имя}
+    """
+    if not has_derivatives(name):
+        return {}
+    return {spec: derivative_name(name, spec) for spec in DERIVATIVE_SPECS}
+
+
+def get_derivative_urls(name, filename_stem, request=None):
+    """
+    Возвращает подписанные ссылки на построенные копии изображения: {вид: ссылка}
+    """
+    from .downloads import sign_media_urls
+
+    names = get_derivative_names(name)
+    if not names:
+        return {}
+    # Одна проверка срока действия и один префикс ссылки на все копии
+    urls = sign_media_urls([
+        (path, f'{filename_stem}-{spec}{os.path.splitext(path)[1]}') for spec, path in names.items()
+    ])
+    if request is not None:
+        urls = [request.build_absolute_uri(url) for url in urls]
+    return dict(zip(names, urls))
+
+
+def delete_derivatives(name):
+    """
+    Удаляет все копии изображения
+    """
+    with _built_lock:
+        _built.discard(_source_key(name))
+    storage = get_delivery_media_storage()
+    for spec in DERIVATIVE_SPECS:
+        path = storage.path(derivative_name(name, spec))
+        if os.path.exists(path):
+            os.remove(path)
+    try:
+        os.rmdir(os.path.dirname(storage.path(derivative_name(name, next(iter(DERIVATIVE_SPECS))))))
+    except OSError:
+        pass
+
+
+def _encode(image, image_format):
+    buffer = io.BytesIO()
+    if image_format == 'JPEG':
+        image.convert('RGB').save(buffer, 'JPEG', quality=settings.DELIVERY_DERIVATIVE_QUALITY, optimize=True, progressive=True)
+    else:
+        image.save(buffer, image_format, quality=settings.DELIVERY_DERIVATIVE_QUALITY, method=4)
+    return buffer.getvalue()
+
+
+def generate_derivatives(name, force=False):
+    """
+    Строит недостающие копии изображения и возвращает количество построенных
+    """
+    if not is_image(name):
+        return 0
+
+    storage = get_delivery_media_storage()
+    targets = {spec: derivative_name(name, spec) for spec in DERIVATIVE_SPECS}
+    if not force:
+        targets = {spec: path for spec, path in targets.items() if not os.path.exists(storage.path(path))}
+    if not targets:
+        _mark_built(_source_key(name))
+        return 0
+
+    largest = max(size for size, _ in DERIVATIVE_SPECS.values())
+    with storage.open(name, 'rb') as source:
+        image = Image.open(source)
+        # Для JPEG декодер сразу уменьшает изображение кратно 1/2..1/8
+        image.draft(None, largest)
+        image = ImageOps.exif_transpose(image)
+        if image.mode not in ('RGB', 'RGBA'):
+            image = image.convert('RGBA' if 'transparency' in image.info or image.mode in ('LA', 'PA') else 'RGB')
+
+        ordered = sorted(DERIVATIVE_SPECS.items(), key=lambda item: -item[1][0][0])
+        for spec, (size, image_format) in ordered:
+            image.thumbnail(size, Image.Resampling.LANCZOS)
+            if spec in targets:
+                _save(storage, targets[spec], _encode(image, _get_format(image_format)))
+
+    _mark_built(_source_key(name))
+    return len(targets)
+
+
+def _save(storage, name, data):
+    """
+    Записывает копию атомарно, минуя переименование блобов хранилища
+    """
+    path = storage.path(name)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    temp_path = f'{path}.{os.getpid()}.{threading.get_ident()}.part'
+    with open(temp_path, 'wb') as output:
+        output.write(data)
+    os.replace(temp_path, path)
+
+
+class DerivativeQueue:
+    """
+    Очередь построения копий, обрабатываемая фоновым потоком процесса
+    """
+
+    def __init__(self, max_size):
+        self._queue = queue.Queue(maxsize=max_size)
+        self._thread = None
+        self._lock = threading.Lock()
+
+    def _ensure_worker(self):
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name='delivery-derivatives', daemon=True)
+                self._thread.start()
+
+    def put(self, name):
+        self._ensure_worker()
+        try:
+            self._queue.put_nowait(name)
+        except queue.Full:
+            logger.warning('Очередь построения копий переполнена, пропущен файл %s', name)
+
+    def join(self):
+        self._queue.join()
+
+    def _run(self):
+        while True:
+            name = self._queue.get()
+            try:
+                generate_derivatives(name)
+            except Exception:
+                logger.exception('Не удалось построить копии изображения %s', name)
+            finally:
+                self._queue.task_done()
+
+
+_queue = None
+_queue_lock = threading.Lock()
+
+
+def get_queue():
+    global _queue
+    with _queue_lock:
+        if _queue is None:
+            _queue = DerivativeQueue(settings.DELIVERY_DERIVATIVE_QUEUE_SIZE)
+        return _queue
+
+
+def schedule_derivatives(name):
+    """
+    Ставит изображение в очередь построения копий (или строит сразу,
+    если фоновая обработка отключена)
+    """
+    if not is_image(name):
+        return
+    if settings.DELIVERY_DERIVATIVES_ASYNC:
+        get_queue().put(name)
+    else:
+        generate_derivatives(name)
+
+
+def schedule_derivatives_many(names):
+    """
+    Ставит в очередь построения копий несколько изображений
+    """
+    for name in dict.fromkeys(names):
+        schedule_derivatives(name)
@@ -0,0 +1,250 @@
+"""
+Выдача медиа-файлов доставок
+
+Права проверяются один раз - в действии download представления доставок
+или при выдаче подписанной ссылки. Дальше файл отдается без копирования
+в память: FileResponse передает открытый файл WSGI-серверу, который
+использует os.sendfile (gunicorn, uWSGI), либо отдача целиком передается
+веб-серверу заголовком X-Accel-Redirect (nginx) или X-Sendfile (Apache).
+
+Поддерживаются запросы диапазона (Range, If-Range) и условные заголовки
+(If-None-Match, If-Modified-Since). Подписанная ссылка содержит имя файла,
+срок действия и HMAC от них, поэтому ее проверка не требует аутентификации
+и обращения к базе.
+"""
+import hashlib
+import hmac
+import mimetypes
+import os
+import re
+import time
+from functools import lru_cache
+from urllib.parse import quote, urlencode
+
+from django.conf import settings
+from django.http import FileResponse, HttpResponse
+from django.urls import get_script_prefix, reverse
+from django.utils.cache import get_conditional_response, patch_cache_control
+from django.utils.http import RFC3986_SUBDELIMS, http_date, parse_http_date_safe
+
+from .storage import CAS_PREFIX, get_delivery_media_storage
+
+
+SIGNATURE_SALT = 'delivery_core.downloads'
+RANGE_RE = re.compile(r'^bytes=(\d*)-(\d*)$')
+
+
+def get_signed_url_ttl():
+    return getattr(settings, 'DELIVERY_MEDIA_URL_TTL', 3600)
+
+
+@lru_cache(maxsize=4)
+def _base_hmac(secret):
+    # То же, что salted_hmac, но ключ вычисляется один раз на SECRET_KEY
+    key = hashlib.sha256((SIGNATURE_SALT + secret).encode()).digest()
+    return hmac.new(key, digestmod=hashlib.sha256)
+
+
+def _signature(name, expires, filename):
+    signer = _base_hmac(settings.SECRET_KEY).copy()
+    signer.update(f'{name}\n{expires}\n{filename}'.encode())
+    return signer.hexdigest()
+
+
+@lru_cache(maxsize=16)
+def _url_prefix(script_prefix):
+    # Префикс ссылки без имени файла: reverse выполняется один раз
+    # на префикс скрипта (SCRIPT_NAME), который входит в ключ кэша
+    return reverse('delivery-media-signed', kwargs={'name': '_'})[:-1]
+
+
+def _media_url(name):
+    # Экранирование совпадает с reverse для конвертера path
+    return _url_prefix(get_script_prefix()) + quote(name, safe=RFC3986_SUBDELIMS + '/~:@')
+
+
+def sign_media_urls(files, ttl=None):
+    """
+    Возвращает подписанные ссылки с общим сроком действия на несколько
+    файлов: [(имя, имя для скачивания)] -> [ссылка]
+    """
+    expires = int(time.time()) + (ttl or get_signed_url_ttl())
+    urls = []
+    for name, filename in files:
+        query = urlencode({
+            'expires': expires,
+            'filename': filename,
+            'signature': _signature(name, expires, filename),
+        })
+        urls.append(f'{_media_url(name)}?{query}')
+    return urls
+
+
+def sign_media_url(name, filename, ttl=None):
+    """
+    Возвращает подписанную ссылку на файл и время окончания ее действия
+    """
+    expires = int(time.time()) + (ttl or get_signed_url_ttl())
+    query = urlencode({
+        'expires': expires,
+        'filename': filename,
+        'signature': _signature(name, expires, filename),
+    })
+    return f'{_media_url(name)}?{query}', expires
+
+
+def check_signature(name, expires, filename, signature):
+    """
+    Проверяет подпись и срок действия ссылки
+    """
+    try:
+        expires = int(expires)
+    except (TypeError, ValueError):
+        return False
+    if expires < time.time():
+        return False
+    return hmac.compare_digest(_signature(name, expires, filename), signature or '')
+
+
+def _make_etag(name, size, modified):
+    if name.startswith(CAS_PREFIX + '/'):
+        # Имя блоба уже содержит хэш содержимого
+        return '"%s"' % os.path.splitext(os.path.basename(name))[0]
+    return '"%x-%x"' % (int(modified), size)
+
+
+def _parse_range(header, size):
+    """
+    Возвращает (начало, конец) одного диапазона байт, None для всего файла
+    или False для недопустимого диапазона
+    """
+    match = RANGE_RE.match(header.replace(' ', ''))
+    if not match:
+        # Несколько диапазонов и другие единицы не поддерживаются - отдаем файл целиком
+        return None
+    start, end = match.groups()
+    if not start:
+        if not end or int(end) == 0:
+            return False
+        length = min(int(end), size)
+        return size - length, size - 1
+    start = int(start)
+    end = min(int(end), size - 1) if end else size - 1
+    if start >= size or start > end:
+        return False
+    return start, end
+
+
+def _if_range_matches(request, etag, modified):
+    value = request.headers.get('If-Range')
+    if not value:
+        return True
+    if value.startswith(('"', 'W/')):
+        return value == etag
+    date = parse_http_date_safe(value)
+    return date is not None and int(modified) <= date
+
+
+class _RangeFile:
+    """
+    Файл, ограниченный диапазоном байт
+
+    Метод fileno позволяет WSGI-серверу отдать диапазон через os.sendfile:
+    сервер начинает с текущей позиции файла и передает Content-Length байт.
+    """
+
+    def __init__(self, file, start, length):
+        self.file = file
+        self.file.seek(start)
+        self.remaining = length
+
+    def read(self, size=-1):
+        if self.remaining <= 0:
+            return b''
+        if size is None or size < 0 or size > self.remaining:
+            size = self.remaining
+        data = self.file.read(size)
+        self.remaining -= len(data)
+        return data
+
+    def fileno(self):
+        return self.file.fileno()
+
+    def close(self):
+        self.file.close()
+
+
+def _accel_response(name, content_type):
+    """
+    Передает отдачу файла веб-серверу (X-Accel-Redirect или X-Sendfile)
+    """
+    mode = getattr(settings, 'DELIVERY_MEDIA_ACCEL', '')
+    response = HttpResponse(content_type=content_type)
+    if mode == 'x-accel':
+        prefix = getattr(settings, 'DELIVERY_MEDIA_ACCEL_PREFIX', '/protected-media/')
+        response['X-Accel-Redirect'] = prefix.rstrip('/') + '/' + quote(name)
+    else:
+        response['X-Sendfile'] = get_delivery_media_storage().path(name)
+    return response
+
+
+def serve_media(request, name, filename, cache_seconds=0):
+    """
+    Отдает файл из хранилища медиа-файлов доставок
+
+    Возвращает 304/412 для условных запросов, 206 для допустимого диапазона,
+    416 для недопустимого и 200 с файлом целиком в остальных случаях.
+    """
+    storage = get_delivery_media_storage()
+    content_type = mimetypes.guess_type(filename)[0] or 'application/octet-stream'
+    disposition = f"attachment; filename*=UTF-8''{quote(filename)}"
+
+    if getattr(settings, 'DELIVERY_MEDIA_ACCEL', ''):
+        # Range и условные заголовки обработает веб-сервер
+        response = _accel_response(name, content_type)
+        response['Content-Disposition'] = disposition
+        _patch_cache(response, cache_seconds)
+        return response
+
+    size = storage.size(name)
+    modified = storage.get_modified_time(name).timestamp()
+    etag = _make_etag(name, size, modified)
+
+    response = get_conditional_response(request, etag=etag, last_modified=int(modified))
+    if response is not None:
+        _patch_cache(response, cache_seconds)
+        return response
+
+    byte_range = None
+    range_header = request.headers.get('Range')
+    if range_header and request.method == 'GET' and _if_range_matches(request, etag, modified):
+        byte_range = _parse_range(range_header, size)
+        if byte_range is False:
+            response = HttpResponse(status=416)
+            response['Content-Range'] = f'bytes */{size}'
+            return response
+
+    file = storage.open(name, 'rb')
+    if byte_range:
+        start, end = byte_range
+        length = end - start + 1
+        response = FileResponse(_RangeFile(file, start, length), status=206, content_type=content_type)
+        response['Content-Range'] = f'bytes {start}-{end}/{size}'
+    else:
+        length = size
+        response = FileResponse(file, content_type=content_type)
+
+    response['Content-Length'] = str(length)
+    response['Content-Disposition'] = disposition
+    response['Accept-Ranges'] = 'bytes'
+    response['ETag'] = etag
+    response['Last-Modified'] = http_date(modified)
+    _patch_cache(response, cache_seconds)
+    return response
+
+
+def _patch_cache(response, cache_seconds):
+    if cache_seconds > 0:
+        patch_cache_control(response, private=True, max_age=int(cache_seconds))
+    else:
+        patch_cache_control(response, private=True, no_cache=True)
@@ -0,0 +1,265 @@
+"""
+Рассылка событий изменения доставок подписчикам (SSE и WebSocket)
+
+Сигналы модели Delivery после фиксации транзакции публикуют события
+created, updated, status_changed и deleted. Подписчики - открытые
+соединения потока событий - получают их через очередь asyncio в цикле
+событий своего процесса. Простаивающее соединение занимает только
+корутину и очередь, поэтому процесс ASGI-сервера держит тысячи
+соединений без отдельных потоков.
+
+DELIVERY_EVENTS_BACKEND:
+- local - события доходят только до подписчиков процесса, в котором
+  произошло изменение (один процесс или общий воркер);
+- database - события записываются в таблицу DeliveryEvent, каждый процесс
+  опрашивает ее раз в DELIVERY_EVENTS_POLL_INTERVAL секунд и рассылает
+  новые события своим подписчикам.
+
+Доставка событий не гарантирована: медленному подписчику, очередь которого
+переполнилась, отправляется событие overflow, и соединение закрывается.
+После переподключения клиент догоняет изменения через /deliveries/sync/.
+"""
+import asyncio
+import itertools
+import json
+import threading
+from collections import namedtuple
+
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db.models import Max
+from django.utils import timezone
+
+
+EVENT_CREATED = 'created'
+EVENT_UPDATED = 'updated'
+EVENT_STATUS_CHANGED = 'status_changed'
+EVENT_DELETED = 'deleted'
+EVENT_OVERFLOW = 'overflow'
+
+# data - готовый JSON события: кодируется один раз для всех подписчиков
+ChangeEvent = namedtuple('ChangeEvent', 'id kind status previous_status transport_model data')
+
+OVERFLOW = ChangeEvent(None, EVENT_OVERFLOW, None, None, None, json.dumps({'event': EVENT_OVERFLOW}))
+
+PURGE_EVERY_POLLS = 100
+
+_local_ids = itertools.count(1)
+
+
+def make_event(kind, payload, event_id=None):
+    """
+    Создает событие из словаря с данными доставки
+    """
+    return ChangeEvent(
+        event_id if event_id is not None else next(_local_ids),
+        kind,
+        payload.get('status'),
+        payload.get('previous_status'),
+        payload.get('transport_model'),
+        json.dumps({'event': kind, **payload}, cls=DjangoJSONEncoder, ensure_ascii=False),
+    )
+
+
+def delivery_payload(delivery, previous_status=None):
+    """
+    Данные доставки, передаваемые в событии
+    """
+    payload = {
+        'id': delivery.pk,
+        'number': delivery.number,
+        'status': delivery.status_id,
+        'transport_model': delivery.transport_model_id,
+        'updated_at': delivery.updated_at,
+    }
+    if previous_status is not None:
+        payload['previous_status'] = previous_status
+    return payload
+
+
+class Subscription:
+    """
+    Подписка одного соединения на события
+
+    statuses и transport_models - множества id для фильтрации (пустое
+    множество - без фильтра). Событие смены статуса проходит фильтр и
+    по прежнему статусу, чтобы клиент узнал об уходе доставки из выборки.
+    """
+
+    def __init__(self, loop, statuses=(), transport_models=(), queue_size=None):
+        self.loop = loop
+        self.statuses = set(statuses)
+        self.transport_models = set(transport_models)
+        self.queue = asyncio.Queue(queue_size or settings.DELIVERY_EVENTS_QUEUE_SIZE)
+
+    def set_filters(self, statuses=(), transport_models=()):
+        self.statuses = set(statuses)
+        self.transport_models = set(transport_models)
+
+    def matches(self, event):
+        if self.statuses and event.status not in self.statuses and event.previous_status not in self.statuses:
+            return False
+        if self.transport_models and event.transport_model not in self.transport_models:
+            return False
+        return True
+
+    def put(self, event):
+        """
+        Кладет событие в очередь (вызывается в цикле событий подписки)
+        """
+        if not self.matches(event):
+            return
+        try:
+            self.queue.put_nowait(event)
+        except asyncio.QueueFull:
+            # Подписчик не успевает - остальные события ему уже не нужны
+            while not self.queue.empty():
+                self.queue.get_nowait()
+            self.queue.put_nowait(OVERFLOW)
+
+    async def get(self, timeout):
+        """
+        Ждет следующее событие; None, если за timeout секунд событий не было
+        """
+        try:
+            return await asyncio.wait_for(self.queue.get(), timeout)
+        except asyncio.TimeoutError:
+            return None
+
+
+class EventBroker:
+    """
+    Рассылка событий подписчикам процесса
+
+    Публикация возможна из любого потока: события передаются в цикл событий
+    подписчиков одним вызовом call_soon_threadsafe на цикл, а фильтрация
+    выполняется уже в цикле.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._subscribers = {}
+        self._pollers = {}
+
+    @property
+    def subscriber_count(self):
+        with self._lock:
+            return sum(len(subscribers) for subscribers in self._subscribers.values())
+
+    def subscribe(self, statuses=(), transport_models=()):
+        """
+        Создает подписку в текущем цикле событий
+        """
+        loop = asyncio.get_running_loop()
+        subscription = Subscription(loop, statuses, transport_models)
+        with self._lock:
+            self._subscribers.setdefault(loop, set()).add(subscription)
+        if settings.DELIVERY_EVENTS_BACKEND == 'database':
+            self._ensure_poller(loop)
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self._lock:
+            subscribers = self._subscribers.get(subscription.loop)
+            if subscribers is not None:
+                subscribers.discard(subscription)
+                if not subscribers:
+                    del self._subscribers[subscription.loop]
+
+    def dispatch(self, events):
+        """
+        Передает события подписчикам всех циклов событий процесса
+        """
+        with self._lock:
+            targets = [(loop, tuple(subscribers)) for loop, subscribers in self._subscribers.items()]
+        for loop, subscribers in targets:
+            if loop.is_closed():
+                continue
+            loop.call_soon_threadsafe(_deliver, subscribers, events)
+
+    def _ensure_poller(self, loop):
+        with self._lock:
+            task = self._pollers.get(loop)
+            if task is None or task.done():
+                self._pollers[loop] = loop.create_task(self._poll(loop))
+
+    def _has_subscribers(self, loop):
+        with self._lock:
+            return bool(self._subscribers.get(loop))
+
+    async def _poll(self, loop):
+        """
+        Читает новые события из таблицы, пока в цикле есть подписчики
+        """
+        from .models import DeliveryEvent
+
+        last_id = (await DeliveryEvent.objects.aaggregate(last=Max('id')))['last'] or 0
+        for polls in itertools.count(1):
+            await asyncio.sleep(settings.DELIVERY_EVENTS_POLL_INTERVAL)
+            if not self._has_subscribers(loop):
+                return
+            rows = [
+                row async for row in DeliveryEvent.objects.filter(id__gt=last_id).order_by('id')[:1000]
+            ]
+            if rows:
+                last_id = rows[-1].id
+                events = [make_event(row.kind, row.payload, event_id=row.id) for row in rows]
+                with self._lock:
+                    subscribers = tuple(self._subscribers.get(loop, ()))
+                _deliver(subscribers, events)
+            if polls % PURGE_EVERY_POLLS == 0:
+                cutoff = timezone.now() - timezone.timedelta(seconds=settings.DELIVERY_EVENTS_RETENTION_SECONDS)
+                await DeliveryEvent.objects.filter(created_at__lt=cutoff).adelete()
+
+
+def _deliver(subscribers, events):
+    for subscription in subscribers:
+        for event in events:
+            subscription.put(event)
+
+
+broker = EventBroker()
+
+
+def publish(kind, payload):
+    """
+    Публикует событие изменения доставки
+
+    Вызывается после фиксации транзакции (см. delivery_core.signals).
+    """
+    if settings.DELIVERY_EVENTS_BACKEND == 'database':
+        from .models import DeliveryEvent
+
+        DeliveryEvent.objects.create(kind=kind, delivery_id=payload['id'], payload=json.loads(
+            json.dumps(payload, cls=DjangoJSONEncoder)
+        ))
+        return
+    broker.dispatch([make_event(kind, payload)])
+
+
+def publish_many(kind, payloads):
+    """
+    Публикует пачку однотипных событий (например, после массового создания)
+    """
+    if not payloads:
+        return
+    if settings.DELIVERY_EVENTS_BACKEND == 'database':
+        from .models import DeliveryEvent
+
+        DeliveryEvent.objects.bulk_create([
+            DeliveryEvent(kind=kind, delivery_id=payload['id'], payload=json.loads(
+                json.dumps(payload, cls=DjangoJSONEncoder)
+            ))
+            for payload in payloads
+        ])
+        return
+    broker.dispatch([make_event(kind, payload) for payload in payloads])
+
+
+def parse_id_list(value):
+    """
+    Разбирает список id через запятую ("1,2,3"); ValueError при ошибке
+    """
+    if not value:
+        return set()
+    return {int(item) for item in str(value).split(',') if item.strip()}
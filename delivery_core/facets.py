@@ -0,0 +1,73 @@
+"""
+Фасетные счетчики списка доставок (?facets=status,transport_model,...)
+
+Счетчики считаются по тому же отфильтрованному набору доставок, что и
+список. Все запрошенные фасеты считаются одним запросом с группировкой по
+сочетанию их полей (GROUP BY status_id, transport_model_id, ...), а
+счетчики по каждому полю суммируются из строк этого запроса. Названия
+справочников подставляются из кэша (references.cache), без JOIN.
+"""
+from collections import Counter
+
+from django.db.models import Count
+from rest_framework.exceptions import ValidationError
+
+from references.cache import get_reference_names
+from references.models import CargoType, DeliveryStatus, PackagingType, TransportModel
+
+
+# Фасет -> справочник (None - значение поля без справочника)
+FACET_FIELDS = {
+    'status': DeliveryStatus,
+    'transport_model': TransportModel,
+    'packaging': PackagingType,
+    'cargo_type': CargoType,
+    'condition': None,
+}
+
+
+def parse_facets(value):
+    """
+    Разбирает список фасетов из параметра запроса; ValidationError при ошибке
+    """
+    facets = [name.strip() for name in (value or '').split(',') if name.strip()]
+    unknown = sorted(set(facets) - set(FACET_FIELDS))
+    if unknown:
+        raise ValidationError({'facets': f'Неизвестные фасеты: {", ".join(unknown)}'})
+    return list(dict.fromkeys(facets))
+
+
+def _column(facet):
+    return f'{facet}_id' if FACET_FIELDS[facet] is not None else facet
+
+
+def count_facets(facets, *querysets):
+    """
+    Возвращает счетчики фасетов по наборам доставок (оперативным и архивным)
+
+    Результат: {фасет: [{"id", "name", "count"}, ...]} для справочников и
+    {фасет: [{"value", "count"}, ...]} для остальных полей, по убыванию count.
+    """
+    columns = [_column(facet) for facet in facets]
+    counters = {facet: Counter() for facet in facets}
+    for queryset in querysets:
+        # DISTINCT (например, после фильтра по услугам) сохраняется в подсчете
+        count = Count('pk', distinct=queryset.query.distinct)
+        rows = queryset.order_by().prefetch_related(None).values_list(*columns).annotate(facet_count=count)
+        for *values, total in rows:
+            for facet, value in zip(facets, values):
+                counters[facet][value] += total
+
+    result = {}
+    for facet in facets:
+        model = FACET_FIELDS[facet]
+        ordered = sorted(counters[facet].items(), key=lambda item: (-item[1], str(item[0])))
+        if model is None:
+            result[facet] = [{'value': value, 'count': total} for value, total in ordered]
+            continue
+        names = get_reference_names(model)
+        result[facet] = [
+            {'id': value, 'name': names.get(value), 'count': total}
+            for value, total in ordered
+        ]
+    return result
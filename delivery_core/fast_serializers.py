@@ -0,0 +1,200 @@
+"""
+Быстрое чтение списков доставок без ModelSerializer
+
+Набор полей сериализатора один раз компилируется в функцию, которая
+превращает кортеж values_list() в словарь ответа той же формы, что и
+у исходного сериализатора. Экземпляры моделей и связанных объектов не
+создаются, а преобразование значений выполняют to_representation тех же
+полей DRF, поэтому формат дат, десятичных чисел и выбора совпадает.
+
+Поддерживаются поля модели, первичные ключи связей, поля связанных
+моделей через source ("transport_model.name") и поля-методы, для которых
+в method_field_sources сериализатора перечислены используемые поля
+модели: метод вызывается с легким объектом строки вместо экземпляра модели
+(у объекта строки есть атрибуты-значения и методы класса модели).
+Если набор полей не компилируется (например, вложенный список услуг),
+compile_serializer выбрасывает NotCompilable и используется обычный путь.
+"""
+import inspect
+import threading
+from collections import OrderedDict
+
+from django.conf import settings
+from django.utils import timezone
+from rest_framework import ISO_8601, serializers
+from rest_framework.relations import PrimaryKeyRelatedField
+from rest_framework.settings import api_settings
+
+
+MAX_COMPILED = 64
+
+
+class NotCompilable(Exception):
+    """
+    Набор полей сериализатора не поддерживается быстрым путем
+    """
+
+
+class CompiledSerializer:
+    """
+    Скомпилированный сериализатор: columns - аргументы values_list(),
+    convert(row, serializer, tz) - функция строки в словарь
+
+    Поля-методы вызываются у переданного экземпляра сериализатора, поэтому
+    контекст (например, request) берется из текущего запроса.
+    """
+
+    def __init__(self, columns, convert):
+        self.columns = columns
+        self.convert = convert
+
+    def serialize(self, rows, serializer):
+        return list(self.iterate(rows, serializer))
+
+    def iterate(self, rows, serializer):
+        """
+        Преобразует строки по одной (для потоковой выдачи)
+        """
+        convert = self.convert
+        tz = timezone.get_current_timezone() if settings.USE_TZ else None
+        for row in rows:
+            yield convert(row, serializer, tz)
+
+    def serialize_queryset(self, queryset, serializer):
+        return self.serialize(queryset.values_list(*self.columns), serializer)
+
+
+def _make_row_class(model):
+    """
+    Класс объекта строки с методами модели (без полей и менеджеров)
+    """
+    methods = {}
+    for klass in reversed(model.__mro__):
+        methods.update({
+            name: value for name, value in vars(klass).items()
+            if inspect.isfunction(value) and not name.startswith('__')
+        })
+    return type(f'{model.__name__}Row', (), methods)
+
+
+def _iso_datetime(value, tz):
+    """
+    То же, что DateTimeField.to_representation для формата ISO 8601
+    и часового пояса по умолчанию
+    """
+    value = value.astimezone(tz).isoformat()
+    if value.endswith('+00:00'):
+        value = value[:-6] + 'Z'
+    return value
+
+
+def _is_default_datetime(field):
+    return (
+        type(field) is serializers.DateTimeField
+        and settings.USE_TZ
+        and not hasattr(field, 'timezone')
+        and getattr(field, 'format', api_settings.DATETIME_FORMAT) == ISO_8601
+    )
+
+
+def _column(columns, path):
+    if path not in columns:
+        columns.append(path)
+    return columns.index(path)
+
+
+def compile_serializer(serializer):
+    """
+    Компилирует поля экземпляра сериализатора в функцию строки
+    """
+    model = serializer.Meta.model
+    # Первичный ключ выбирается всегда, чтобы distinct() не склеивал строки
+    columns = [model._meta.pk.name]
+    namespace = {'_Row': _make_row_class(model)}
+    items = []
+    lines = []
+
+    for position, (name, field) in enumerate(serializer.fields.items()):
+        if field.write_only:
+            continue
+        if isinstance(field, serializers.SerializerMethodField):
+            sources = getattr(serializer, 'method_field_sources', {}).get(name)
+            if sources is None or any('__' in source for source in sources):
+                raise NotCompilable(name)
+            namespace[f'm{position}'] = getattr(type(serializer), field.method_name)
+            attrs = ', '.join(f"{source!r}: row[{_column(columns, source)}]" for source in sources)
+            lines.append(f'    r{position} = _Row(); r{position}.__dict__.update({{{attrs}}})')
+            items.append(f"{name!r}: m{position}(serializer, r{position})")
+            continue
+
+        if isinstance(field, (
+            serializers.ListSerializer, serializers.ManyRelatedField, serializers.Serializer, serializers.FileField
+        )):
+            raise NotCompilable(name)
+        if field.source == '*':
+            raise NotCompilable(name)
+
+        path = field.source.replace('.', '__')
+        index = _column(columns, path)
+        if isinstance(field, PrimaryKeyRelatedField) and field.pk_field is None:
+            # values_list() уже возвращает значение ключа
+            items.append(f"{name!r}: row[{index}]")
+            continue
+
+        value = f'row[{index}]'
+        if _is_default_datetime(field):
+            namespace['_iso_datetime'] = _iso_datetime
+            items.append(f"{name!r}: None if {value} is None else _iso_datetime({value}, tz)")
+            continue
+
+        namespace[f'f{position}'] = field.to_representation
+        if '__' in path and not field.allow_null:
+            # Как и DRF, поле отсутствует, если связанный объект не задан
+            lines.append(f'    v{position} = {value}')
+            items.append((name, position))
+            continue
+        items.append(f"{name!r}: None if {value} is None else f{position}({value})")
+
+    body = ['def convert(row, serializer, tz):'] + lines + ['    data = {']
+    optional = []
+    for item in items:
+        if isinstance(item, tuple):
+            name, position = item
+            body.append(f"        {name!r}: None,")
+            optional.append(item)
+        else:
+            body.append(f'        {item},')
+    body.append('    }')
+    for name, position in optional:
+        body.append(f'    if v{position} is None:')
+        body.append(f"        del data[{name!r}]")
+        body.append('    else:')
+        body.append(f"        data[{name!r}] = f{position}(v{position})")
+    body.append('    return data')
+
+    exec('\n'.join(body), namespace)
+    return CompiledSerializer(tuple(columns), namespace['convert'])
+
+
+_compiled = OrderedDict()
+_compiled_lock = threading.Lock()
+
+
+def get_compiled_serializer(serializer):
+    """
+    Возвращает скомпилированный сериализатор для класса и набора полей,
+    компилируя его при первом обращении
+    """
+    key = (type(serializer), tuple(serializer.fields))
+    with _compiled_lock:
+        compiled = _compiled.get(key)
+        if compiled is not None:
+            _compiled.move_to_end(key)
+            return compiled
+
+    compiled = compile_serializer(serializer)
+    with _compiled_lock:
+        _compiled[key] = compiled
+        while len(_compiled) > MAX_COMPILED:
+            _compiled.popitem(last=False)
+    return compiled
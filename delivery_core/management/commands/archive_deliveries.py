@@ -0,0 +1,70 @@
+from datetime import datetime, timedelta
+
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+from delivery_core.archive import archive_chunk, get_archive_database
+from delivery_core.models import Delivery
+from references.models import DeliveryStatus
+
+
+class Command(BaseCommand):
+    """
+    Команда для переноса старых выполненных доставок в архив
+
+    Переносит доставки со статусом "completed", отправленные раньше границы
+    архивации, вместе со связями с услугами. Перенос идет пачками по id,
+    каждая пачка - в собственной транзакции, где условия отбора проверяются
+    повторно.
+    """
+    help = 'Переносит выполненные доставки старше заданной даты в архив'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--older-than-days', type=int, default=180, help='Архивировать доставки старше N дней')
+        parser.add_argument('--before', help='Архивировать доставки, отправленные раньше даты YYYY-MM-DD')
+        parser.add_argument('--chunk-size', type=int, default=1000, help='Размер пачки')
+        parser.add_argument('--dry-run', action='store_true', help='Только посчитать доставки для переноса')
+
+    def handle(self, *args, **options):
+        """
+        Основной метод, выполняющий команду
+        """
+        cutoff = self._get_cutoff(options)
+        completed_statuses = list(DeliveryStatus.objects.filter(code='completed').values_list('id', flat=True))
+        if not completed_statuses:
+            raise CommandError("Статус с кодом 'completed' не найден в справочнике")
+
+        queryset = Delivery.objects.filter(
+            status__in=completed_statuses,
+            departure_time__lt=cutoff,
+        ).order_by('id')
+
+        if options['dry_run']:
+            self.stdout.write(f'К переносу в архив: {queryset.count()} доставок (до {cutoff:%Y-%m-%d})')
+            return
+
+        self.stdout.write(f'Перенос доставок до {cutoff:%Y-%m-%d} в базу "{get_archive_database()}"...')
+
+        total = 0
+        last_id = 0
+        while True:
+            ids = list(queryset.filter(id__gt=last_id).values_list('id', flat=True)[:options['chunk_size']])
+            if not ids:
+                break
+            total += archive_chunk(queryset, ids)
+            last_id = ids[-1]
+            self.stdout.write(f'  перенесено {total}')
+
+        self.stdout.write(self.style.SUCCESS(f'Перенесено в архив доставок: {total}'))
+
+    def _get_cutoff(self, options):
+        """
+        Возвращает границу архивации
+        """
+        if options['before']:
+            try:
+                cutoff = datetime.strptime(options['before'], '%Y-%m-%d')
+            except ValueError:
+                raise CommandError('Дата --before должна быть в формате YYYY-MM-DD')
+            return timezone.make_aware(cutoff)
+        return timezone.now() - timedelta(days=options['older_than_days'])
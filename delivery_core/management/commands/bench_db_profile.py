@@ -0,0 +1,91 @@
+import json
+import os
+import subprocess
+import sys
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from rest_framework.test import APIClient
+
+from delivery_core.benchmarking import get_benchmark_user, summarize_latencies
+
+
+ENDPOINTS = {
+    'deliveries_list': '/api/delivery/deliveries/',
+    'deliveries_stats': '/api/delivery/deliveries/stats/',
+    'reports_daily': '/api/reports/delivery-reports/?report_type=daily&start_date=2000-01-01',
+}
+
+
+class Command(BaseCommand):
+    """
+    Замер эндпоинтов при разных профилях подключения к базе данных
+
+    Без параметра --profiles замеряет текущий профиль (DB_PROFILE).
+    С параметром --profiles запускает замер в отдельном процессе для каждого
+    указанного профиля и выводит результаты рядом для сравнения.
+    """
+    help = 'Сравнивает задержку списка доставок и отчетов при разных DB_PROFILE'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--iterations', type=int, default=200, help='Количество запросов к каждому эндпоинту')
+        parser.add_argument('--profiles', nargs='+', help='Профили для сравнения, например: sqlite sqlite_tuned')
+        parser.add_argument('--json', action='store_true', help='Вывести результат одной строкой JSON')
+
+    def handle(self, *args, **options):
+        """
+        Основной метод, выполняющий команду
+        """
+        if options['profiles']:
+            self._compare_profiles(options['profiles'], options['iterations'])
+            return
+
+        result = {'profile': settings.DB_PROFILE, 'endpoints': self._measure(options['iterations'])}
+        if options['json']:
+            self.stdout.write(json.dumps(result))
+        else:
+            self._print_result(result)
+
+    def _measure(self, iterations):
+        """
+        Выполняет запросы к эндпоинтам и возвращает сводку задержек
+        """
+        client = APIClient(HTTP_HOST='localhost')
+        client.force_authenticate(get_benchmark_user())
+
+        results = {}
+        for name, url in ENDPOINTS.items():
+            # Прогревочный запрос не учитывается
+            client.get(url)
+            latencies = []
+            for _ in range(iterations):
+                started = time.perf_counter()
+                response = client.get(url)
+                latencies.append(time.perf_counter() - started)
+                if response.status_code != 200:
+                    raise CommandError(f'{url} вернул статус {response.status_code}')
+            results[name] = summarize_latencies(latencies, sum(latencies))
+        return results
+
+    def _compare_profiles(self, profiles, iterations):
+        """
+        Запускает замер для каждого профиля в отдельном процессе
+        """
+        manage_py = os.path.join(settings.BASE_DIR, 'manage.py')
+        for profile in profiles:
+            # Замер пропускной способности не должен упираться в ограничение отчетов
+            env = dict(os.environ, DB_PROFILE=profile, REPORTS_THROTTLE_ENABLED='False')
+            completed = subprocess.run(
+                [sys.executable, manage_py, 'bench_db_profile',
+                 '--iterations', str(iterations), '--json'],
+                env=env, capture_output=True, text=True,
+            )
+            if completed.returncode != 0:
+                raise CommandError(f'Замер профиля {profile} завершился с ошибкой:\n{completed.stderr}')
+            self._print_result(json.loads(completed.stdout.strip().splitlines()[-1]))
+
+    def _print_result(self, result):
+        self.stdout.write(self.style.SUCCESS(f"Профиль: {result['profile']}"))
+        for name, summary in result['endpoints'].items():
+            self.stdout.write(f'  {name}: {json.dumps(summary)}')
@@ -0,0 +1,254 @@
+import json
+import os
+import platform
+import random
+import statistics
+import subprocess
+import sys
+import time
+import tracemalloc
+from io import StringIO
+
+import django
+from django.conf import settings
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+from django.test.utils import CaptureQueriesContext
+from rest_framework.test import APIClient
+
+from delivery_core.benchmarking import get_benchmark_user, summarize_latencies
+from delivery_core.models import Delivery
+
+
+# Данные генерируются от фиксированной даты, чтобы периоды отчетов и
+# результаты были одинаковыми при каждом заполнении базы
+BENCH_END_DATE = '2025-12-31'
+BENCH_DAYS = 730
+BENCH_PREFIX = 'BENCH'
+
+# Сценарий -> URL ({delivery_id} - доставка из середины таблицы)
+SCENARIOS = {
+    'list': '/api/delivery/deliveries/',
+    'list_page_50': '/api/delivery/deliveries/?page=50',
+    'list_ordering_distance': '/api/delivery/deliveries/?ordering=-distance',
+    'retrieve': '/api/delivery/deliveries/{delivery_id}/',
+    'stats': '/api/delivery/deliveries/stats/',
+    'search': '/api/delivery/deliveries/?search=00123',
+    'filter_services': '/api/delivery/deliveries/?services=1,2',
+    'filter_status_transport': '/api/delivery/deliveries/?status=1&transport_model=2',
+    'filter_distance': '/api/delivery/deliveries/?min_distance=10&max_distance=100',
+    'filter_time_week': '/api/delivery/deliveries/?time_filter=week',
+    'facets': '/api/delivery/deliveries/?facets=status,transport_model,condition',
+    'reports_daily_quarter': '/api/reports/delivery-reports/?report_type=daily&start_date=2025-10-01&end_date=2025-12-31',
+    # Недельные и месячные отчеты группируются через DATE_TRUNC (только PostgreSQL)
+    'reports_daily_year': '/api/reports/delivery-reports/?report_type=daily&start_date=2025-01-01&end_date=2025-12-31',
+}
+
+# Показатели, которые сравниваются с базовой линией
+COMPARED_METRICS = ('p50_ms', 'p95_ms', 'queries', 'peak_memory_kb')
+
+# Количество запросов для замера памяти
+MEMORY_SAMPLES = 3
+
+
+class Command(BaseCommand):
+    """
+    Набор замеров эндпоинтов API с сохранением базовой линии
+
+    Для каждого размера (--sizes) используется отдельная база SQLite в
+    --db-dir (при первом запуске она заполняется setup_references и
+    generate_deliveries с фиксированным --seed и затем переиспользуется).
+    Замер каждого размера выполняется в отдельном процессе. Для каждого
+    сценария (SCENARIOS) через тестовый клиент Django записываются
+    перцентили задержки, количество запросов к базе и пиковая память
+    Python (tracemalloc) на один запрос.
+
+    --save-baseline записывает результат в JSON, --compare сравнивает с
+    сохраненной базовой линией и завершается ошибкой, если задержка или
+    память выросли больше чем на --threshold, а количество запросов
+    увеличилось.
+    """
+    help = 'Замеряет эндпоинты API на базах разного размера и сравнивает с базовой линией'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sizes', type=int, nargs='+', default=[10000, 100000, 1000000], help='Размеры баз (количество доставок)')
+        parser.add_argument('--scenarios', nargs='+', choices=list(SCENARIOS), default=list(SCENARIOS), help='Сценарии для замера')
+        parser.add_argument('--iterations', type=int, default=20, help='Количество запросов в каждом сценарии')
+        parser.add_argument('--seed', type=int, default=1, help='Начальное значение генератора данных')
+        parser.add_argument('--workers', type=int, default=1, help='Процессов для заполнения базы')
+        parser.add_argument('--db-dir', default=os.path.join(settings.BASE_DIR, 'benchmarks'), help='Каталог баз для замеров')
+        parser.add_argument('--save-baseline', help='Сохранить результат в JSON-файл')
+        parser.add_argument('--compare', help='Сравнить результат с JSON-файлом базовой линии')
+        parser.add_argument('--threshold', type=float, default=0.2, help='Допустимый рост задержки и памяти (0.2 - 20%%)')
+        parser.add_argument('--size', type=int, help='Замер одного размера (для дочерних процессов)')
+
+    def handle(self, *args, **options):
+        """
+        Основной метод, выполняющий команду
+        """
+        if options['size']:
+            # Замер одного размера в дочернем процессе
+            self.stdout.write(json.dumps(self._run_size(options['size'], options)))
+            return
+
+        baseline = None
+        if options['compare']:
+            try:
+                with open(options['compare'], encoding='utf-8') as baseline_file:
+                    baseline = json.load(baseline_file)
+            except (OSError, ValueError) as e:
+                raise CommandError(f'Не удалось прочитать базовую линию: {e}')
+
+        os.makedirs(options['db_dir'], exist_ok=True)
+        result = {
+            'meta': {
+                'db_profile': settings.DB_PROFILE,
+                'iterations': options['iterations'],
+                'seed': options['seed'],
+                'python': platform.python_version(),
+                'django': django.get_version(),
+            },
+            'sizes': {},
+        }
+        for size in options['sizes']:
+            result['sizes'][str(size)] = self._spawn(size, options)
+            self._print_size(size, result['sizes'][str(size)])
+
+        if options['save_baseline']:
+            with open(options['save_baseline'], 'w', encoding='utf-8') as baseline_file:
+                json.dump(result, baseline_file, ensure_ascii=False, indent=2)
+            self.stdout.write(self.style.SUCCESS(f"Базовая линия сохранена: {options['save_baseline']}"))
+
+        if baseline is not None:
+            regressions = self._compare(baseline, result, options['threshold'])
+            if regressions:
+                for line in regressions:
+                    self.stdout.write(self.style.ERROR(f'  {line}'))
+                raise CommandError(f'Обнаружено ухудшений: {len(regressions)}')
+            self.stdout.write(self.style.SUCCESS('Ухудшений относительно базовой линии нет'))
+
+    def _spawn(self, size, options):
+        """
+        Запускает замер размера в отдельном процессе со своей базой
+        """
+        env = dict(
+            os.environ,
+            DB_NAME=os.path.join(options['db_dir'], f'deliveries_{size}.sqlite3'),
+            # Все запросы идут в одну базу, чтобы их можно было посчитать
+            DB_REPLICA_NAME='',
+            DB_ARCHIVE_NAME='',
+            # Замеряются синхронные представления без ограничения отчетов
+            REPORTS_THROTTLE_ENABLED='False',
+            API_ASYNC_VIEWS='False',
+        )
+        command = [
+            sys.executable, os.path.join(settings.BASE_DIR, 'manage.py'), 'bench_endpoints',
+            '--size', str(size), '--iterations', str(options['iterations']),
+            '--seed', str(options['seed']), '--workers', str(options['workers']),
+            '--scenarios', *options['scenarios'],
+        ]
+        completed = subprocess.run(command, env=env, capture_output=True, text=True)
+        if completed.returncode != 0:
+            raise CommandError(f'Замер размера {size} завершился с ошибкой:\n{completed.stderr}')
+        return json.loads(completed.stdout.strip().splitlines()[-1])
+
+    def _print_size(self, size, scenarios):
+        self.stdout.write(self.style.SUCCESS(f'Доставок: {size}'))
+        for name, summary in scenarios.items():
+            self.stdout.write(
+                f"  {name}: p50 {summary['p50_ms']} мс, p95 {summary['p95_ms']} мс, "
+                f"запросов {summary['queries']}, память {summary['peak_memory_kb']} КБ"
+            )
+
+    def _compare(self, baseline, result, threshold):
+        """
+        Возвращает список ухудшений относительно базовой линии
+        """
+        regressions = []
+        for size, scenarios in result['sizes'].items():
+            for name, summary in scenarios.items():
+                previous = baseline.get('sizes', {}).get(size, {}).get(name)
+                if previous is None:
+                    continue
+                for metric in COMPARED_METRICS:
+                    old, new = previous.get(metric), summary.get(metric)
+                    if old is None or new is None:
+                        continue
+                    # Количество запросов детерминировано - любой рост это ухудшение
+                    limit = old if metric == 'queries' else old * (1 + threshold)
+                    if new > limit:
+                        regressions.append(f'{size} {name} {metric}: {old} -> {new}')
+        return regressions
+
+    def _run_size(self, size, options):
+        self._ensure_data(size, options)
+        client = APIClient(HTTP_HOST='localhost')
+        client.force_authenticate(get_benchmark_user())
+        ids = Delivery.objects.order_by('id').values_list('id', flat=True)
+        delivery_id = ids[size // 2]
+
+        results = {}
+        for name in options['scenarios']:
+            url = SCENARIOS[name].format(delivery_id=delivery_id)
+            results[name] = self._measure(client, url, options['iterations'])
+        return results
+
+    def _measure(self, client, url, iterations):
+        """
+        Задержка по iterations запросам, затем отдельные запросы с подсчетом
+        запросов к базе и памяти (они замедляют выполнение)
+        """
+        # Прогревочный запрос не учитывается
+        self._get(client, url)
+        latencies = []
+        for _ in range(iterations):
+            started = time.perf_counter()
+            self._get(client, url)
+            latencies.append(time.perf_counter() - started)
+        summary = summarize_latencies(latencies)
+
+        # Пиковая память - медиана нескольких запросов (разовые выделения
+        # вроде заполнения кэшей не должны давать ложных ухудшений)
+        peaks = []
+        for _ in range(MEMORY_SAMPLES):
+            with CaptureQueriesContext(connections['default']) as queries:
+                tracemalloc.start()
+                try:
+                    self._get(client, url)
+                    peaks.append(tracemalloc.get_traced_memory()[1])
+                finally:
+                    tracemalloc.stop()
+        summary['queries'] = len(queries.captured_queries)
+        summary['peak_memory_kb'] = round(statistics.median(peaks) / 1024, 1)
+        return summary
+
+    def _get(self, client, url):
+        response = client.get(url)
+        if response.status_code != 200:
+            raise CommandError(f'{url} вернул статус {response.status_code}')
+        return response
+
+    def _ensure_data(self, size, options):
+        """
+        Создает схему и заполняет базу до size доставок (один раз)
+        """
+        call_command('migrate', verbosity=0, interactive=False)
+        output = StringIO()
+        if not Delivery.objects.exists():
+            # setup_references создает и несколько случайных доставок
+            random.seed(options['seed'])
+            call_command('setup_references', stdout=output)
+
+        count = Delivery.objects.count()
+        if count == size:
+            return
+        if count > size or Delivery.objects.filter(number__startswith=f'{BENCH_PREFIX}-').exists():
+            raise CommandError(
+                f"База {settings.DATABASES['default']['NAME']} содержит {count} доставок "
+                f'вместо {size}. Удалите файл базы для повторного заполнения.'
+            )
+        call_command(
+            'generate_deliveries', size - count, seed=options['seed'], workers=options['workers'],
+            prefix=BENCH_PREFIX, end_date=BENCH_END_DATE, days=BENCH_DAYS, stdout=output,
+        )
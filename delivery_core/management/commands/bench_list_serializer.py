@@ -0,0 +1,121 @@
+import json
+import random
+import time
+from decimal import Decimal
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.utils import timezone
+from rest_framework.renderers import JSONRenderer
+from rest_framework.request import Request
+from rest_framework.test import APIRequestFactory
+
+from delivery_core.fast_serializers import get_compiled_serializer
+from delivery_core.models import Delivery
+from delivery_core.projection import apply_projection
+from delivery_core.serializers import DeliveryListSerializer
+from references.models import TransportModel, PackagingType, DeliveryStatus, CargoType
+
+
+class Command(BaseCommand):
+    """
+    Замер и проверка эквивалентности быстрого сериализатора списка доставок
+
+    Для каждого размера создает временные доставки (в транзакции, которая
+    затем откатывается), сериализует их DeliveryListSerializer и
+    скомпилированной функцией (delivery_core.fast_serializers), сравнивает
+    JSON побайтно и выводит время обоих путей.
+    """
+    help = 'Сравнивает DeliveryListSerializer и скомпилированный сериализатор по скорости и результату'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rows', type=int, nargs='+', default=[1000, 10000, 100000], help='Размеры выборок')
+        parser.add_argument('--fields', help='Выборочные поля через запятую, как в ?fields=')
+        parser.add_argument('--repeat', type=int, default=3, help='Количество повторов (берется лучшее время)')
+        parser.add_argument('--seed', type=int, default=1, help='Начальное значение генератора данных')
+
+    def handle(self, *args, **options):
+        """
+        Основной метод, выполняющий команду
+        """
+        request = Request(APIRequestFactory().get('/api/delivery/deliveries/', HTTP_HOST='localhost'))
+        fields = options['fields'].split(',') if options['fields'] else None
+        serializer = DeliveryListSerializer(context={'request': request}, fields=fields)
+        compiled = get_compiled_serializer(serializer)
+
+        failed = False
+        for rows in options['rows']:
+            with transaction.atomic():
+                self._create_rows(rows, random.Random(options['seed']))
+                result = self._measure(serializer, compiled, fields, request, options['repeat'])
+                transaction.set_rollback(True)
+
+            failed = failed or not result['equal']
+            self.stdout.write(f'{rows}: {json.dumps(result, ensure_ascii=False)}')
+
+        if failed:
+            raise CommandError('Результаты сериализаторов различаются')
+        self.stdout.write(self.style.SUCCESS('Результаты совпадают'))
+
+    def _create_rows(self, count, rng):
+        """
+        Создает временные доставки с разнообразными значениями полей
+        """
+        transport_models = list(TransportModel.objects.all())
+        packagings = list(PackagingType.objects.all())
+        statuses = list(DeliveryStatus.objects.all())
+        cargo_types = list(CargoType.objects.all()) + [None]
+        if not transport_models or not packagings or not statuses:
+            raise CommandError('Справочники пусты. Выполните сначала setup_references.')
+
+        conditions = [value for value, _ in Delivery.CONDITION_CHOICES]
+        now = timezone.now()
+        batch = []
+        for index in range(count):
+            departure_time = now - timezone.timedelta(minutes=rng.randint(0, 525600), microseconds=rng.randint(0, 999999))
+            batch.append(Delivery(
+                number=f'BENCH-{index:07d}',
+                transport_model=rng.choice(transport_models),
+                packaging=rng.choice(packagings),
+                status=rng.choice(statuses),
+                cargo_type=rng.choice(cargo_types),
+                condition=rng.choice(conditions),
+                departure_time=departure_time,
+                arrival_time=departure_time + timezone.timedelta(seconds=rng.randint(60, 3 * 86400)),
+                distance=Decimal(rng.randint(1, 10 ** 6)) / 100,
+                notes='x' * rng.randint(0, 500),
+            ))
+            if len(batch) == 5000:
+                Delivery.objects.bulk_create(batch)
+                batch = []
+        Delivery.objects.bulk_create(batch)
+
+    def _measure(self, serializer, compiled, fields, request, repeat):
+        """
+        Сериализует выборку обоими путями и сравнивает результат
+        """
+        queryset = Delivery.objects.filter(number__startswith='BENCH-').order_by('-departure_time', 'id')
+        renderer = JSONRenderer()
+
+        drf_times, fast_times = [], []
+        for _ in range(repeat):
+            started = time.perf_counter()
+            drf_data = DeliveryListSerializer(
+                apply_projection(queryset, serializer), many=True, context={'request': request}, fields=fields
+            ).data
+            drf_times.append(time.perf_counter() - started)
+
+            started = time.perf_counter()
+            fast_data = compiled.serialize_queryset(queryset, serializer)
+            fast_times.append(time.perf_counter() - started)
+
+        drf_json = renderer.render(drf_data)
+        fast_json = renderer.render(fast_data)
+        drf_best, fast_best = min(drf_times), min(fast_times)
+        return {
+            'equal': drf_json == fast_json,
+            'bytes': len(drf_json),
+            'serializer_ms': round(drf_best * 1000, 1),
+            'compiled_ms': round(fast_best * 1000, 1),
+            'speedup': round(drf_best / fast_best, 2) if fast_best else None,
+        }
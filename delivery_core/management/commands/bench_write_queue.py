@@ -0,0 +1,112 @@
+import json
+import threading
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test.utils import override_settings
+from django.utils import timezone
+from rest_framework.test import APIClient
+
+from delivery_core.benchmarking import get_benchmark_user, summarize_latencies
+from delivery_core.models import Delivery
+from references.models import TransportModel, PackagingType, DeliveryStatus
+
+
+class Command(BaseCommand):
+    """
+    Замер параллельного создания доставок
+
+    Сравнивает обычный режим (транзакция на каждый запрос) с режимом
+    групповой фиксации (DELIVERY_WRITE_COALESCING) на одной и той же нагрузке:
+    несколько потоков одновременно отправляют POST /api/delivery/deliveries/.
+    """
+    help = 'Сравнивает пропускную способность и p99 записи с group commit и без него'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--threads', type=int, default=16, help='Количество параллельных клиентов')
+        parser.add_argument('--requests', type=int, default=50, help='Количество запросов на клиента')
+        parser.add_argument('--keep', action='store_true', help='Не удалять созданные доставки')
+
+    def handle(self, *args, **options):
+        """
+        Основной метод, выполняющий команду
+        """
+        user = get_benchmark_user()
+        payload = self._build_payload()
+
+        results = {}
+        for mode, coalescing in (('per_request', False), ('group_commit', True)):
+            with override_settings(DELIVERY_WRITE_COALESCING=coalescing):
+                results[mode] = self._run(
+                    user, payload, options['threads'], options['requests'], options['keep']
+                )
+            self.stdout.write(f'{mode}: {json.dumps(results[mode], ensure_ascii=False)}')
+
+        self.stdout.write(self.style.SUCCESS('Замер завершен'))
+
+    def _build_payload(self):
+        """
+        Формирует тело запроса на создание доставки из первых записей справочников
+        """
+        transport_model = TransportModel.objects.first()
+        packaging = PackagingType.objects.first()
+        status = DeliveryStatus.objects.first()
+        if not transport_model or not packaging or not status:
+            raise CommandError('Справочники пусты. Выполните сначала setup_references.')
+
+        departure_time = timezone.now()
+        return {
+            'transport_model': transport_model.pk,
+            'packaging': packaging.pk,
+            'status': status.pk,
+            'departure_time': departure_time.isoformat(),
+            'arrival_time': (departure_time + timezone.timedelta(hours=2)).isoformat(),
+            'distance': '10.00',
+        }
+
+    def _run(self, user, payload, threads, per_thread, keep):
+        """
+        Запускает нагрузку в threads потоках и собирает задержки и ошибки
+        """
+        latencies = []
+        errors = []
+        created_ids = []
+        lock = threading.Lock()
+        barrier = threading.Barrier(threads)
+
+        def worker():
+            client = APIClient(HTTP_HOST='localhost', raise_request_exception=False)
+            client.force_authenticate(user)
+            local_latencies, local_errors, local_ids = [], [], []
+            barrier.wait()
+            try:
+                for _ in range(per_thread):
+                    started = time.perf_counter()
+                    response = client.post('/api/delivery/deliveries/', payload, format='json')
+                    local_latencies.append(time.perf_counter() - started)
+                    if response.status_code == 201:
+                        local_ids.append(response.data['id'])
+                    else:
+                        local_errors.append(response.status_code)
+            finally:
+                connection.close()
+            with lock:
+                latencies.extend(local_latencies)
+                errors.extend(local_errors)
+                created_ids.extend(local_ids)
+
+        workers = [threading.Thread(target=worker) for _ in range(threads)]
+        started = time.perf_counter()
+        for thread in workers:
+            thread.start()
+        for thread in workers:
+            thread.join()
+        elapsed = time.perf_counter() - started
+
+        if not keep:
+            Delivery.objects.filter(id__in=created_ids).delete()
+
+        summary = summarize_latencies(latencies, elapsed)
+        summary['errors'] = len(errors)
+        return summary
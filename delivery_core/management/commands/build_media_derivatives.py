@@ -0,0 +1,82 @@
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+from django.core.management.base import BaseCommand
+from django.db import connections
+
+from delivery_core.derivatives import generate_derivatives, is_image
+from delivery_core.models import Delivery, ArchivedDelivery
+
+
+def _init_worker():
+    """
+    Инициализирует Django в процессе-обработчике (нужно при запуске через spawn)
+    """
+    import django
+
+    django.setup()
+
+
+def _process(task):
+    name, force = task
+    try:
+        return name, generate_derivatives(name, force=force), None
+    except Exception as e:
+        return name, 0, str(e)
+
+
+class Command(BaseCommand):
+    """
+    Команда для построения копий уже загруженных изображений доставок
+
+    Имена файлов читаются из оперативных и архивных доставок потоком,
+    изображения обрабатываются пулом процессов (декодирование и
+    масштабирование загружают процессор). Уже построенные копии
+    пропускаются, если не указан --force.
+    """
+    help = 'Строит миниатюры и превью для уже загруженных изображений доставок'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=os.cpu_count() or 1, help='Количество процессов')
+        parser.add_argument('--force', action='store_true', help='Перестроить уже существующие копии')
+        parser.add_argument('--include-archive', action='store_true', help='Обработать также архивные доставки')
+
+    def handle(self, *args, **options):
+        """
+        Основной метод, выполняющий команду
+        """
+        names = self._collect_images(options['include_archive'])
+        self.stdout.write(f'Изображений для обработки: {len(names)}')
+        if not names:
+            return
+
+        # Подключения к базе не должны наследоваться процессами пула
+        connections.close_all()
+
+        built = failed = 0
+        tasks = [(name, options['force']) for name in names]
+        with ProcessPoolExecutor(max_workers=max(options['workers'], 1), initializer=_init_worker) as executor:
+            for index, (name, count, error) in enumerate(executor.map(_process, tasks, chunksize=16), start=1):
+                if error:
+                    failed += 1
+                    self.stderr.write(f'  {name}: {error}')
+                built += count
+                if index % 500 == 0:
+                    self.stdout.write(f'  обработано {index}')
+
+        self.stdout.write(self.style.SUCCESS(
+            f'Построено копий: {built}, ошибок: {failed}'
+        ))
+
+    def _collect_images(self, include_archive):
+        """
+        Возвращает уникальные имена изображений доставок
+        """
+        models = (Delivery, ArchivedDelivery) if include_archive else (Delivery,)
+        names = set()
+        for model in models:
+            queryset = model.objects.exclude(media_file='').exclude(media_file__isnull=True)
+            for name in queryset.values_list('media_file', flat=True).iterator(chunk_size=5000):
+                if is_image(name):
+                    names.add(name)
+        return sorted(names)
@@ -0,0 +1,150 @@
+import os
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+
+from django.core.management.base import BaseCommand, CommandError
+
+from delivery_core.derivatives import delete_derivatives
+from delivery_core.models import Delivery, ArchivedDelivery, MediaBlob
+from delivery_core.storage import CAS_PREFIX, ContentAddressedStorage, get_delivery_media_storage, is_blob_name
+
+
+# Размер пачки имен в запросах IN (...) - с запасом ниже лимита
+# переменных SQLite
+DELETE_CHUNK_SIZE = 500
+
+
+class Command(BaseCommand):
+    """
+    Команда для удаления медиа-блобов, на которые не ссылается ни одна доставка
+
+    Ссылки собираются потоковым чтением оперативных и архивных доставок,
+    дерево хранилища обходится параллельно по каталогам первого уровня.
+    Блобы моложе периода ожидания не удаляются: файл мог быть сохранен
+    загрузкой, которая еще не зафиксировала доставку (повторное сохранение
+    того же содержимого обновляет время изменения блоба). Непосредственно
+    перед удалением ссылки и время изменения блоба проверяются повторно.
+    Заодно сверяются счетчики ссылок в MediaBlob.
+    """
+    help = 'Удаляет медиа-блобы доставок без ссылок и сверяет счетчики ссылок'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=4, help='Количество потоков обхода хранилища')
+        parser.add_argument('--grace-minutes', type=int, default=60, help='Не удалять блобы моложе N минут')
+        parser.add_argument('--dry-run', action='store_true', help='Только показать, что будет удалено')
+
+    def handle(self, *args, **options):
+        """
+        Основной метод, выполняющий команду
+        """
+        storage = get_delivery_media_storage()
+        if not isinstance(storage, ContentAddressedStorage):
+            raise CommandError('Хранилище delivery_media не использует адресацию по содержимому')
+
+        root = storage.path(CAS_PREFIX)
+        if not os.path.isdir(root):
+            self.stdout.write('Хранилище блобов пусто')
+            return
+
+        references = self._collect_references()
+        self.stdout.write(f'Блобов со ссылками: {len(references)}')
+
+        shards = [entry.path for entry in os.scandir(root) if entry.is_dir() and entry.name != 'tmp']
+        cutoff = time.time() - options['grace_minutes'] * 60
+        with ThreadPoolExecutor(max_workers=max(options['workers'], 1)) as executor:
+            orphans = [
+                name
+                for shard_orphans in executor.map(lambda shard: self._scan_shard(storage, shard, references, cutoff), shards)
+                for name in shard_orphans
+            ]
+
+        if options['dry_run']:
+            freed = sum(storage.size(name) for name in orphans)
+            self.stdout.write(f'К удалению: {len(orphans)} блобов, {freed} байт')
+            return
+
+        deleted = []
+        freed = 0
+        for name in orphans:
+            # За время обхода блоб могли сохранить или прикрепить заново
+            if not self._still_orphaned(storage, name, cutoff):
+                continue
+            freed += storage.size(name)
+            storage.delete(name)
+            delete_derivatives(name)
+            deleted.append(name)
+
+        for start in range(0, len(deleted), DELETE_CHUNK_SIZE):
+            MediaBlob.objects.filter(name__in=deleted[start:start + DELETE_CHUNK_SIZE]).delete()
+        fixed = self._reconcile_counters(references)
+
+        self.stdout.write(self.style.SUCCESS(
+            f'Удалено блобов: {len(deleted)} ({freed} байт), исправлено счетчиков: {fixed}'
+        ))
+
+    def _collect_references(self):
+        """
+        Считает ссылки на блобы в оперативных и архивных доставках
+        """
+        references = Counter()
+        for model in (Delivery, ArchivedDelivery):
+            names = model.objects.filter(
+                media_file__startswith=CAS_PREFIX + '/'
+            ).values_list('media_file', flat=True).iterator(chunk_size=5000)
+            references.update(names)
+        return references
+
+    def _scan_shard(self, storage, shard, references, cutoff):
+        """
+        Возвращает имена блобов каталога без ссылок, старше границы ожидания
+        """
+        orphans = []
+        for directory, _, files in os.walk(shard):
+            for filename in files:
+                path = os.path.join(directory, filename)
+                name = os.path.relpath(path, storage.location).replace(os.sep, '/')
+                if not is_blob_name(name) or name in references:
+                    continue
+                if os.path.getmtime(path) < cutoff:
+                    orphans.append(name)
+        return orphans
+
+    def _still_orphaned(self, storage, name, cutoff):
+        """
+        Повторно проверяет блоб перед удалением: он старше границы
+        ожидания и ни одна доставка на него не ссылается
+        """
+        try:
+            if os.path.getmtime(storage.path(name)) >= cutoff:
+                return False
+        except FileNotFoundError:
+            return False
+        return not any(
+            model.objects.filter(media_file=name).exists()
+            for model in (Delivery, ArchivedDelivery)
+        )
+
+    def _count_references(self, name):
+        return sum(
+            model.objects.filter(media_file=name).count()
+            for model in (Delivery, ArchivedDelivery)
+        )
+
+    def _reconcile_counters(self, references):
+        """
+        Приводит счетчики ссылок MediaBlob к фактическому числу ссылок
+
+        Снимок ссылок устарел к концу обхода, поэтому по нему выбираются
+        только кандидаты: ссылки пересчитываются заново, а счетчик
+        обновляется, только если его не изменили параллельные F()-обновления
+        с момента чтения (иначе его сверит следующий запуск).
+        """
+        fixed = 0
+        for blob in MediaBlob.objects.only('id', 'name', 'ref_count').iterator(chunk_size=5000):
+            if blob.ref_count == references.get(blob.name, 0):
+                continue
+            actual = self._count_references(blob.name)
+            if blob.ref_count != actual:
+                fixed += MediaBlob.objects.filter(pk=blob.pk, ref_count=blob.ref_count).update(ref_count=actual)
+        return fixed
@@ -0,0 +1,274 @@
+import math
+import multiprocessing
+import random
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from datetime import datetime, timedelta, timezone as dt_timezone
+from decimal import Decimal
+from itertools import accumulate
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections, transaction
+
+from delivery_core.models import Delivery
+from references.models import TransportModel, PackagingType, Service, DeliveryStatus, CargoType
+
+
+# Доля исправного транспорта и доставок без типа груза
+HEALTHY_SHARE = 0.9
+NO_CARGO_TYPE_SHARE = 0.2
+NOTES_SHARE = 0.3
+
+
+def _skewed_weights(count, skew):
+    """
+    Веса записей справочника по закону Ципфа: 1 / ранг^skew (0 - равномерно)
+    """
+    return [1 / (rank ** skew) for rank in range(1, count + 1)]
+
+
+def _batch_rng(seed, batch_index):
+    # Генератор пачки зависит только от seed и номера пачки, поэтому
+    # результат не зависит от количества процессов и порядка их работы
+    return random.Random(f'{seed}:{batch_index}')
+
+
+def build_batch(plan, batch_index):
+    """
+    Создает доставки и связи с услугами для пачки batch_index (без сохранения)
+    """
+    rng = _batch_rng(plan['seed'], batch_index)
+    first = batch_index * plan['batch_size']
+    size = min(plan['batch_size'], plan['count'] - first)
+
+    references = {
+        name: rng.choices(ids, cum_weights=cum_weights, k=size)
+        for name, (ids, cum_weights) in plan['references'].items()
+    }
+    service_ids, service_weights = plan['services']
+    span = plan['days'] * 86400
+    half_life = plan['half_life_days'] * 86400
+    conditions = [value for value, _ in Delivery.CONDITION_CHOICES]
+
+    deliveries, services = [], []
+    for offset in range(size):
+        index = first + offset
+        if plan['time_distribution'] == 'recent':
+            seconds_ago = rng.expovariate(math.log(2) / half_life) % span
+        else:
+            seconds_ago = rng.random() * span
+        departure_time = plan['end'] - timedelta(seconds=seconds_ago)
+
+        if plan['distance_distribution'] == 'lognormal':
+            distance = rng.lognormvariate(math.log(plan['distance_median']), plan['distance_sigma'])
+        else:
+            distance = rng.uniform(1, plan['distance_max'])
+        distance = min(max(distance, 0.5), plan['distance_max'])
+        # Время в пути: дистанция при средней скорости 30-80 км/ч плюс погрузка
+        travel_hours = distance / rng.uniform(30, 80) + rng.uniform(0.25, 2)
+
+        deliveries.append(Delivery(
+            number=f"{plan['prefix']}-{index:09d}",
+            transport_model_id=references['transport_model'][offset],
+            packaging_id=references['packaging'][offset],
+            status_id=references['status'][offset],
+            cargo_type_id=None if rng.random() < NO_CARGO_TYPE_SHARE else references['cargo_type'][offset],
+            condition=conditions[0] if rng.random() < HEALTHY_SHARE else conditions[1],
+            departure_time=departure_time,
+            arrival_time=departure_time + timedelta(hours=travel_hours),
+            distance=Decimal(f'{distance:.2f}'),
+            notes=f'Сгенерированная доставка #{index}' if rng.random() < NOTES_SHARE else None,
+        ))
+
+        # Количество услуг - по Пуассону со средним services_mean
+        wanted = 0
+        threshold, product = math.exp(-plan['services_mean']), rng.random()
+        while product > threshold and wanted < len(service_ids):
+            wanted += 1
+            product *= rng.random()
+        chosen = set()
+        while len(chosen) < wanted:
+            chosen.update(rng.choices(service_ids, weights=service_weights, k=wanted - len(chosen)))
+        services.append(sorted(chosen))
+    return deliveries, services
+
+
+def insert_batch(plan, batch_index):
+    """
+    Сохраняет пачку доставок и их связи с услугами в одной транзакции
+    """
+    deliveries, services = build_batch(plan, batch_index)
+    Through = Delivery.services.through
+    with transaction.atomic():
+        created = Delivery.objects.bulk_create(deliveries)
+        links = [
+            Through(delivery_id=delivery.pk, service_id=service_id)
+            for delivery, service_ids in zip(created, services)
+            for service_id in service_ids
+        ]
+        Through.objects.bulk_create(links)
+    return len(created), len(links)
+
+
+def _close_connections():
+    # Дочерний процесс не должен использовать соединения родителя
+    connections.close_all()
+
+
+class Command(BaseCommand):
+    """
+    Генерация большого количества доставок для нагрузочных замеров
+
+    Доставки создаются пачками через bulk_create, связи с услугами - одним
+    bulk_create на пачку, каждая пачка в своей транзакции. Сигналы модели
+    не отправляются (события, отметки синхронизации и ссылки на медиа-файлы
+    не создаются). Пачки распределяются между --workers процессами.
+
+    Данные пачки зависят только от --seed и номера пачки, поэтому при
+    одинаковых параметрах (включая --end-date) результат один и тот же при
+    любом количестве процессов. Номера доставок - "<prefix>-<номер>",
+    для повторной генерации в ту же базу нужен другой --prefix.
+    """
+    help = 'Создает N синтетических доставок для нагрузочных замеров'
+
+    def add_arguments(self, parser):
+        parser.add_argument('count', type=int, help='Количество доставок')
+        parser.add_argument('--seed', type=int, default=1, help='Начальное значение генератора данных')
+        parser.add_argument('--batch-size', type=int, default=5000, help='Размер пачки bulk_create')
+        parser.add_argument('--workers', type=int, default=1, help='Количество процессов')
+        parser.add_argument('--prefix', default='GEN', help='Префикс номеров доставок')
+        parser.add_argument('--end-date', help='Самая поздняя дата отправления YYYY-MM-DD (по умолчанию сегодня)')
+        parser.add_argument('--days', type=int, default=365, help='Период отправлений в днях до --end-date')
+        parser.add_argument(
+            '--time-distribution', choices=['uniform', 'recent'], default='uniform',
+            help='Распределение отправлений: равномерно или с преобладанием недавних',
+        )
+        parser.add_argument('--half-life-days', type=float, default=30, help='Для recent: через сколько дней плотность падает вдвое')
+        parser.add_argument(
+            '--distance-distribution', choices=['lognormal', 'uniform'], default='lognormal',
+            help='Распределение дистанции',
+        )
+        parser.add_argument('--distance-median', type=float, default=40, help='Медиана дистанции для lognormal, км')
+        parser.add_argument('--distance-sigma', type=float, default=1.0, help='Разброс дистанции для lognormal')
+        parser.add_argument('--distance-max', type=float, default=3000, help='Максимальная дистанция, км')
+        parser.add_argument('--reference-skew', type=float, default=1.0, help='Перекос выбора справочников (0 - равномерно)')
+        parser.add_argument('--status-weights', help='Веса статусов по кодам, например completed=70,in_progress=20')
+        parser.add_argument('--services-mean', type=float, default=1.5, help='Среднее количество услуг доставки')
+
+    def handle(self, *args, **options):
+        """
+        Основной метод, выполняющий команду
+        """
+        if options['count'] <= 0 or options['batch_size'] <= 0 or options['workers'] <= 0:
+            raise CommandError('count, --batch-size и --workers должны быть положительными')
+        plan = self._build_plan(options)
+        if Delivery.objects.filter(number=f"{plan['prefix']}-{0:09d}").exists():
+            raise CommandError(f"Доставки с префиксом {plan['prefix']} уже есть. Укажите другой --prefix.")
+
+        batches = math.ceil(plan['count'] / plan['batch_size'])
+        self.stdout.write(
+            f"Генерация {plan['count']} доставок: {batches} пачек по {plan['batch_size']}, "
+            f"процессов: {options['workers']}"
+        )
+        started = time.perf_counter()
+        created = links = 0
+
+        if options['workers'] == 1:
+            for batch_index in range(batches):
+                batch_created, batch_links = insert_batch(plan, batch_index)
+                created, links = created + batch_created, links + batch_links
+                self._progress(created, plan['count'], started)
+        else:
+            connections.close_all()
+            with ProcessPoolExecutor(
+                max_workers=options['workers'],
+                mp_context=multiprocessing.get_context('fork'),
+                initializer=_close_connections,
+            ) as executor:
+                futures = [executor.submit(insert_batch, plan, batch_index) for batch_index in range(batches)]
+                for future in as_completed(futures):
+                    batch_created, batch_links = future.result()
+                    created, links = created + batch_created, links + batch_links
+                    self._progress(created, plan['count'], started)
+
+        elapsed = time.perf_counter() - started
+        self.stdout.write(self.style.SUCCESS(
+            f'Создано доставок: {created}, связей с услугами: {links} '
+            f'за {elapsed:.1f} с ({created / elapsed:.0f} доставок/с)'
+        ))
+
+    def _progress(self, created, total, started):
+        elapsed = time.perf_counter() - started
+        self.stdout.write(f'  {created}/{total} ({created / elapsed:.0f} доставок/с)')
+
+    def _build_plan(self, options):
+        """
+        Собирает параметры генерации и веса справочников для процессов
+        """
+        skew = options['reference_skew']
+        references = {}
+        for name, model in (
+            ('transport_model', TransportModel),
+            ('packaging', PackagingType),
+            ('cargo_type', CargoType),
+        ):
+            ids = list(model.objects.order_by('id').values_list('id', flat=True))
+            if not ids:
+                raise CommandError('Справочники пусты. Выполните сначала setup_references.')
+            references[name] = (ids, list(accumulate(_skewed_weights(len(ids), skew))))
+
+        statuses = list(DeliveryStatus.objects.order_by('id').values_list('id', 'code'))
+        if not statuses:
+            raise CommandError('Справочники пусты. Выполните сначала setup_references.')
+        weights = self._status_weights(statuses, options['status_weights'], skew)
+        references['status'] = ([status_id for status_id, _ in statuses], list(accumulate(weights)))
+
+        service_ids = list(Service.objects.order_by('id').values_list('id', flat=True))
+
+        if options['end_date']:
+            try:
+                end = datetime.strptime(options['end_date'], '%Y-%m-%d')
+            except ValueError:
+                raise CommandError('Дата должна быть в формате YYYY-MM-DD')
+        else:
+            end = datetime.now()
+        end = end.replace(hour=0, minute=0, second=0, microsecond=0, tzinfo=dt_timezone.utc) + timedelta(days=1)
+
+        return {
+            'seed': options['seed'],
+            'count': options['count'],
+            'batch_size': options['batch_size'],
+            'prefix': options['prefix'],
+            'end': end,
+            'days': options['days'],
+            'time_distribution': options['time_distribution'],
+            'half_life_days': options['half_life_days'],
+            'distance_distribution': options['distance_distribution'],
+            'distance_median': options['distance_median'],
+            'distance_sigma': options['distance_sigma'],
+            'distance_max': options['distance_max'],
+            'services_mean': options['services_mean'],
+            'references': references,
+            'services': (service_ids, _skewed_weights(len(service_ids), skew)),
+        }
+
+    def _status_weights(self, statuses, value, skew):
+        """
+        Веса статусов из --status-weights (неуказанные статусы не выбираются)
+        """
+        if not value:
+            return _skewed_weights(len(statuses), skew)
+        try:
+            given = {
+                code.strip(): float(weight)
+                for code, weight in (item.split('=') for item in value.split(',') if item.strip())
+            }
+        except ValueError:
+            raise CommandError('Формат --status-weights: код=вес через запятую')
+        unknown = set(given) - {code for _, code in statuses}
+        if unknown:
+            raise CommandError(f'Неизвестные коды статусов: {", ".join(sorted(unknown))}')
+        weights = [given.get(code, 0) for _, code in statuses]
+        if not any(weights):
+            raise CommandError('Хотя бы один статус должен иметь положительный вес')
+        return weights
@@ -0,0 +1,226 @@
+import asyncio
+import json
+import os
+import subprocess
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+
+from django.conf import settings
+from django.core.handlers.wsgi import WSGIHandler
+from django.core.management.base import BaseCommand, CommandError
+from django.db.backends.signals import connection_created
+from django.db import connections
+from rest_framework_simplejwt.tokens import AccessToken
+
+from delivery_core.benchmarking import get_benchmark_user, summarize_latencies
+
+
+ENDPOINTS = {
+    'deliveries_list': '/api/delivery/deliveries/',
+    'delivery_detail': '/api/delivery/deliveries/{delivery_id}/',
+    'transport_models': '/api/references/transport-models/',
+    'reports_daily': '/api/reports/delivery-reports/?report_type=daily&start_date=2000-01-01',
+}
+
+# Режим: (API_ASYNC_VIEWS, сервер)
+MODES = {
+    'wsgi': (False, 'wsgi'),
+    'asgi-sync': (False, 'asgi'),
+    'asgi': (True, 'asgi'),
+}
+
+
+class Command(BaseCommand):
+    """
+    Нагрузочное сравнение обработки запросов под WSGI и ASGI
+
+    Каждый режим запускается в отдельном процессе (маршруты выбираются по
+    API_ASYNC_VIEWS при импорте):
+    - wsgi - синхронные представления, WSGIHandler в пуле из --threads потоков
+      (как gunicorn с gthread);
+    - asgi-sync - синхронные представления под ASGI-обработчиком Django;
+    - asgi - асинхронные представления (delivery_project.async_views).
+
+    Запросы выполняются внутри процесса без сети, --concurrency клиентов
+    одновременно; так сравнивается обработчик, а не HTTP-сервер. Параметр
+    --db-latency-ms добавляет задержку к каждому запросу к базе, имитируя
+    сетевую базу данных (у локального SQLite задержки почти нет).
+    """
+    help = 'Сравнивает пропускную способность эндпоинтов чтения под WSGI и ASGI'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--modes', nargs='+', choices=list(MODES), default=list(MODES), help='Режимы для сравнения')
+        parser.add_argument('--requests', type=int, default=400, help='Количество запросов к каждому эндпоинту')
+        parser.add_argument('--concurrency', type=int, default=50, help='Количество одновременных клиентов')
+        parser.add_argument('--threads', type=int, default=8, help='Размер пула потоков WSGI')
+        parser.add_argument('--db-latency-ms', type=float, default=0, help='Задержка каждого запроса к базе, мс')
+        parser.add_argument('--endpoints', nargs='+', choices=list(ENDPOINTS), default=list(ENDPOINTS))
+        parser.add_argument('--mode', choices=list(MODES), help='Замер одного режима (для дочерних процессов)')
+
+    def handle(self, *args, **options):
+        """
+        Основной метод, выполняющий команду
+        """
+        if options['mode']:
+            # Замер одного режима в дочернем процессе
+            self.stdout.write(json.dumps(self._run_mode(options['mode'], options)))
+            return
+
+        results = {}
+        for mode in options['modes']:
+            results[mode] = self._spawn(mode, options)
+            self._print_result(mode, results[mode])
+
+        self.stdout.write(self.style.SUCCESS('Пропускная способность, запросов/с:'))
+        for name in options['endpoints']:
+            row = ', '.join(f"{mode}: {results[mode][name]['throughput_rps']}" for mode in results)
+            self.stdout.write(f'  {name}: {row}')
+
+    def _spawn(self, mode, options):
+        """
+        Запускает замер режима в отдельном процессе
+        """
+        api_async_views, _ = MODES[mode]
+        # Замер пропускной способности не должен упираться в ограничение отчетов
+        env = dict(os.environ, API_ASYNC_VIEWS=str(api_async_views), REPORTS_THROTTLE_ENABLED='False')
+        command = [
+            sys.executable, os.path.join(settings.BASE_DIR, 'manage.py'), 'loadtest_asgi', '--mode', mode,
+            '--requests', str(options['requests']), '--concurrency', str(options['concurrency']),
+            '--threads', str(options['threads']), '--db-latency-ms', str(options['db_latency_ms']),
+            '--endpoints', *options['endpoints'],
+        ]
+        completed = subprocess.run(command, env=env, capture_output=True, text=True)
+        if completed.returncode != 0:
+            raise CommandError(f'Замер режима {mode} завершился с ошибкой:\n{completed.stderr}')
+        return json.loads(completed.stdout.strip().splitlines()[-1])
+
+    def _print_result(self, mode, result):
+        self.stdout.write(self.style.SUCCESS(f'Режим: {mode}'))
+        for name, summary in result.items():
+            self.stdout.write(f'  {name}: {json.dumps(summary)}')
+
+    def _run_mode(self, mode, options):
+        api_async_views, server = MODES[mode]
+        if settings.API_ASYNC_VIEWS != api_async_views:
+            raise CommandError(f'Режим {mode} требует API_ASYNC_VIEWS={api_async_views}')
+
+        from delivery_core.models import Delivery
+
+        delivery = Delivery.objects.order_by('id').first()
+        if delivery is None:
+            raise CommandError('Нет доставок. Выполните сначала setup_references.')
+        token = str(AccessToken.for_user(get_benchmark_user()))
+        if options['db_latency_ms']:
+            self._install_db_latency(options['db_latency_ms'] / 1000)
+        # Дочерние потоки откроют свои соединения
+        connections.close_all()
+
+        run = self._run_wsgi if server == 'wsgi' else self._run_asgi
+        results = {}
+        for name in options['endpoints']:
+            url = ENDPOINTS[name].format(delivery_id=delivery.pk)
+            results[name] = run(url, token, options)
+        return results
+
+    def _install_db_latency(self, seconds):
+        def wrapper(execute, sql, params, many, context):
+            time.sleep(seconds)
+            return execute(sql, params, many, context)
+
+        def add_wrapper(sender, connection, **kwargs):
+            connection.execute_wrappers.append(wrapper)
+
+        connection_created.connect(add_wrapper, weak=False)
+
+    def _split(self, url):
+        path, _, query = url.partition('?')
+        return path, query
+
+    def _run_wsgi(self, url, token, options):
+        """
+        Запросы через WSGIHandler из пула потоков
+        """
+        handler = WSGIHandler()
+        path, query = self._split(url)
+
+        def request():
+            environ = {
+                'REQUEST_METHOD': 'GET', 'PATH_INFO': path, 'QUERY_STRING': query,
+                'SERVER_NAME': 'localhost', 'SERVER_PORT': '80', 'HTTP_HOST': 'localhost',
+                'HTTP_AUTHORIZATION': f'Bearer {token}', 'SCRIPT_NAME': '',
+                'wsgi.url_scheme': 'http', 'wsgi.input': BytesIO(), 'wsgi.errors': sys.stderr,
+                'wsgi.version': (1, 0), 'wsgi.multithread': True, 'wsgi.multiprocess': False,
+                'wsgi.run_once': False,
+            }
+            statuses = []
+            started = time.perf_counter()
+            response = handler(environ, lambda status, headers, exc_info=None: statuses.append(status))
+            try:
+                b''.join(response)
+            finally:
+                response.close()
+            return time.perf_counter() - started, statuses[0].startswith('200')
+
+        with ThreadPoolExecutor(max_workers=options['threads']) as executor:
+            # Прогревочный запрос не учитывается
+            executor.submit(request).result()
+            started = time.perf_counter()
+            outcomes = list(executor.map(lambda _: request(), range(options['requests'])))
+            elapsed = time.perf_counter() - started
+        return self._summary(outcomes, elapsed)
+
+    def _run_asgi(self, url, token, options):
+        """
+        Запросы через ASGI-приложение проекта, не более --concurrency одновременно
+        """
+        from delivery_project.asgi import application
+
+        path, query = self._split(url)
+        scope = {
+            'type': 'http', 'asgi': {'version': '3.0'}, 'http_version': '1.1', 'method': 'GET',
+            'scheme': 'http', 'path': path, 'raw_path': path.encode(), 'query_string': query.encode(),
+            'root_path': '', 'server': ('localhost', 80), 'client': ('127.0.0.1', 0),
+            'headers': [(b'host', b'localhost'), (b'authorization', f'Bearer {token}'.encode())],
+        }
+
+        async def request():
+            received = False
+            status = []
+
+            async def receive():
+                nonlocal received
+                if not received:
+                    received = True
+                    return {'type': 'http.request', 'body': b'', 'more_body': False}
+                # Клиент не отключается: обработчик отменит ожидание сам
+                await asyncio.Future()
+
+            async def send(message):
+                if message['type'] == 'http.response.start':
+                    status.append(message['status'])
+
+            started = time.perf_counter()
+            await application(dict(scope), receive, send)
+            return time.perf_counter() - started, status[0] == 200
+
+        async def main():
+            await request()
+            semaphore = asyncio.Semaphore(options['concurrency'])
+
+            async def limited():
+                async with semaphore:
+                    return await request()
+
+            started = time.perf_counter()
+            outcomes = await asyncio.gather(*(limited() for _ in range(options['requests'])))
+            return outcomes, time.perf_counter() - started
+
+        outcomes, elapsed = asyncio.run(main())
+        return self._summary(outcomes, elapsed)
+
+    def _summary(self, outcomes, elapsed):
+        summary = summarize_latencies([latency for latency, _ in outcomes], elapsed)
+        summary['errors'] = sum(1 for _, ok in outcomes if not ok)
+        return summary
@@ -0,0 +1,27 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from delivery_core.models import DeliveryTombstone
+
+
+class Command(BaseCommand):
+    """
+    Команда для удаления отметок об удалении доставок старше срока хранения
+
+    Клиенты с курсором старше срока хранения получают ответ 410 и
+    выполняют полную синхронизацию (см. delivery_core.sync).
+    """
+    help = 'Удаляет отметки об удалении доставок старше DELIVERY_TOMBSTONE_RETENTION_DAYS дней'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=int, default=None, help='Срок хранения в днях (по умолчанию из настроек)')
+
+    def handle(self, *args, **options):
+        """
+        Основной метод, выполняющий команду
+        """
+        days = options['days'] if options['days'] is not None else settings.DELIVERY_TOMBSTONE_RETENTION_DAYS
+        cutoff = timezone.now() - timezone.timedelta(days=days)
+        deleted, _ = DeliveryTombstone.objects.filter(deleted_at__lt=cutoff).delete()
+        self.stdout.write(self.style.SUCCESS(f'Удалено отметок: {deleted}'))
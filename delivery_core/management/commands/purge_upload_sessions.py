@@ -0,0 +1,28 @@
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from delivery_core.uploads import purge_abandoned
+
+
+class Command(BaseCommand):
+    """
+    Команда для удаления брошенных загрузок медиа-файлов
+
+    Удаляет незавершенные сессии загрузки, в которые дольше срока не
+    поступали части, вместе с их временными файлами, а также временные
+    файлы, для которых нет активной сессии (см. delivery_core.uploads).
+    """
+    help = 'Удаляет брошенные сессии загрузки и временные файлы старше DELIVERY_UPLOAD_SESSION_TTL_HOURS часов'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--hours', type=int, default=None, help='Срок в часах (по умолчанию из настроек)')
+
+    def handle(self, *args, **options):
+        """
+        Основной метод, выполняющий команду
+        """
+        hours = options['hours'] if options['hours'] is not None else settings.DELIVERY_UPLOAD_SESSION_TTL_HOURS
+        sessions, files = purge_abandoned(timedelta(hours=hours))
+        self.stdout.write(self.style.SUCCESS(f'Удалено сессий: {sessions}, временных файлов: {files}'))
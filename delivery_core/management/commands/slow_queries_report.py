@@ -0,0 +1,132 @@
+import json
+import os
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from delivery_core.benchmarking import percentile
+
+
+SORT_KEYS = {
+    'total': lambda group: group['total_ms'],
+    'count': lambda group: group['count'],
+    'avg': lambda group: group['total_ms'] / group['count'],
+    'max': lambda group: group['max_ms'],
+}
+
+
+class Command(BaseCommand):
+    """
+    Сводка журнала медленных SQL-запросов (см. delivery_project.slow_queries)
+
+    Записи текущего файла и файлов ротации группируются по fingerprint.
+    Для каждой группы выводятся количество, суммарное, среднее, p95 и
+    максимальное время, представления, из которых выполнялся запрос,
+    нормализованный текст и (с --explain) план EXPLAIN.
+    """
+    help = 'Выводит самые тяжелые медленные SQL-запросы из журнала'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--file', default=None, help='Файл журнала (по умолчанию SLOW_QUERY_LOG_FILE)')
+        parser.add_argument('--top', type=int, default=20, help='Количество групп в сводке')
+        parser.add_argument('--sort', choices=list(SORT_KEYS), default='total', help='Порядок групп')
+        parser.add_argument('--hours', type=float, default=None, help='Только записи за последние N часов')
+        parser.add_argument('--view', default=None, help='Только запросы указанного представления')
+        parser.add_argument('--explain', action='store_true', help='Выводить планы EXPLAIN')
+        parser.add_argument('--json', action='store_true', help='Вывести сводку в JSON')
+
+    def handle(self, *args, **options):
+        """
+        Основной метод, выполняющий команду
+        """
+        path = options['file'] or settings.SLOW_QUERY_LOG_FILE
+        files = self._log_files(path)
+        if not files:
+            raise CommandError(f'Журнал {path} не найден')
+
+        since = timezone.now() - timedelta(hours=options['hours']) if options['hours'] else None
+        groups = self._collect(files, since, options['view'])
+        ordered = sorted(groups.values(), key=SORT_KEYS[options['sort']], reverse=True)[:options['top']]
+        summary = [self._summarize(group) for group in ordered]
+
+        if options['json']:
+            self.stdout.write(json.dumps(summary, ensure_ascii=False, indent=2))
+            return
+
+        total = sum(group['count'] for group in groups.values())
+        self.stdout.write(self.style.SUCCESS(
+            f'Медленных запросов: {total}, видов: {len(groups)} (файлов журнала: {len(files)})'
+        ))
+        for index, group in enumerate(summary, 1):
+            self.stdout.write(self.style.SUCCESS(
+                f"{index}. {group['fingerprint']}: {group['count']} раз, всего {group['total_ms']} мс, "
+                f"среднее {group['avg_ms']} мс, p95 {group['p95_ms']} мс, макс. {group['max_ms']} мс"
+            ))
+            self.stdout.write(f"   Представления: {', '.join(group['views']) or '-'}")
+            self.stdout.write(f"   {group['normalized_sql']}")
+            if options['explain'] and group['explain']:
+                for line in group['explain']:
+                    self.stdout.write(f'     {line}')
+
+    def _log_files(self, path):
+        # Текущий файл и файлы ротации RotatingFileHandler: path.1, path.2, ...
+        files = [path] if os.path.exists(path) else []
+        index = 1
+        while os.path.exists(f'{path}.{index}'):
+            files.append(f'{path}.{index}')
+            index += 1
+        return files
+
+    def _collect(self, files, since, view):
+        groups = {}
+        for path in files:
+            with open(path, encoding='utf-8') as log_file:
+                for line in log_file:
+                    try:
+                        record = json.loads(line)
+                    except ValueError:
+                        continue
+                    if view and record.get('view') != view:
+                        continue
+                    if since:
+                        ts = parse_datetime(record.get('ts') or '')
+                        if ts is None or ts < since:
+                            continue
+                    group = groups.setdefault(record['fingerprint'], {
+                        'fingerprint': record['fingerprint'],
+                        'normalized_sql': record.get('normalized_sql'),
+                        'count': 0,
+                        'total_ms': 0.0,
+                        'max_ms': 0.0,
+                        'durations': [],
+                        'views': {},
+                        'explain': None,
+                    })
+                    duration = record.get('duration_ms', 0)
+                    group['count'] += 1
+                    group['total_ms'] += duration
+                    group['max_ms'] = max(group['max_ms'], duration)
+                    group['durations'].append(duration)
+                    name = record.get('view') or '-'
+                    group['views'][name] = group['views'].get(name, 0) + 1
+                    # План снимается один раз на процесс - берется любой найденный
+                    if group['explain'] is None and record.get('explain'):
+                        group['explain'] = record['explain']
+        return groups
+
+    def _summarize(self, group):
+        views = sorted(group['views'].items(), key=lambda item: -item[1])
+        return {
+            'fingerprint': group['fingerprint'],
+            'count': group['count'],
+            'total_ms': round(group['total_ms'], 1),
+            'avg_ms': round(group['total_ms'] / group['count'], 1),
+            'p95_ms': round(percentile(group['durations'], 95), 1),
+            'max_ms': round(group['max_ms'], 1),
+            'views': [f'{name} ({count})' for name, count in views],
+            'normalized_sql': group['normalized_sql'],
+            'explain': group['explain'],
+        }
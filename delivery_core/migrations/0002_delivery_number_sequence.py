@@ -0,0 +1,27 @@
+# Generated by Django 5.2 on 2026-10-19 18:56
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('delivery_core', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DeliveryNumberSequence',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('prefix', models.CharField(max_length=20, verbose_name='Префикс')),
+                ('year', models.PositiveIntegerField(verbose_name='Год')),
+                ('last_value', models.PositiveBigIntegerField(default=0, verbose_name='Последнее выданное значение')),
+            ],
+            options={
+                'verbose_name': 'Счетчик номеров доставок',
+                'verbose_name_plural': 'Счетчики номеров доставок',
+                'constraints': [models.UniqueConstraint(fields=('prefix', 'year'), name='unique_delivery_number_sequence')],
+            },
+        ),
+    ]
@@ -0,0 +1,96 @@
+# Generated by Django 5.2 on 2026-10-19 19:03
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('delivery_core', '0002_delivery_number_sequence'),
+        ('references', '0001_initial'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ArchivedDelivery',
+            fields=[
+                ('id', models.BigIntegerField(primary_key=True, serialize=False)),
+                ('created_at', models.DateTimeField(verbose_name='Дата создания')),
+                ('updated_at', models.DateTimeField(verbose_name='Дата изменения')),
+                ('archived_at', models.DateTimeField(auto_now_add=True, verbose_name='Дата архивации')),
+                ('number', models.CharField(max_length=100, unique=True, verbose_name='Номер')),
+                ('departure_time', models.DateTimeField(db_index=True, verbose_name='Время отправления')),
+                ('arrival_time', models.DateTimeField(verbose_name='Время прибытия')),
+                ('distance', models.DecimalField(decimal_places=2, max_digits=10, verbose_name='Дистанция (км)')),
+                ('condition', models.CharField(choices=[('Исправно', 'Исправно'), ('Неисправно', 'Неисправно')], default='Исправно', max_length=20, verbose_name='Техническое состояние')),
+                ('media_file', models.FileField(blank=True, null=True, upload_to='delivery_files/%Y/%m/', verbose_name='Медиа-файл')),
+                ('notes', models.TextField(blank=True, null=True, verbose_name='Примечания')),
+            ],
+            options={
+                'verbose_name': 'Архивная доставка',
+                'verbose_name_plural': 'Архивные доставки',
+                'ordering': ['-departure_time'],
+            },
+        ),
+        migrations.CreateModel(
+            name='ArchivedDeliveryService',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+            ],
+            options={
+                'verbose_name': 'Услуга архивной доставки',
+                'verbose_name_plural': 'Услуги архивных доставок',
+            },
+        ),
+        migrations.AddIndex(
+            model_name='delivery',
+            index=models.Index(fields=['departure_time'], name='delivery_departure_idx'),
+        ),
+        migrations.AddField(
+            model_name='archiveddelivery',
+            name='cargo_type',
+            field=models.ForeignKey(blank=True, db_constraint=False, null=True, on_delete=django.db.models.deletion.DO_NOTHING, related_name='+', to='references.cargotype', verbose_name='Тип груза'),
+        ),
+        migrations.AddField(
+            model_name='archiveddelivery',
+            name='created_by',
+            field=models.ForeignKey(blank=True, db_constraint=False, null=True, on_delete=django.db.models.deletion.DO_NOTHING, related_name='+', to=settings.AUTH_USER_MODEL, verbose_name='Кем создано'),
+        ),
+        migrations.AddField(
+            model_name='archiveddelivery',
+            name='packaging',
+            field=models.ForeignKey(db_constraint=False, on_delete=django.db.models.deletion.DO_NOTHING, related_name='+', to='references.packagingtype', verbose_name='Упаковка'),
+        ),
+        migrations.AddField(
+            model_name='archiveddelivery',
+            name='status',
+            field=models.ForeignKey(db_constraint=False, on_delete=django.db.models.deletion.DO_NOTHING, related_name='+', to='references.deliverystatus', verbose_name='Статус'),
+        ),
+        migrations.AddField(
+            model_name='archiveddelivery',
+            name='transport_model',
+            field=models.ForeignKey(db_constraint=False, on_delete=django.db.models.deletion.DO_NOTHING, related_name='+', to='references.transportmodel', verbose_name='Модель транспорта'),
+        ),
+        migrations.AddField(
+            model_name='archiveddelivery',
+            name='updated_by',
+            field=models.ForeignKey(blank=True, db_constraint=False, null=True, on_delete=django.db.models.deletion.DO_NOTHING, related_name='+', to=settings.AUTH_USER_MODEL, verbose_name='Кем изменено'),
+        ),
+        migrations.AddField(
+            model_name='archiveddeliveryservice',
+            name='delivery',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='service_links', to='delivery_core.archiveddelivery', verbose_name='Доставка'),
+        ),
+        migrations.AddField(
+            model_name='archiveddeliveryservice',
+            name='service',
+            field=models.ForeignKey(db_constraint=False, on_delete=django.db.models.deletion.DO_NOTHING, related_name='+', to='references.service', verbose_name='Услуга'),
+        ),
+        migrations.AddConstraint(
+            model_name='archiveddeliveryservice',
+            constraint=models.UniqueConstraint(fields=('delivery', 'service'), name='unique_archived_delivery_service'),
+        ),
+    ]
@@ -0,0 +1,39 @@
+# Generated by Django 5.2 on 2026-10-19 19:06
+
+import delivery_core.storage
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('delivery_core', '0004_upload_session'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='MediaBlob',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=255, unique=True, verbose_name='Имя в хранилище')),
+                ('sha256', models.CharField(db_index=True, max_length=64, verbose_name='SHA-256')),
+                ('size', models.PositiveBigIntegerField(verbose_name='Размер (байт)')),
+                ('ref_count', models.IntegerField(default=0, verbose_name='Количество ссылок')),
+                ('created_at', models.DateTimeField(auto_now_add=True, verbose_name='Дата создания')),
+            ],
+            options={
+                'verbose_name': 'Медиа-блоб',
+                'verbose_name_plural': 'Медиа-блобы',
+            },
+        ),
+        migrations.AlterField(
+            model_name='archiveddelivery',
+            name='media_file',
+            field=models.FileField(blank=True, null=True, storage=delivery_core.storage.get_delivery_media_storage, upload_to='delivery_files/%Y/%m/', verbose_name='Медиа-файл'),
+        ),
+        migrations.AlterField(
+            model_name='delivery',
+            name='media_file',
+            field=models.FileField(blank=True, null=True, storage=delivery_core.storage.get_delivery_media_storage, upload_to='delivery_files/%Y/%m/', verbose_name='Медиа-файл'),
+        ),
+    ]
@@ -0,0 +1,38 @@
+# Generated by Django 5.2 on 2026-10-19 19:18
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('delivery_core', '0005_media_blob'),
+        ('references', '0001_initial'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DeliveryTombstone',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('delivery_id', models.BigIntegerField(verbose_name='ID доставки')),
+                ('number', models.CharField(max_length=100, verbose_name='Номер')),
+                ('reason', models.CharField(choices=[('deleted', 'Удалена'), ('archived', 'Перенесена в архив')], default='deleted', max_length=20, verbose_name='Причина')),
+                ('deleted_at', models.DateTimeField(auto_now_add=True, verbose_name='Дата удаления')),
+            ],
+            options={
+                'verbose_name': 'Удаленная доставка',
+                'verbose_name_plural': 'Удаленные доставки',
+            },
+        ),
+        migrations.AddIndex(
+            model_name='delivery',
+            index=models.Index(fields=['updated_at', 'id'], name='delivery_updated_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='deliverytombstone',
+            index=models.Index(fields=['deleted_at', 'id'], name='tombstone_deleted_idx'),
+        ),
+    ]
@@ -1,3 +1,5 @@
+import uuid
+
 from django.db import models
 from django.contrib.auth.models import User
 from django.core.validators import MinValueValidator
@@ -6,6 +8,7 @@ from references.models import (
     TransportModel, PackagingType, Service, 
     DeliveryStatus, CargoType
 )
+from .storage import get_delivery_media_storage
 
 
 class Delivery(models.Model):
@@ -89,6 +92,7 @@ class Delivery(models.Model):
     media_file = models.FileField(
         'Медиа-файл', 
         upload_to='delivery_files/%Y/%m/', 
+        storage=get_delivery_media_storage,
         null=True, 
         blank=True
     )
@@ -97,14 +101,35 @@ class Delivery(models.Model):
     # Связь с услугами (многие ко многим)
     services = models.ManyToManyField(Service, verbose_name='Услуги', blank=True)
     
+    # Поля, исходные значения которых запоминаются при загрузке из базы
+    TRACKED_FIELDS = ('media_file', 'status_id')
+    
     class Meta:
         verbose_name = 'Доставка'
         verbose_name_plural = 'Доставки'
         ordering = ['-departure_time']
+        indexes = [
+            models.Index(fields=['departure_time'], name='delivery_departure_idx'),
+            # Выборка изменений для синхронизации (см. delivery_core.sync)
+            models.Index(fields=['updated_at', 'id'], name='delivery_updated_idx'),
+        ]
     
     def __str__(self):
         return f"Доставка {self.number} ({self.transport_model})"
     
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        """
+        Запоминает загруженные из базы значения полей, за изменением
+        которых следят сигналы (см. delivery_core.signals)
+        """
+        instance = super().from_db(db, field_names, values)
+        instance._loaded_values = {
+            name: value for name, value in zip(field_names, values)
+            if name in cls.TRACKED_FIELDS
+        }
+        return instance
+    
     def travel_time_hours(self):
         """
         Возвращает время в пути в часах
@@ -117,3 +142,293 @@ class Delivery(models.Model):
         diff = self.arrival_time - self.departure_time
         return round(diff.total_seconds() / 3600, 2)
     travel_time_hours.short_description = 'Время в пути (ч)'
+
+
+class DeliveryNumberSequence(models.Model):
+    """
+    Счетчик номеров доставок
+    
+    Хранит последнее выданное значение последовательности для пары
+    префикс + год. Номера выдаются блоками (см. delivery_core.numbering),
+    поэтому строка счетчика блокируется один раз на целый блок номеров,
+    а не на каждую создаваемую доставку.
+    """
+    prefix = models.CharField('Префикс', max_length=20)
+    year = models.PositiveIntegerField('Год')
+    last_value = models.PositiveBigIntegerField('Последнее выданное значение', default=0)
+    
+    class Meta:
+        verbose_name = 'Счетчик номеров доставок'
+        verbose_name_plural = 'Счетчики номеров доставок'
+        constraints = [
+            models.UniqueConstraint(
+                fields=['prefix', 'year'], name='unique_delivery_number_sequence'
+            ),
+        ]
+    
+    def __str__(self):
+        return f"{self.prefix}-{self.year}: {self.last_value}"
+
+
+class ArchivedDelivery(models.Model):
+    """
+    Архивная доставка
+    
+    Копия выполненной доставки, перенесенной из оперативной таблицы командой
+    archive_deliveries. Сохраняет id исходной доставки и все ее поля.
+    Может храниться в отдельной базе (DB_ARCHIVE_NAME), поэтому связи
+    со справочниками и пользователями объявлены без ограничений в базе
+    и не используются в JOIN - названия берутся из references.cache.
+    """
+    id = models.BigIntegerField(primary_key=True)
+    
+    # Технические поля
+    created_at = models.DateTimeField('Дата создания')
+    updated_at = models.DateTimeField('Дата изменения')
+    archived_at = models.DateTimeField('Дата архивации', auto_now_add=True)
+    created_by = models.ForeignKey(
+        User,
+        on_delete=models.DO_NOTHING,
+        db_constraint=False,
+        null=True,
+        blank=True,
+        related_name='+',
+        verbose_name='Кем создано'
+    )
+    updated_by = models.ForeignKey(
+        User,
+        on_delete=models.DO_NOTHING,
+        db_constraint=False,
+        null=True,
+        blank=True,
+        related_name='+',
+        verbose_name='Кем изменено'
+    )
+    
+    # Основные поля
+    number = models.CharField('Номер', max_length=100, unique=True)
+    transport_model = models.ForeignKey(
+        TransportModel,
+        on_delete=models.DO_NOTHING,
+        db_constraint=False,
+        related_name='+',
+        verbose_name='Модель транспорта'
+    )
+    departure_time = models.DateTimeField('Время отправления', db_index=True)
+    arrival_time = models.DateTimeField('Время прибытия')
+    distance = models.DecimalField('Дистанция (км)', max_digits=10, decimal_places=2)
+    packaging = models.ForeignKey(
+        PackagingType,
+        on_delete=models.DO_NOTHING,
+        db_constraint=False,
+        related_name='+',
+        verbose_name='Упаковка'
+    )
+    status = models.ForeignKey(
+        DeliveryStatus,
+        on_delete=models.DO_NOTHING,
+        db_constraint=False,
+        related_name='+',
+        verbose_name='Статус'
+    )
+    
+    # Дополнительные поля
+    condition = models.CharField(
+        'Техническое состояние',
+        max_length=20,
+        choices=Delivery.CONDITION_CHOICES,
+        default='Исправно'
+    )
+    cargo_type = models.ForeignKey(
+        CargoType,
+        on_delete=models.DO_NOTHING,
+        db_constraint=False,
+        null=True,
+        blank=True,
+        related_name='+',
+        verbose_name='Тип груза'
+    )
+    media_file = models.FileField(
+        'Медиа-файл',
+        upload_to='delivery_files/%Y/%m/',
+        storage=get_delivery_media_storage,
+        null=True,
+        blank=True
+    )
+    notes = models.TextField('Примечания', blank=True, null=True)
+    
+    class Meta:
+        verbose_name = 'Архивная доставка'
+        verbose_name_plural = 'Архивные доставки'
+        ordering = ['-departure_time']
+    
+    def __str__(self):
+        return f"Доставка {self.number} (архив)"
+    
+    travel_time_hours = Delivery.travel_time_hours
+    
+    @property
+    def services(self):
+        """
+        Услуги архивной доставки
+        
+        Связи хранятся в архивной базе, а сами услуги - в основной,
+        поэтому услуги выбираются по списку id без JOIN между базами.
+        """
+        service_ids = list(self.service_links.values_list('service_id', flat=True))
+        return Service.objects.filter(id__in=service_ids)
+
+
+class ArchivedDeliveryService(models.Model):
+    """
+    Связь архивной доставки с услугой
+    """
+    delivery = models.ForeignKey(
+        ArchivedDelivery,
+        on_delete=models.CASCADE,
+        related_name='service_links',
+        verbose_name='Доставка'
+    )
+    service = models.ForeignKey(
+        Service,
+        on_delete=models.DO_NOTHING,
+        db_constraint=False,
+        related_name='+',
+        verbose_name='Услуга'
+    )
+    
+    class Meta:
+        verbose_name = 'Услуга архивной доставки'
+        verbose_name_plural = 'Услуги архивных доставок'
+        constraints = [
+            models.UniqueConstraint(
+                fields=['delivery', 'service'], name='unique_archived_delivery_service'
+            ),
+        ]
+
+
+class UploadSession(models.Model):
+    """
+    Сессия возобновляемой загрузки медиа-файла доставки
+    
+    Файл передается частями (PUT с указанием смещения) во временный файл
+    на диске. Поле received хранит количество уже принятых байт, поэтому
+    после обрыва связи клиент продолжает загрузку с этого места.
+    После завершения файл проверяется и прикрепляется к доставке.
+    """
+    STATUS_ACTIVE = 'active'
+    STATUS_COMPLETED = 'completed'
+    STATUS_CHOICES = [
+        (STATUS_ACTIVE, 'Загружается'),
+        (STATUS_COMPLETED, 'Завершена'),
+    ]
+    
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    created_at = models.DateTimeField('Дата создания', auto_now_add=True)
+    updated_at = models.DateTimeField('Дата изменения', auto_now=True)
+    created_by = models.ForeignKey(
+        User,
+        on_delete=models.CASCADE,
+        related_name='delivery_upload_sessions',
+        verbose_name='Кем создано'
+    )
+    delivery = models.ForeignKey(
+        Delivery,
+        on_delete=models.SET_NULL,
+        null=True,
+        blank=True,
+        related_name='upload_sessions',
+        verbose_name='Доставка'
+    )
+    filename = models.CharField('Имя файла', max_length=255)
+    size = models.PositiveBigIntegerField('Размер (байт)')
+    checksum = models.CharField('SHA-256', max_length=64, blank=True)
+    received = models.PositiveBigIntegerField('Принято байт', default=0)
+    status = models.CharField(
+        'Состояние',
+        max_length=20,
+        choices=STATUS_CHOICES,
+        default=STATUS_ACTIVE
+    )
+    
+    class Meta:
+        verbose_name = 'Сессия загрузки'
+        verbose_name_plural = 'Сессии загрузки'
+        ordering = ['-created_at']
+    
+    def __str__(self):
+        return f"Загрузка {self.filename} ({self.received}/{self.size})"
+
+
+class MediaBlob(models.Model):
+    """
+    Блоб медиа-файла в хранилище с адресацией по содержимому
+    
+    Один файл на диске может быть прикреплен к нескольким доставкам;
+    ref_count хранит количество таких ссылок. Счетчик поддерживается
+    сигналами и пересчитывается командой gc_media.
+    """
+    name = models.CharField('Имя в хранилище', max_length=255, unique=True)
+    sha256 = models.CharField('SHA-256', max_length=64, db_index=True)
+    size = models.PositiveBigIntegerField('Размер (байт)')
+    ref_count = models.IntegerField('Количество ссылок', default=0)
+    created_at = models.DateTimeField('Дата создания', auto_now_add=True)
+    
+    class Meta:
+        verbose_name = 'Медиа-блоб'
+        verbose_name_plural = 'Медиа-блобы'
+    
+    def __str__(self):
+        return f"{self.name} ({self.ref_count})"
+
+
+class DeliveryTombstone(models.Model):
+    """
+    Отметка об удалении доставки для синхронизации клиентов
+    
+    Создается при удалении доставки (reason='deleted') и при переносе
+    в архив (reason='archived'). Клиенты получают отметки через
+    эндпоинт синхронизации и удаляют доставки из локальных копий.
+    """
+    REASON_DELETED = 'deleted'
+    REASON_ARCHIVED = 'archived'
+    REASON_CHOICES = [
+        (REASON_DELETED, 'Удалена'),
+        (REASON_ARCHIVED, 'Перенесена в архив'),
+    ]
+    
+    delivery_id = models.BigIntegerField('ID доставки')
+    number = models.CharField('Номер', max_length=100)
+    reason = models.CharField('Причина', max_length=20, choices=REASON_CHOICES, default=REASON_DELETED)
+    deleted_at = models.DateTimeField('Дата удаления', auto_now_add=True)
+    
+    class Meta:
+        verbose_name = 'Удаленная доставка'
+        verbose_name_plural = 'Удаленные доставки'
+        indexes = [
+            models.Index(fields=['deleted_at', 'id'], name='tombstone_deleted_idx'),
+        ]
+    
+    def __str__(self):
+        return f"{self.number} ({self.get_reason_display()})"
+
+
+class DeliveryEvent(models.Model):
+    """
+    Событие изменения доставки для рассылки между процессами
+    
+    Используется, если DELIVERY_EVENTS_BACKEND='database': каждый процесс
+    читает новые события из таблицы и рассылает их своим подписчикам
+    (см. delivery_core.events). Старые события удаляются автоматически.
+    """
+    kind = models.CharField('Тип события', max_length=20)
+    delivery_id = models.BigIntegerField('ID доставки')
+    payload = models.JSONField('Данные события')
+    created_at = models.DateTimeField('Дата создания', auto_now_add=True, db_index=True)
+    
+    class Meta:
+        verbose_name = 'Событие доставки'
+        verbose_name_plural = 'События доставок'
+    
+    def __str__(self):
+        return f"{self.kind} #{self.delivery_id}"
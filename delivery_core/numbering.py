@@ -0,0 +1,243 @@
+"""
+Серверная выдача номеров доставок
+
+Номер доставки строится по схеме ``<префикс>-<год>-<порядковый номер>``,
+например ``D-2024-00001``. Порядковые номера хранятся в таблице
+DeliveryNumberSequence, но каждый процесс резервирует их не по одному,
+а блоками (DELIVERY_NUMBER_BLOCK_SIZE) и дальше раздает номера из памяти.
+Благодаря этому одновременное создание доставок не приводит к коллизиям
+и не упирается в блокировку одной строки счетчика.
+
+Неиспользованный остаток блока теряется при перезапуске процесса, поэтому
+в нумерации возможны пропуски - уникальность при этом сохраняется.
+
+Внутри транзакции вызывающего кода (ATOMIC_REQUESTS, пакетная запись
+write_queue) резервирование откатывается вместе с ней. Поэтому блок,
+зарезервированный в транзакции, до ее фиксации раздает номера только этой
+транзакции и становится общим блоком процесса в transaction.on_commit.
+После отката блок забывается: иначе процесс продолжил бы раздавать номера,
+которые счетчик снова выдаст другим процессам. Строку счетчика транзакция
+обновляет один раз на блок, а не на каждую доставку.
+
+Номера клиента в формате сервера (``<префикс>-<год>-<число>``)
+отклоняются при проверке данных, чтобы они не совпали с выдаваемыми позже.
+"""
+import re
+import threading
+
+from django.conf import settings
+from django.db import IntegrityError, router, transaction
+from django.db.models import F
+from django.db.models.functions import Length
+from django.utils import timezone
+
+from .models import Delivery, DeliveryNumberSequence
+
+
+class DeliveryNumberAllocator:
+    """
+    Распределитель номеров доставок
+
+    Держит для каждого года текущий зарезервированный блок номеров.
+    Потокобезопасен: внутри процесса номера выдаются под блокировкой,
+    между процессами уникальность обеспечивает атомарное обновление счетчика.
+    """
+
+    def __init__(self, prefix=None, block_size=None, width=None):
+        self._prefix = prefix
+        self._block_size = block_size
+        self._width = width
+        self._lock = threading.Lock()
+        # год -> [следующее свободное значение, последнее значение блока]
+        self._blocks = {}
+        # (база, поток, год) -> (блок, обработчик on_commit) для блоков,
+        # зарезервированных в еще не зафиксированной транзакции
+        self._pending = {}
+
+    @property
+    def prefix(self):
+        return self._prefix or getattr(settings, 'DELIVERY_NUMBER_PREFIX', 'D')
+
+    @property
+    def block_size(self):
+        return self._block_size or getattr(settings, 'DELIVERY_NUMBER_BLOCK_SIZE', 50)
+
+    @property
+    def width(self):
+        return self._width or getattr(settings, 'DELIVERY_NUMBER_WIDTH', 5)
+
+    def format_number(self, year, value):
+        """
+        Форматирует номер доставки по схеме префикс + год + порядковый номер
+        """
+        return f"{self.prefix}-{year}-{value:0{self.width}d}"
+
+    def is_server_number(self, number):
+        """
+        Проверяет, совпадает ли номер с форматом номеров, выдаваемых сервером
+        """
+        return re.fullmatch(rf'{re.escape(self.prefix)}-\d{{4}}-\d+', number or '') is not None
+
+    def next_number(self, year=None):
+        """
+        Возвращает один новый номер доставки
+        """
+        return self.allocate(1, year=year)[0]
+
+    def allocate(self, count, year=None):
+        """
+        Возвращает список из count новых уникальных номеров
+
+        Номера берутся из текущего блока процесса; если его не хватает,
+        резервируется новый блок (не меньше запрошенного количества).
+        Внутри транзакции новый блок становится общим только после ее
+        фиксации.
+        """
+        if count <= 0:
+            return []
+        year = year or timezone.localdate().year
+        using = router.db_for_write(DeliveryNumberSequence)
+        connection = transaction.get_connection(using)
+
+        numbers = []
+        with self._lock:
+            while len(numbers) < count:
+                block = self._get_block(connection, using, year)
+                if block is None:
+                    size = max(self.block_size, count - len(numbers))
+                    block = list(self._reserve_block(year, size))
+                    if connection.in_atomic_block:
+                        self._defer_block(using, year, block)
+                    else:
+                        self._blocks[year] = block
+
+                take = min(count - len(numbers), block[1] - block[0] + 1)
+                numbers.extend(
+                    self.format_number(year, value)
+                    for value in range(block[0], block[0] + take)
+                )
+                block[0] += take
+
+        return numbers
+
+    def _get_block(self, connection, using, year):
+        """
+        Возвращает блок с оставшимися номерами или None
+        """
+        block = self._blocks.get(year)
+        if block is not None and block[0] <= block[1]:
+            return block
+        if not connection.in_atomic_block:
+            return None
+        key = (using, threading.get_ident(), year)
+        pending = self._pending.get(key)
+        if pending is None:
+            return None
+        block, on_commit = pending
+        # После отката транзакции или точки сохранения Django убирает ее
+        # обработчики on_commit - по ним видно, что резервирование отменено
+        registered = any(func is on_commit for _, func, _ in connection.run_on_commit)
+        if not registered or block[0] > block[1]:
+            del self._pending[key]
+            return None
+        return block
+
+    def _defer_block(self, using, year, block):
+        """
+        Делает блок, зарезервированный в транзакции, общим после ее фиксации
+        """
+        key = (using, threading.get_ident(), year)
+
+        def on_commit():
+            with self._lock:
+                if self._pending.get(key, (None,))[0] is block:
+                    del self._pending[key]
+                current = self._blocks.get(year)
+                if block[0] <= block[1] and (current is None or current[0] > current[1]):
+                    self._blocks[year] = block
+
+        self._pending[key] = (block, on_commit)
+        transaction.on_commit(on_commit, using=using)
+
+    def reset(self):
+        """
+        Сбрасывает зарезервированные блоки (например, после fork процесса)
+        """
+        with self._lock:
+            self._blocks.clear()
+            self._pending.clear()
+
+    def _reserve_block(self, year, size):
+        """
+        Резервирует в базе блок из size значений и возвращает его границы
+
+        Сначала выполняется UPDATE счетчика - он сразу берет блокировку на
+        запись, поэтому два процесса не могут прочитать одно и то же значение.
+        """
+        lookup = {'prefix': self.prefix, 'year': year}
+        for _ in range(2):
+            with transaction.atomic():
+                updated = DeliveryNumberSequence.objects.filter(**lookup).update(
+                    last_value=F('last_value') + size
+                )
+                if updated:
+                    last_value = DeliveryNumberSequence.objects.filter(
+                        **lookup
+                    ).values_list('last_value', flat=True).get()
+                    return last_value - size + 1, last_value
+
+            # Счетчика для этого года еще нет - создаем его, продолжая
+            # нумерацию уже существующих доставок с тем же префиксом
+            try:
+                with transaction.atomic():
+                    start = self._existing_max(year)
+                    DeliveryNumberSequence.objects.create(
+                        last_value=start + size, **lookup
+                    )
+                    return start + 1, start + size
+            except IntegrityError:
+                # Счетчик параллельно создал другой процесс - повторяем UPDATE
+                continue
+
+        raise RuntimeError('Не удалось зарезервировать блок номеров доставок')
+
+    def _existing_max(self, year):
+        """
+        Возвращает максимальный порядковый номер среди существующих доставок
+        """
+        number_prefix = f"{self.prefix}-{year}-"
+        last_number = Delivery.objects.filter(
+            number__startswith=number_prefix
+        ).annotate(
+            number_length=Length('number')
+        ).order_by('-number_length', '-number').values_list('number', flat=True).first()
+
+        if last_number:
+            suffix = last_number[len(number_prefix):]
+            if suffix.isdigit():
+                return int(suffix)
+        return 0
+
+
+allocator = DeliveryNumberAllocator()
+
+
+def next_delivery_number():
+    """
+    Возвращает новый номер доставки из общего распределителя процесса
+    """
+    return allocator.next_number()
+
+
+def allocate_delivery_numbers(count):
+    """
+    Возвращает count новых номеров доставок из общего распределителя процесса
+    """
+    return allocator.allocate(count)
+
+
+def is_server_number(number):
+    """
+    Проверяет, совпадает ли номер с форматом номеров, выдаваемых сервером
+    """
+    return allocator.is_server_number(number)
@@ -0,0 +1,110 @@
+"""
+Выборочные поля ответа (?fields= / ?exclude=) с проекцией в SQL
+
+По набору полей сериализатора определяется, какие столбцы загружать
+(only), какие связи присоединять (select_related) и какие подгружать
+отдельным запросом (prefetch_related). Поля, вычисляемые методами,
+объявляют используемые поля модели в атрибуте method_field_sources
+сериализатора.
+"""
+from django.core.exceptions import FieldDoesNotExist
+from rest_framework import serializers
+from rest_framework.exceptions import ValidationError
+
+
+def parse_field_list(value):
+    """
+    Разбирает список полей из параметра запроса ("a,b,c")
+    """
+    if not value:
+        return None
+    return [name.strip() for name in value.split(',') if name.strip()]
+
+
+class SparseFieldsMixin:
+    """
+    Миксин сериализатора, оставляющий только запрошенные поля
+
+    Принимает аргументы fields и exclude - списки имен полей.
+    Неизвестные имена отклоняются с ошибкой валидации.
+    """
+    method_field_sources = {}
+
+    def __init__(self, *args, fields=None, exclude=None, **kwargs):
+        super().__init__(*args, **kwargs)
+        if fields is None and exclude is None:
+            return
+
+        existing = set(self.fields)
+        unknown = set(fields or ()) | set(exclude or ())
+        unknown -= existing
+        if unknown:
+            raise ValidationError({'fields': f'Неизвестные поля: {", ".join(sorted(unknown))}'})
+
+        keep = set(fields if fields is not None else existing)
+        keep -= set(exclude or ())
+        for name in existing - keep:
+            self.fields.pop(name)
+
+
+def _model_field(model, name):
+    try:
+        return model._meta.get_field(name)
+    except FieldDoesNotExist:
+        return None
+
+
+def get_projection(serializer, model):
+    """
+    Возвращает (only, select_related, prefetch_related) для полей сериализатора
+    """
+    only = {model._meta.pk.name}
+    select_related = set()
+    prefetch_related = set()
+
+    for name, field in serializer.fields.items():
+        if isinstance(field, serializers.SerializerMethodField):
+            paths = [
+                source.split('__') for source in getattr(serializer, 'method_field_sources', {}).get(name, ())
+            ]
+        elif field.source == '*':
+            continue
+        else:
+            paths = [field.source.split('.')]
+
+        for attrs in paths:
+            model_field = _model_field(model, attrs[0])
+            if model_field is None:
+                continue
+            if model_field.many_to_many or model_field.one_to_many:
+                prefetch_related.add(attrs[0])
+            elif model_field.many_to_one or model_field.one_to_one:
+                only.add(attrs[0])
+                if len(attrs) > 1:
+                    select_related.add(attrs[0])
+                    only.add('__'.join(attrs))
+            else:
+                only.add(attrs[0])
+
+    return only, select_related, prefetch_related
+
+
+def apply_projection(queryset, serializer, allow_joins=True, include=()):
+    """
+    Ограничивает запрос столбцами и связями, нужными сериализатору
+
+    include - дополнительные столбцы модели, нужные самому представлению.
+    Без allow_joins (например, для архива в отдельной базе) загружаются
+    только собственные столбцы модели, без присоединения справочников.
+    """
+    only, select_related, prefetch_related = get_projection(serializer, queryset.model)
+    only.update(include)
+    if not allow_joins:
+        only = {name for name in only if '__' not in name}
+        return queryset.only(*only)
+
+    if select_related:
+        queryset = queryset.select_related(*sorted(select_related))
+    if prefetch_related:
+        queryset = queryset.prefetch_related(*sorted(prefetch_related))
+    return queryset.only(*only)
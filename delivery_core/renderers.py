@@ -0,0 +1,114 @@
+"""
+Колоночный формат списков доставок для мобильных клиентов
+
+Выбирается заголовком Accept: application/vnd.delivery.columnar+json
+(или ?format=columnar). Вместо массива объектов передаются имена столбцов
+и массивы значений по столбцам, а названия справочников - один раз в
+словаре references по id:
+
+    {
+        "count": 120, "next": "...", "previous": null,
+        "columns": ["id", "number", "transport_model", "status", ...],
+        "blocks": [[[1, 2], ["D-1", "D-2"], [3, 3], [1, 2], ...]],
+        "references": {"transport_model": {"3": "Грузовик"}, "status": {...}}
+    }
+
+Список может состоять из нескольких блоков (выгрузка формирует их
+потоком); значения i-й строки - i-е элементы массивов блока. Ответы,
+не являющиеся списками (карточка доставки, ошибки), передаются обычным JSON.
+"""
+from delivery_project.renderers import FastJSONRenderer, STREAM_CHUNK_SIZE
+
+
+class ColumnarJSONRenderer(FastJSONRenderer):
+    """
+    Рендерер списков в колоночном формате
+
+    Пары "поле с названием -> поле с id" берутся из атрибута
+    columnar_references представления. Поле с названием заменяется
+    словарем references, только если в ответе есть и поле с id.
+    """
+    media_type = 'application/vnd.delivery.columnar+json'
+    format = 'columnar'
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        renderer_context = renderer_context or {}
+        references = self.get_reference_fields(renderer_context.get('view'))
+        if isinstance(data, list):
+            data = self.to_columnar(data, references)
+        elif isinstance(data, dict) and isinstance(data.get('results'), list):
+            payload = {key: value for key, value in data.items() if key != 'results'}
+            payload.update(self.to_columnar(data['results'], references))
+            data = payload
+        return super().render(data, accepted_media_type, renderer_context)
+
+    def get_reference_fields(self, view):
+        return getattr(view, 'columnar_references', {})
+
+    def get_columns(self, row, references):
+        """
+        Возвращает (столбцы, {поле с названием: поле с id}) для строк вида row
+        """
+        replaced = {
+            name_field: id_field for name_field, id_field in references.items()
+            if name_field in row and id_field in row
+        }
+        return [key for key in row if key not in replaced], replaced
+
+    def to_columnar(self, rows, references):
+        if not rows:
+            return {'columns': [], 'blocks': [], 'references': {}}
+        columns, replaced = self.get_columns(rows[0], references)
+        names = {id_field: {} for id_field in replaced.values()}
+        return {
+            'columns': columns,
+            'blocks': [self._make_block(rows, columns, replaced, names)],
+            'references': names,
+        }
+
+    def _make_block(self, rows, columns, replaced, names):
+        for name_field, id_field in replaced.items():
+            column_names = names[id_field]
+            for row in rows:
+                key = row.get(id_field)
+                if key is not None:
+                    column_names[key] = row.get(name_field)
+        return [[row.get(column) for row in rows] for column in columns]
+
+    def render_json(self, data):
+        """
+        Кодирует данные как есть, без преобразования в колоночный вид
+        """
+        return FastJSONRenderer.render(self, data)
+
+    def stream(self, items, chunk_size=STREAM_CHUNK_SIZE, view=None):
+        """
+        Выдает колоночный список частями: каждый блок - chunk_size строк,
+        словарь references - в конце ответа
+        """
+        references = self.get_reference_fields(view)
+        columns = replaced = names = None
+        chunk = []
+        first = True
+
+        def flush():
+            block = self.render_json(self._make_block(chunk, columns, replaced, names))
+            return block if first else b',' + block
+
+        for item in items:
+            if columns is None:
+                columns, replaced = self.get_columns(item, references)
+                names = {id_field: {} for id_field in replaced.values()}
+                yield b'{"columns":' + self.render_json(columns) + b',"blocks":['
+            chunk.append(item)
+            if len(chunk) >= chunk_size:
+                yield flush()
+                first = False
+                chunk = []
+
+        if columns is None:
+            yield self.render_json(self.to_columnar([], references))
+            return
+        if chunk:
+            yield flush()
+        yield b'],"references":' + self.render_json(names) + b'}'
@@ -1,6 +1,13 @@
 from rest_framework import serializers
 from django.contrib.auth.models import User
-from .models import Delivery
+from django.db import transaction
+from . import events
+from .derivatives import get_derivative_urls, schedule_derivatives_many
+from .models import Delivery, UploadSession
+from .projection import SparseFieldsMixin
+from .numbering import allocate_delivery_numbers, is_server_number, next_delivery_number
+from .storage import add_references
+from .uploads import get_max_upload_size
 from references.serializers import ServiceSerializer
 
 
@@ -15,17 +22,37 @@ class UserSerializer(serializers.ModelSerializer):
         fields = ('id', 'username', 'email', 'first_name', 'last_name')
 
 
-class DeliveryListSerializer(serializers.ModelSerializer):
+class MediaDerivativesMixin:
+    """
+    Ссылки на уменьшенные копии изображения доставки (миниатюры и превью)
+    
+    Пока копии не построены, возвращается пустой словарь.
+    """
+    
+    def get_media_derivatives(self, obj):
+        if not obj.media_file:
+            return {}
+        # В быстром пути (fast_serializers) media_file - строка с именем файла
+        name = getattr(obj.media_file, 'name', obj.media_file)
+        return get_derivative_urls(name, obj.number, self.context.get('request'))
+
+
+class DeliveryListSerializer(SparseFieldsMixin, MediaDerivativesMixin, serializers.ModelSerializer):
     """
     Сериализатор для списка доставок с минимумом полей
     
     Используется при выводе доставок в списке для улучшения производительности.
     Содержит только основные поля, необходимые для отображения в таблице.
     """
+    method_field_sources = {
+        'travel_time': ('departure_time', 'arrival_time'),
+        'media_derivatives': ('media_file', 'number'),
+    }
     transport_model_name = serializers.CharField(source='transport_model.name', read_only=True)
     status_name = serializers.CharField(source='status.name', read_only=True)
     packaging_name = serializers.CharField(source='packaging.name', read_only=True)
     travel_time = serializers.SerializerMethodField()
+    media_derivatives = serializers.SerializerMethodField()
     
     class Meta:
         model = Delivery
@@ -33,7 +60,7 @@ class DeliveryListSerializer(serializers.ModelSerializer):
             'id', 'number', 'transport_model', 'transport_model_name',
             'departure_time', 'arrival_time', 'travel_time',
             'distance', 'status', 'status_name', 
-            'condition', 'packaging', 'packaging_name'
+            'condition', 'packaging', 'packaging_name', 'media_derivatives'
         )
     
     def get_travel_time(self, obj):
@@ -43,12 +70,13 @@ class DeliveryListSerializer(serializers.ModelSerializer):
         return obj.travel_time_hours()
 
 
-class DeliveryDetailSerializer(serializers.ModelSerializer):
+class DeliveryDetailSerializer(SparseFieldsMixin, MediaDerivativesMixin, serializers.ModelSerializer):
     """
     Подробный сериализатор для доставки
     
     Включает все поля и связанные данные для детального просмотра доставки.
     """
+    method_field_sources = DeliveryListSerializer.method_field_sources
     transport_model_name = serializers.CharField(source='transport_model.name', read_only=True)
     status_name = serializers.CharField(source='status.name', read_only=True)
     packaging_name = serializers.CharField(source='packaging.name', read_only=True)
@@ -57,6 +85,7 @@ class DeliveryDetailSerializer(serializers.ModelSerializer):
     created_by_name = serializers.CharField(source='created_by.username', read_only=True, allow_null=True)
     updated_by_name = serializers.CharField(source='updated_by.username', read_only=True, allow_null=True)
     travel_time = serializers.SerializerMethodField()
+    media_derivatives = serializers.SerializerMethodField()
     
     class Meta:
         model = Delivery
@@ -64,7 +93,7 @@ class DeliveryDetailSerializer(serializers.ModelSerializer):
         extra_fields = (
             'transport_model_name', 'status_name', 'packaging_name', 
             'cargo_type_name', 'services_data', 'created_by_name', 
-            'updated_by_name', 'travel_time'
+            'updated_by_name', 'travel_time', 'media_derivatives'
         )
     
     def get_travel_time(self, obj):
@@ -74,16 +103,91 @@ class DeliveryDetailSerializer(serializers.ModelSerializer):
         return obj.travel_time_hours()
 
 
+class DeliveryBulkCreateSerializer(serializers.ListSerializer):
+    """
+    Сериализатор для массового создания доставок
+    
+    Выдает номера всем доставкам пакета одним обращением к распределителю
+    и сохраняет доставки и их связи с услугами через bulk_create.
+    """
+    def validate(self, attrs):
+        """
+        Проверяет, что переданные клиентом номера не повторяются в пакете
+        """
+        numbers = [item['number'] for item in attrs if item.get('number')]
+        duplicates = sorted({number for number in numbers if numbers.count(number) > 1})
+        if duplicates:
+            raise serializers.ValidationError({
+                'number': f"Номера повторяются в пакете: {', '.join(duplicates)}"
+            })
+        return attrs
+    
+    def create(self, validated_data):
+        """
+        Создает пакет доставок с информацией о пользователе-создателе
+        """
+        request = self.context.get("request")
+        user = request.user if request else None
+        
+        missing_numbers = [item for item in validated_data if not item.get('number')]
+        allocated = allocate_delivery_numbers(len(missing_numbers))
+        for item, number in zip(missing_numbers, allocated):
+            item['number'] = number
+        
+        services_list = [item.pop('services', []) for item in validated_data]
+        Through = Delivery.services.through
+        
+        with transaction.atomic():
+            deliveries = Delivery.objects.bulk_create([
+                Delivery(**item, created_by=user, updated_by=user)
+                for item in validated_data
+            ])
+            Through.objects.bulk_create([
+                Through(delivery_id=delivery.pk, service_id=service.pk)
+                for delivery, services in zip(deliveries, services_list)
+                for service in services
+            ])
+            # bulk_create не отправляет сигналы - учитываем ссылки на медиа-файлы
+            # и ставим изображения в очередь построения копий сами
+            media_names = [delivery.media_file.name for delivery in deliveries if delivery.media_file]
+            add_references(media_names)
+            transaction.on_commit(lambda: schedule_derivatives_many(media_names))
+            payloads = [events.delivery_payload(delivery) for delivery in deliveries]
+            transaction.on_commit(lambda: events.publish_many(events.EVENT_CREATED, payloads))
+        
+        return deliveries
+
+
 class DeliveryCreateUpdateSerializer(serializers.ModelSerializer):
     """
     Сериализатор для создания/обновления доставки
     
     Используется при создании новой доставки или обновлении существующей.
     Содержит валидацию данных и логику сохранения информации о пользователе.
+    Если номер не передан, он выдается сервером (см. delivery_core.numbering).
     """
     class Meta:
         model = Delivery
         exclude = ('created_at', 'updated_at', 'created_by', 'updated_by')
+        extra_kwargs = {
+            'number': {'required': False},
+        }
+        list_serializer_class = DeliveryBulkCreateSerializer
+    
+    def validate_number(self, value):
+        """
+        Отклоняет номера клиента в формате номеров, выдаваемых сервером
+        
+        Такой номер позже выдал бы распределитель, и создание доставки
+        с ним завершилось бы ошибкой уникальности.
+        """
+        if self.instance is not None and value == self.instance.number:
+            return value
+        if is_server_number(value):
+            raise serializers.ValidationError(
+                'Номер в этом формате выдается сервером - не передавайте number'
+            )
+        return value
     
     def validate(self, data):
         """
@@ -107,6 +211,9 @@ class DeliveryCreateUpdateSerializer(serializers.ModelSerializer):
         request = self.context.get("request")
         user = request.user if request else None
         
+        if not validated_data.get('number'):
+            validated_data['number'] = next_delivery_number()
+        
         delivery = Delivery.objects.create(**validated_data, created_by=user, updated_by=user)
         
         if services:
@@ -134,4 +241,40 @@ class DeliveryCreateUpdateSerializer(serializers.ModelSerializer):
         if services is not None:
             instance.services.set(services)
             
-        return instance 
\ No newline at end of file
+        return instance
+
+
+class UploadSessionSerializer(serializers.ModelSerializer):
+    """
+    Сериализатор сессии возобновляемой загрузки медиа-файла
+    
+    При создании клиент передает имя файла, его размер и, при желании,
+    SHA-256 для проверки целостности после загрузки.
+    """
+    class Meta:
+        model = UploadSession
+        fields = (
+            'id', 'filename', 'size', 'checksum', 'delivery',
+            'received', 'status', 'created_at', 'updated_at'
+        )
+        read_only_fields = ('received', 'status', 'created_at', 'updated_at')
+    
+    def validate_size(self, value):
+        """
+        Проверяет, что размер файла не превышает допустимый
+        """
+        max_size = get_max_upload_size()
+        if value <= 0:
+            raise serializers.ValidationError('Размер файла должен быть больше нуля')
+        if value > max_size:
+            raise serializers.ValidationError(f'Размер файла превышает допустимый ({max_size} байт)')
+        return value
+    
+    def validate_checksum(self, value):
+        """
+        Проверяет формат SHA-256 (64 шестнадцатеричных символа)
+        """
+        value = value.lower()
+        if value and (len(value) != 64 or any(char not in '0123456789abcdef' for char in value)):
+            raise serializers.ValidationError('Ожидается SHA-256 в шестнадцатеричном виде')
+        return value
@@ -0,0 +1,84 @@
+"""
+Обработчики сигналов модели Delivery
+
+Исходные значения отслеживаемых полей запоминаются при загрузке доставки
+из базы (Delivery.from_db), поэтому изменения определяются без
+дополнительных запросов.
+"""
+from django.db import transaction
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+
+from . import events
+from .derivatives import schedule_derivatives
+from .models import Delivery
+from .storage import add_references, remove_references
+from .sync import record_tombstones, tombstones_suppressed
+
+
+@receiver(post_save, sender=Delivery)
+def update_media_references(sender, instance, created, **kwargs):
+    """
+    Обновляет счетчики ссылок блобов при смене медиа-файла доставки
+    и ставит новое изображение в очередь построения копий
+    """
+    loaded = getattr(instance, '_loaded_values', None)
+    if not created and (loaded is None or 'media_file' not in loaded):
+        # Исходное значение неизвестно - счетчик сверит gc_media
+        return
+    
+    old_name = loaded.get('media_file') if loaded else None
+    new_name = instance.media_file.name if instance.media_file else None
+    if old_name != new_name:
+        add_references([new_name])
+        remove_references([old_name])
+        if new_name:
+            # Копии изображения строятся вне запроса после фиксации транзакции
+            transaction.on_commit(lambda: schedule_derivatives(new_name), using=kwargs.get('using'))
+    
+    if loaded is None:
+        instance._loaded_values = {}
+    instance._loaded_values['media_file'] = new_name
+
+
+@receiver(post_save, sender=Delivery)
+def publish_delivery_change(sender, instance, created, **kwargs):
+    """
+    Публикует событие создания, изменения или смены статуса доставки
+    подписчикам потока событий после фиксации транзакции
+    """
+    loaded = getattr(instance, '_loaded_values', None)
+    if loaded is None:
+        loaded = instance._loaded_values = {}
+    
+    previous_status = loaded.get('status_id')
+    if created:
+        kind, previous_status = events.EVENT_CREATED, None
+    elif 'status_id' in loaded and previous_status != instance.status_id:
+        kind = events.EVENT_STATUS_CHANGED
+    else:
+        kind, previous_status = events.EVENT_UPDATED, None
+    loaded['status_id'] = instance.status_id
+    
+    payload = events.delivery_payload(instance, previous_status)
+    transaction.on_commit(lambda: events.publish(kind, payload), using=kwargs.get('using'))
+
+
+@receiver(post_delete, sender=Delivery)
+def release_media_reference(sender, instance, **kwargs):
+    """
+    Уменьшает счетчик ссылок блоба при удалении доставки
+    """
+    if instance.media_file:
+        remove_references([instance.media_file.name])
+
+
+@receiver(post_delete, sender=Delivery)
+def record_delivery_tombstone(sender, instance, **kwargs):
+    """
+    Записывает отметку об удалении доставки для клиентов синхронизации
+    """
+    if not tombstones_suppressed():
+        record_tombstones([(instance.pk, instance.number)])
+        payload = events.delivery_payload(instance)
+        transaction.on_commit(lambda: events.publish(events.EVENT_DELETED, payload), using=kwargs.get('using'))
@@ -0,0 +1,163 @@
+"""
+Хранилище медиа-файлов доставок с адресацией по содержимому
+
+Файл сохраняется под именем, вычисленным из SHA-256 его содержимого:
+``delivery_files/cas/ab/cd/abcd...ef.jpg``. Одинаковые файлы, прикрепленные
+к разным доставкам, хранятся на диске один раз. Для каждого блоба ведется
+запись MediaBlob со счетчиком ссылок, который поддерживается сигналами
+модели Delivery. Блобы, на которые больше не ссылается ни одна доставка,
+удаляет команда gc_media.
+"""
+import hashlib
+import os
+import tempfile
+from collections import Counter
+
+from django.core.files.move import file_move_safe
+from django.core.files.storage import FileSystemStorage, storages
+from django.db.models import F
+
+
+CAS_PREFIX = 'delivery_files/cas'
+READ_BLOCK_SIZE = 64 * 1024
+
+
+def get_delivery_media_storage():
+    """
+    Возвращает хранилище для Delivery.media_file (STORAGES['delivery_media'])
+    """
+    return storages['delivery_media']
+
+
+def blob_name(digest, extension=''):
+    """
+    Возвращает имя блоба в хранилище по SHA-256 содержимого
+    """
+    return f'{CAS_PREFIX}/{digest[:2]}/{digest[2:4]}/{digest}{extension}'
+
+
+def is_blob_name(name):
+    return bool(name) and name.startswith(CAS_PREFIX + '/')
+
+
+class ContentAddressedStorage(FileSystemStorage):
+    """
+    Файловое хранилище с дедупликацией по SHA-256 содержимого
+
+    Имя, сформированное upload_to, используется только для расширения файла.
+    Содержимое сначала пишется во временный файл внутри хранилища с подсчетом
+    хэша, затем атомарно переименовывается в имя блоба; если такой блоб уже
+    есть, временный файл удаляется. Если у загруженного файла на диске есть
+    атрибут sha256 (хэш посчитан при приеме), файл не читается повторно.
+    """
+
+    def get_available_name(self, name, max_length=None):
+        # Имена блобов определяются содержимым и не конфликтуют между собой
+        return name
+
+    def _save(self, name, content):
+        extension = os.path.splitext(name)[1].lower()
+        temp_dir = self.path(f'{CAS_PREFIX}/tmp')
+        os.makedirs(temp_dir, exist_ok=True)
+
+        if hasattr(content, 'temporary_file_path'):
+            source_path = content.temporary_file_path()
+            digest = getattr(content, 'sha256', None)
+            if digest:
+                size = os.path.getsize(source_path)
+            else:
+                digest, size = self._hash_file(source_path)
+            move_source = True
+        else:
+            source_path, digest, size = self._spool(content, temp_dir)
+            move_source = False
+
+        name = blob_name(digest, extension)
+        full_path = self.path(name)
+        os.makedirs(os.path.dirname(full_path), exist_ok=True)
+
+        if self._touch(full_path):
+            # Такой файл уже хранится - новая копия не нужна
+            try:
+                os.remove(source_path)
+            except FileNotFoundError:
+                pass
+        elif move_source:
+            file_move_safe(source_path, full_path, allow_overwrite=True)
+        else:
+            os.replace(source_path, full_path)
+
+        if self.file_permissions_mode is not None:
+            os.chmod(full_path, self.file_permissions_mode)
+
+        register_blob(name, digest, size)
+        return name
+
+    def _touch(self, path):
+        """
+        Обновляет время изменения существующего блоба; False, если блоба нет
+
+        gc_media отсчитывает период ожидания от времени изменения, поэтому
+        блоб, на который только что сослалась новая загрузка, не удаляется,
+        пока она не зафиксировала доставку.
+        """
+        try:
+            os.utime(path)
+        except FileNotFoundError:
+            return False
+        return True
+
+    def _hash_file(self, path):
+        hasher = hashlib.sha256()
+        size = 0
+        with open(path, 'rb') as source:
+            for block in iter(lambda: source.read(READ_BLOCK_SIZE), b''):
+                hasher.update(block)
+                size += len(block)
+        return hasher.hexdigest(), size
+
+    def _spool(self, content, temp_dir):
+        hasher = hashlib.sha256()
+        size = 0
+        fd, temp_path = tempfile.mkstemp(dir=temp_dir, suffix='.part')
+        try:
+            with os.fdopen(fd, 'wb') as temp_file:
+                for chunk in content.chunks():
+                    temp_file.write(chunk)
+                    hasher.update(chunk)
+                    size += len(chunk)
+        except BaseException:
+            os.remove(temp_path)
+            raise
+        return temp_path, hasher.hexdigest(), size
+
+
+def register_blob(name, digest, size):
+    """
+    Создает запись MediaBlob для нового блоба (счетчик ссылок начинается с нуля)
+    """
+    from .models import MediaBlob
+
+    MediaBlob.objects.get_or_create(name=name, defaults={'sha256': digest, 'size': size})
+
+
+def _adjust_references(names, sign):
+    from .models import MediaBlob
+
+    counts = Counter(name for name in names if is_blob_name(name))
+    for name, count in counts.items():
+        MediaBlob.objects.filter(name=name).update(ref_count=F('ref_count') + sign * count)
+
+
+def add_references(names):
+    """
+    Увеличивает счетчики ссылок блобов (имена не из хранилища блобов пропускаются)
+    """
+    _adjust_references(names, 1)
+
+
+def remove_references(names):
+    """
+    Уменьшает счетчики ссылок блобов
+    """
+    _adjust_references(names, -1)
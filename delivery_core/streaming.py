@@ -0,0 +1,150 @@
+"""
+Потоки событий доставок для клиентов: Server-Sent Events и WebSocket
+
+- GET /api/delivery/events/ - поток SSE (text/event-stream), представление
+  delivery_events в delivery_core.views;
+- /api/delivery/events/ws/ - WebSocket, обрабатывается websocket_application
+  напрямую из delivery_project.asgi, минуя обработчик запросов Django.
+
+Оба потока фильтруются параметрами status и transport_model (id через
+запятую). Клиент WebSocket может сменить фильтры, отправив сообщение
+{"status": [1, 2], "transport_model": [3]}. Токен JWT передается заголовком
+Authorization или параметром token (EventSource и WebSocket в браузере не
+позволяют задать заголовок). Потоки работают только под ASGI-сервером.
+"""
+import asyncio
+import json
+from urllib.parse import parse_qs
+
+from django.conf import settings
+from rest_framework.exceptions import AuthenticationFailed
+
+from delivery_project.async_views import aget_token_user, bearer_token
+from .events import OVERFLOW, broker, parse_id_list
+
+
+WEBSOCKET_PATH = '/api/delivery/events/ws/'
+
+# Коды закрытия WebSocket
+CLOSE_UNAUTHORIZED = 4401
+CLOSE_BAD_REQUEST = 4400
+CLOSE_TRY_AGAIN_LATER = 1013
+
+
+async def authenticate_token(raw_token):
+    """
+    Возвращает активного пользователя по токену доступа JWT или None
+    """
+    if not raw_token:
+        return None
+    try:
+        return await aget_token_user(raw_token)
+    except AuthenticationFailed:
+        return None
+
+
+def has_free_slot():
+    return broker.subscriber_count < settings.DELIVERY_EVENTS_MAX_CONNECTIONS
+
+
+def _drain(subscription, first):
+    """
+    Забирает из очереди событие first и все уже накопившиеся за ним
+    """
+    events = [first]
+    while first is not OVERFLOW and not subscription.queue.empty():
+        first = subscription.queue.get_nowait()
+        events.append(first)
+    return events
+
+
+async def sse_stream(statuses, transport_models):
+    """
+    Тело ответа SSE: события, пачкой из всех накопившихся, и комментарии
+    ping раз в DELIVERY_EVENTS_HEARTBEAT секунд простоя
+    """
+    subscription = broker.subscribe(statuses, transport_models)
+    try:
+        yield b'retry: 5000\n\n'
+        while True:
+            event = await subscription.get(settings.DELIVERY_EVENTS_HEARTBEAT)
+            if event is None:
+                yield b': ping\n\n'
+                continue
+            events = _drain(subscription, event)
+            yield ''.join(
+                f'id: {item.id}\nevent: {item.kind}\ndata: {item.data}\n\n' if item.id is not None
+                else f'event: {item.kind}\ndata: {item.data}\n\n'
+                for item in events
+            ).encode()
+            if events[-1] is OVERFLOW:
+                return
+    finally:
+        broker.unsubscribe(subscription)
+
+
+async def _receive_filters(receive, subscription):
+    """
+    Принимает сообщения клиента WebSocket до отключения
+    """
+    while True:
+        message = await receive()
+        if message['type'] == 'websocket.disconnect':
+            return
+        if message['type'] != 'websocket.receive':
+            continue
+        try:
+            filters = json.loads(message.get('text') or message.get('bytes') or '{}')
+            subscription.set_filters(
+                parse_id_list(','.join(map(str, filters.get('status', [])))),
+                parse_id_list(','.join(map(str, filters.get('transport_model', [])))),
+            )
+        except (ValueError, TypeError, AttributeError):
+            # Некорректное сообщение не меняет фильтры
+            continue
+
+
+async def websocket_application(scope, receive, send):
+    """
+    ASGI-приложение потока событий доставок по WebSocket
+    """
+    message = await receive()
+    if message['type'] != 'websocket.connect':
+        return
+
+    params = parse_qs(scope.get('query_string', b'').decode())
+    headers = dict(scope.get('headers', ()))
+    token = (params.get('token') or [None])[0] or bearer_token(headers.get(b'authorization', b'').decode())
+    if await authenticate_token(token) is None:
+        await send({'type': 'websocket.close', 'code': CLOSE_UNAUTHORIZED})
+        return
+    try:
+        statuses = parse_id_list((params.get('status') or [''])[0])
+        transport_models = parse_id_list((params.get('transport_model') or [''])[0])
+    except ValueError:
+        await send({'type': 'websocket.close', 'code': CLOSE_BAD_REQUEST})
+        return
+    if not has_free_slot():
+        await send({'type': 'websocket.close', 'code': CLOSE_TRY_AGAIN_LATER})
+        return
+
+    await send({'type': 'websocket.accept'})
+    subscription = broker.subscribe(statuses, transport_models)
+    receiver = asyncio.ensure_future(_receive_filters(receive, subscription))
+    getter = None
+    try:
+        while True:
+            getter = asyncio.ensure_future(subscription.queue.get())
+            done, _ = await asyncio.wait({getter, receiver}, return_when=asyncio.FIRST_COMPLETED)
+            if getter not in done:
+                return
+            for event in _drain(subscription, getter.result()):
+                await send({'type': 'websocket.send', 'text': event.data})
+                if event is OVERFLOW:
+                    await send({'type': 'websocket.close', 'code': CLOSE_TRY_AGAIN_LATER})
+                    return
+    finally:
+        if getter is not None:
+            getter.cancel()
+        receiver.cancel()
+        broker.unsubscribe(subscription)
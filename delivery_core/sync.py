@@ -0,0 +1,135 @@
+"""
+Синхронизация изменений доставок по курсору
+
+Клиент передает курсор из предыдущего ответа и получает доставки,
+измененные после него (по индексу (updated_at, id)), и отметки об
+удалении (DeliveryTombstone, по индексу (deleted_at, id)). Стоимость
+запроса пропорциональна количеству изменений, а не размеру таблицы.
+
+Курсор - подписанная строка с позициями в обоих потоках; клиент не
+должен разбирать его. Изменения моложе DELIVERY_SYNC_LAG_SECONDS не
+выдаются: updated_at заполняется в Python при сохранении, а не при
+фиксации, и транзакция, записавшая более раннее время, может
+зафиксироваться позже. Без этой задержки курсор ушел бы вперед ее
+изменений, поэтому задержка должна быть не меньше самой долгой
+транзакции записи доставок - с ожиданием блокировки SQLite
+(SQLITE_BUSY_TIMEOUT), пачкой group commit и атомарным пакетным запросом.
+Изменения читаются только из основной базы (primary_db_actions).
+"""
+import contextvars
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+
+from django.conf import settings
+from django.core import signing
+from django.utils import timezone
+
+from .models import DeliveryTombstone
+
+
+CURSOR_SALT = 'delivery_core.sync'
+
+_tombstones_suppressed = contextvars.ContextVar('delivery_tombstones_suppressed', default=False)
+
+
+class InvalidCursor(Exception):
+    """
+    Курсор поврежден или устарел - клиенту нужна полная синхронизация
+    """
+
+
+@contextmanager
+def suppress_tombstones():
+    """
+    Отключает запись отметок об удалении сигналом post_delete
+    (например, когда их записывает перенос в архив)
+    """
+    token = _tombstones_suppressed.set(True)
+    try:
+        yield
+    finally:
+        _tombstones_suppressed.reset(token)
+
+
+def tombstones_suppressed():
+    return _tombstones_suppressed.get()
+
+
+def record_tombstones(deliveries, reason=DeliveryTombstone.REASON_DELETED):
+    """
+    Записывает отметки об удалении для пар (id, номер)
+    """
+    DeliveryTombstone.objects.bulk_create([
+        DeliveryTombstone(delivery_id=delivery_id, number=number, reason=reason)
+        for delivery_id, number in deliveries
+    ])
+
+
+def _position(timestamp, pk):
+    return [timestamp.isoformat(), pk] if timestamp is not None else None
+
+
+def _parse_position(value):
+    if value is None:
+        return None
+    timestamp, pk = value
+    return datetime.fromisoformat(timestamp), int(pk)
+
+
+def encode_cursor(changes, tombstones):
+    return signing.dumps({'c': changes, 't': tombstones}, salt=CURSOR_SALT, compress=True)
+
+
+def decode_cursor(cursor):
+    """
+    Возвращает позиции (изменения, удаления) из курсора
+    """
+    try:
+        data = signing.loads(cursor, salt=CURSOR_SALT)
+        changes, tombstones = _parse_position(data['c']), _parse_position(data['t'])
+    except (signing.BadSignature, KeyError, TypeError, ValueError):
+        raise InvalidCursor('Курсор синхронизации недействителен')
+
+    retention = getattr(settings, 'DELIVERY_TOMBSTONE_RETENTION_DAYS', 30)
+    if tombstones is not None and tombstones[0] < timezone.now() - timedelta(days=retention):
+        # Отметки старше срока хранения могли быть удалены
+        raise InvalidCursor('Курсор синхронизации устарел, требуется полная синхронизация')
+    return changes, tombstones
+
+
+def _after(queryset, field, position, horizon):
+    queryset = queryset.filter(**{f'{field}__lte': horizon})
+    if position is not None:
+        timestamp, pk = position
+        queryset = queryset.filter(**{f'{field}__gte': timestamp}).exclude(**{field: timestamp, 'id__lte': pk})
+    return queryset.order_by(field, 'id')
+
+
+def fetch_changes(queryset, cursor=None, limit=500):
+    """
+    Возвращает (доставки, отметки об удалении, новый курсор, есть ли еще)
+
+    queryset - доставки с нужной проекцией полей. Без курсора выдаются
+    все доставки, а отметки об удалении - только новые.
+    """
+    horizon = timezone.now() - timedelta(seconds=getattr(settings, 'DELIVERY_SYNC_LAG_SECONDS', 30))
+    if cursor:
+        changes_position, tombstones_position = decode_cursor(cursor)
+    else:
+        changes_position, tombstones_position = None, (horizon, 0)
+
+    deliveries = list(_after(queryset, 'updated_at', changes_position, horizon)[:limit + 1])
+    tombstones = list(_after(
+        DeliveryTombstone.objects.all(), 'deleted_at', tombstones_position, horizon
+    )[:limit + 1])
+
+    has_more = len(deliveries) > limit or len(tombstones) > limit
+    deliveries, tombstones = deliveries[:limit], tombstones[:limit]
+
+    if deliveries:
+        changes_position = (deliveries[-1].updated_at, deliveries[-1].pk)
+    if tombstones:
+        tombstones_position = (tombstones[-1].deleted_at, tombstones[-1].pk)
+
+    new_cursor = encode_cursor(_position(*changes_position) if changes_position else None, _position(*tombstones_position))
+    return deliveries, tombstones, new_cursor, has_more
@@ -1,3 +1,1063 @@
-from django.test import TestCase
+import gc
+import hashlib
+import io
+import json
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import time
+from collections import Counter
+from datetime import date, datetime, timedelta, timezone as dt_timezone
+from decimal import Decimal
+from unittest import mock
+from urllib.parse import parse_qs, urlsplit
 
-# Create your tests here.
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.exceptions import ImproperlyConfigured
+from django.core.cache import cache
+from django.core.files import locks
+from django.core.files.base import ContentFile
+from django.core.management import call_command
+from django.db import connection, transaction
+from django.db.models import Count
+from django.test import AsyncClient, TestCase, TransactionTestCase, override_settings
+from django.urls import reverse
+from django.utils import timezone
+from django.utils.crypto import salted_hmac
+from PIL import Image
+from rest_framework.renderers import JSONRenderer
+from rest_framework.test import APIClient
+
+from references.models import CargoType, DeliveryStatus, PackagingType, Service, TransportModel
+from . import derivatives, uploads
+from .archive import HotColdResults, archive_chunk
+from .downloads import SIGNATURE_SALT, check_signature
+from .facets import count_facets
+from .fast_serializers import compile_serializer
+from .models import ArchivedDelivery, Delivery, DeliveryNumberSequence, MediaBlob, UploadSession
+from .numbering import DeliveryNumberAllocator
+from .renderers import ColumnarJSONRenderer
+from .serializers import DeliveryCreateUpdateSerializer, DeliveryDetailSerializer, DeliveryListSerializer
+from .storage import get_delivery_media_storage
+from .uploads import get_session_path
+from .views import DeliveryViewSet
+from delivery_project.db_profiles import build_database
+from delivery_project.db_routing import _view_uses_primary
+from delivery_project.metrics import MetricsRegistry
+from delivery_project.profiling import get_report_path
+from delivery_project.renderers import FastJSONRenderer
+from delivery_project.slow_queries import log_slow_queries
+from .write_queue import GroupCommitWriter, WriteTimeout, run_write
+
+
+def create_references():
+    """
+    Создает минимальный набор справочников для доставок
+    """
+    return {
+        'transport_model': TransportModel.objects.create(name='Газель', code='gazelle'),
+        'packaging': PackagingType.objects.create(name='Коробка', code='box'),
+        'status': DeliveryStatus.objects.create(name='В пути', code='in_transit'),
+    }
+
+
+def delivery_payload(references, **overrides):
+    """
+    Тело запроса на создание доставки
+    """
+    departure = timezone.now().replace(microsecond=0)
+    payload = {
+        'transport_model': references['transport_model'].pk,
+        'packaging': references['packaging'].pk,
+        'status': references['status'].pk,
+        'departure_time': departure.isoformat(),
+        'arrival_time': (departure + timedelta(hours=3)).isoformat(),
+        'distance': '120.50',
+    }
+    payload.update(overrides)
+    return payload
+
+
+def api_client(user):
+    client = APIClient(HTTP_HOST='localhost')
+    client.force_authenticate(user)
+    return client
+
+
+class AtomicBatchTests(TransactionTestCase):
+    """
+    Атомарный пакетный запрос откатывает записи в обоих режимах записи
+    """
+
+    def setUp(self):
+        self.references = create_references()
+        self.user = User.objects.create_user('batch', password='x')
+        self.client = api_client(self.user)
+
+    def post_failing_batch(self):
+        return self.client.post('/api/batch/', {
+            'atomic': True,
+            'requests': [
+                {'method': 'POST', 'path': '/api/delivery/deliveries/',
+                 'body': delivery_payload(self.references)},
+                {'method': 'GET', 'path': '/api/delivery/deliveries/999999/'},
+            ],
+        }, format='json')
+
+    def assert_rolled_back(self, response):
+        self.assertEqual(response.status_code, 200)
+        data = response.json()
+        self.assertTrue(data['rolled_back'])
+        self.assertEqual([item['status'] for item in data['responses']], [201, 404])
+        self.assertFalse(Delivery.objects.exists())
+
+    @override_settings(DELIVERY_WRITE_COALESCING=False)
+    def test_rollback_without_coalescing(self):
+        self.assert_rolled_back(self.post_failing_batch())
+
+    @override_settings(DELIVERY_WRITE_COALESCING=True, DELIVERY_WRITE_TIMEOUT=5)
+    def test_rollback_with_coalescing(self):
+        self.assert_rolled_back(self.post_failing_batch())
+
+    @override_settings(DELIVERY_WRITE_COALESCING=True, DELIVERY_WRITE_TIMEOUT=5)
+    def test_coalesced_write_outside_transaction_uses_writer(self):
+        thread_name = lambda: threading.current_thread().name
+        self.assertEqual(run_write(thread_name), 'delivery-group-commit')
+
+
+class RunWriteTests(TestCase):
+    """
+    Внутри транзакции запись выполняется в текущем потоке
+    """
+
+    @override_settings(DELIVERY_WRITE_COALESCING=True)
+    def test_inline_inside_atomic_block(self):
+        thread_name = lambda: threading.current_thread().name
+        self.assertEqual(run_write(thread_name), threading.current_thread().name)
+
+
+class GroupCommitTimeoutTests(TestCase):
+    """
+    Операция, не дождавшаяся пачки, отменяется и не выполняется
+    """
+
+    def setUp(self):
+        self.writer = GroupCommitWriter()
+        # Поток-писатель не запускается - пачки разбираются в тесте
+        patcher = mock.patch.object(self.writer, '_ensure_started')
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_timed_out_operation_is_skipped(self):
+        func = mock.Mock()
+        with self.assertRaises(WriteTimeout):
+            self.writer.submit(func, timeout=0.01)
+        self.writer._commit([self.writer._queue.get_nowait()])
+        func.assert_not_called()
+
+    def test_started_operation_returns_its_result(self):
+        def start_batch():
+            operation = self.writer._queue.get()
+            operation.future.set_running_or_notify_cancel()
+            time.sleep(0.1)
+            operation.future.set_result('committed')
+
+        worker = threading.Thread(target=start_batch)
+        worker.start()
+        self.assertEqual(self.writer.submit(mock.Mock(), timeout=0.03), 'committed')
+        worker.join()
+
+
+class BatchRoutingTests(TestCase):
+    """
+    Пакет выполняет только эндпоинты API на представлениях DRF
+    """
+
+    def setUp(self):
+        self.user = User.objects.create_user('batch', password='x')
+        self.client = api_client(self.user)
+
+    def post_batch(self, *requests):
+        return self.client.post('/api/batch/', {
+            'requests': [{'method': 'GET', 'path': path} for path in requests],
+        }, format='json')
+
+    def test_rejects_paths_outside_api(self):
+        response = self.post_batch('/admin/')
+        self.assertEqual(response.status_code, 400)
+
+    def test_rejects_excluded_and_non_drf_views(self):
+        response = self.post_batch('/api/batch/', '/api/profiles/', '/api/delivery/media/missing.jpg')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([item['status'] for item in response.json()['responses']], [400, 400, 400])
+
+    def test_view_exception_becomes_item_error(self):
+        with mock.patch('delivery_core.views.DeliveryViewSet.stats', side_effect=RuntimeError):
+            with self.assertLogs('delivery_project.batch', level='ERROR'):
+                response = self.post_batch(
+                    '/api/delivery/deliveries/stats/', '/api/delivery/deliveries/'
+                )
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([item['status'] for item in response.json()['responses']], [500, 200])
+
+
+class NumberAllocatorTests(TransactionTestCase):
+    """
+    Выдача номеров доставок блоками
+    """
+
+    def test_block_is_reserved_once(self):
+        allocator = DeliveryNumberAllocator(prefix='T', block_size=10)
+        first = allocator.allocate(3, year=2024)
+        second = allocator.allocate(2, year=2024)
+        self.assertEqual(first + second, [f'T-2024-{value:05d}' for value in range(1, 6)])
+        self.assertEqual(DeliveryNumberSequence.objects.get(prefix='T', year=2024).last_value, 10)
+
+    def test_rolled_back_reservation_is_not_reused(self):
+        allocator = DeliveryNumberAllocator(prefix='T', block_size=10)
+        other = DeliveryNumberAllocator(prefix='T', block_size=10)
+        with self.assertRaises(RuntimeError):
+            with transaction.atomic():
+                allocator.allocate(1, year=2024)
+                raise RuntimeError
+        taken = set(other.allocate(5, year=2024))
+        self.assertNotIn(allocator.allocate(1, year=2024)[0], taken)
+
+    def test_block_reserved_in_transaction_is_cached(self):
+        allocator = DeliveryNumberAllocator(prefix='T', block_size=10)
+        with transaction.atomic():
+            numbers = allocator.allocate(1, year=2024)
+            with self.assertNumQueries(0):
+                numbers += allocator.allocate(2, year=2024)
+        with self.assertNumQueries(0):
+            numbers += allocator.allocate(1, year=2024)
+        with transaction.atomic(), self.assertNumQueries(0):
+            numbers += allocator.allocate(1, year=2024)
+        self.assertEqual(numbers, [f'T-2024-{value:05d}' for value in range(1, 6)])
+        self.assertEqual(DeliveryNumberSequence.objects.get(prefix='T', year=2024).last_value, 10)
+
+    def test_savepoint_rollback_drops_pending_block(self):
+        allocator = DeliveryNumberAllocator(prefix='T', block_size=10)
+        with transaction.atomic():
+            with self.assertRaises(RuntimeError):
+                with transaction.atomic():
+                    allocator.allocate(1, year=2024)
+                    raise RuntimeError
+            numbers = allocator.allocate(2, year=2024)
+        # Счетчик откатился вместе с точкой сохранения - блок резервируется заново
+        self.assertEqual(numbers, ['T-2024-00001', 'T-2024-00002'])
+        self.assertEqual(DeliveryNumberSequence.objects.get(prefix='T', year=2024).last_value, 10)
+
+
+class BulkCreateNumberTests(TestCase):
+    """
+    Массовое создание доставок с номерами клиента
+    """
+
+    def setUp(self):
+        self.references = create_references()
+        self.client = api_client(User.objects.create_user('bulk', password='x'))
+
+    def test_duplicate_numbers_in_payload(self):
+        response = self.client.post('/api/delivery/deliveries/', [
+            delivery_payload(self.references, number='X-1'),
+            delivery_payload(self.references, number='X-1'),
+        ], format='json')
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(Delivery.objects.exists())
+
+    def test_number_taken_by_server_allocation(self):
+        allocator = DeliveryNumberAllocator(block_size=10)
+        next_number = allocator.format_number(timezone.localdate().year, 1)
+        response = self.client.post('/api/delivery/deliveries/', [
+            delivery_payload(self.references, number=next_number),
+            delivery_payload(self.references),
+        ], format='json')
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(Delivery.objects.exists())
+
+    def test_single_create_rejects_server_format_number(self):
+        allocator = DeliveryNumberAllocator()
+        future_number = allocator.format_number(timezone.localdate().year, 42)
+        response = self.client.post(
+            '/api/delivery/deliveries/', delivery_payload(self.references, number=future_number), format='json'
+        )
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('number', response.json())
+
+    def test_bulk_create_assigns_numbers(self):
+        response = self.client.post('/api/delivery/deliveries/', [
+            delivery_payload(self.references, number='X-1'),
+            delivery_payload(self.references),
+        ], format='json')
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(Delivery.objects.count(), 2)
+
+
+def create_delivery(references, number, **fields):
+    departure = timezone.now()
+    return Delivery.objects.create(
+        number=number,
+        departure_time=departure,
+        arrival_time=departure + timedelta(hours=2),
+        distance=10,
+        **references,
+        **fields,
+    )
+
+
+@override_settings(DELIVERY_SYNC_LAG_SECONDS=0)
+class SyncCursorTests(TestCase):
+    """
+    Синхронизация изменений доставок по курсору
+    """
+
+    def setUp(self):
+        self.references = create_references()
+        self.client = api_client(User.objects.create_user('sync', password='x'))
+
+    def sync(self, cursor=None, limit=2):
+        params = {'limit': limit}
+        if cursor:
+            params['cursor'] = cursor
+        response = self.client.get('/api/delivery/deliveries/sync/', params)
+        self.assertEqual(response.status_code, 200)
+        return response.json()
+
+    def test_pages_through_changes_and_deletions(self):
+        deliveries = [create_delivery(self.references, f'S-{index}') for index in range(3)]
+        first = self.sync()
+        self.assertTrue(first['has_more'])
+        second = self.sync(first['cursor'])
+        self.assertFalse(second['has_more'])
+        numbers = [item['number'] for item in first['deliveries'] + second['deliveries']]
+        self.assertEqual(numbers, ['S-0', 'S-1', 'S-2'])
+
+        deleted_id = deliveries[0].pk
+        deliveries[0].delete()
+        deliveries[1].notes = 'изменено'
+        deliveries[1].save()
+        third = self.sync(second['cursor'])
+        self.assertEqual([item['number'] for item in third['deliveries']], ['S-1'])
+        self.assertEqual([item['id'] for item in third['deleted']], [deleted_id])
+
+        self.assertEqual(self.sync(third['cursor'])['deliveries'], [])
+
+    def test_invalid_cursor(self):
+        response = self.client.get('/api/delivery/deliveries/sync/', {'cursor': 'broken'})
+        self.assertEqual(response.status_code, 410)
+
+    @override_settings(DELIVERY_SYNC_LAG_SECONDS=3600)
+    def test_recent_changes_are_delayed(self):
+        create_delivery(self.references, 'S-0')
+        self.assertEqual(self.sync()['deliveries'], [])
+
+    def test_sync_reads_primary_database(self):
+        view = DeliveryViewSet.as_view({'get': 'sync'})
+        request = mock.Mock(method='GET')
+        self.assertTrue(_view_uses_primary(view, request))
+
+
+class MediaStorageTestMixin:
+    """
+    Хранилище медиа-файлов доставок во временном каталоге
+    """
+
+    def setUp(self):
+        super().setUp()
+        self.media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.media_root, ignore_errors=True)
+        storages = {
+            'default': {'BACKEND': 'django.core.files.storage.FileSystemStorage'},
+            'delivery_media': {
+                'BACKEND': 'delivery_core.storage.ContentAddressedStorage',
+                'OPTIONS': {'location': self.media_root},
+            },
+        }
+        override = override_settings(STORAGES=storages, MEDIA_ROOT=self.media_root)
+        override.enable()
+        self.addCleanup(override.disable)
+        self.storage = get_delivery_media_storage()
+
+    def age(self, name):
+        self.age_path(self.storage.path(name))
+
+    def age_path(self, path, seconds=2 * 24 * 3600):
+        past = time.time() - seconds
+        os.utime(path, (past, past))
+
+
+class ContentAddressedStorageTests(MediaStorageTestMixin, TestCase):
+
+    def test_duplicate_save_refreshes_blob_mtime(self):
+        name = self.storage.save('a.jpg', ContentFile(b'same'))
+        self.age(name)
+        self.assertEqual(self.storage.save('b.jpg', ContentFile(b'same')), name)
+        self.assertGreater(os.path.getmtime(self.storage.path(name)), time.time() - 60)
+
+
+class GcMediaTests(MediaStorageTestMixin, TestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.references = create_references()
+
+    def test_rechecks_references_before_delete(self):
+        kept = self.storage.save('kept.jpg', ContentFile(b'kept'))
+        orphans = [self.storage.save(f'{index}.jpg', ContentFile(b'orphan %d' % index)) for index in range(3)]
+        for name in [kept, *orphans]:
+            self.age(name)
+        # Ссылка появилась после того, как команда собрала ссылки
+        create_delivery(self.references, 'G-1', media_file=kept)
+
+        with mock.patch(
+            'delivery_core.management.commands.gc_media.Command._collect_references', return_value=Counter()
+        ), mock.patch('delivery_core.management.commands.gc_media.DELETE_CHUNK_SIZE', 2):
+            call_command('gc_media', stdout=mock.Mock())
+
+        self.assertTrue(self.storage.exists(kept))
+        self.assertFalse(any(self.storage.exists(name) for name in orphans))
+        self.assertEqual(list(MediaBlob.objects.values_list('name', flat=True)), [kept])
+
+    def test_counters_are_recounted_before_update(self):
+        fresh = self.storage.save('fresh.jpg', ContentFile(b'fresh'))
+        broken = self.storage.save('broken.jpg', ContentFile(b'broken'))
+        # Ссылка на fresh появилась после снимка, ее счетчик уже верен
+        create_delivery(self.references, 'G-1', media_file=fresh)
+        create_delivery(self.references, 'G-2', media_file=broken)
+        MediaBlob.objects.filter(name=broken).update(ref_count=5)
+
+        with mock.patch(
+            'delivery_core.management.commands.gc_media.Command._collect_references', return_value=Counter()
+        ):
+            call_command('gc_media', stdout=mock.Mock())
+
+        self.assertEqual(MediaBlob.objects.get(name=fresh).ref_count, 1)
+        self.assertEqual(MediaBlob.objects.get(name=broken).ref_count, 1)
+
+
+@override_settings(DELIVERY_DERIVATIVES_ASYNC=False)
+class DerivativeTests(MediaStorageTestMixin, TestCase):
+    """
+    Копии изображений и подписанные ссылки на них
+    """
+
+    def setUp(self):
+        super().setUp()
+        self.references = create_references()
+        derivatives._built.clear()
+        self.addCleanup(derivatives._built.clear)
+
+    def save_image(self, name, color='red'):
+        buffer = io.BytesIO()
+        Image.new('RGB', (400, 300), color).save(buffer, 'PNG')
+        return self.storage.save(name, ContentFile(buffer.getvalue()))
+
+    def test_urls_of_built_source_skip_stat(self):
+        name = self.save_image('photo.png')
+        self.assertEqual(derivatives.get_derivative_urls(name, 'D-1'), {})
+        derivatives.generate_derivatives(name)
+
+        with mock.patch('delivery_core.derivatives.os.path.exists') as exists:
+            urls = derivatives.get_derivative_urls(name, 'D-1')
+        exists.assert_not_called()
+        self.assertEqual(set(urls), set(derivatives.DERIVATIVE_SPECS))
+
+        for spec, url in urls.items():
+            path = derivatives.derivative_name(name, spec)
+            parts = urlsplit(url)
+            query = {key: values[0] for key, values in parse_qs(parts.query).items()}
+            self.assertEqual(parts.path, reverse('delivery-media-signed', kwargs={'name': path}))
+            self.assertEqual(
+                query['signature'],
+                salted_hmac(SIGNATURE_SALT, f"{path}\n{query['expires']}\n{query['filename']}", algorithm='sha256').hexdigest(),
+            )
+            self.assertTrue(check_signature(path, query['expires'], query['filename'], query['signature']))
+
+    def test_built_derivatives_found_on_disk(self):
+        # Копии построены другим процессом
+        name = self.save_image('photo.png')
+        derivatives.generate_derivatives(name)
+        derivatives._built.clear()
+        self.assertEqual(set(derivatives.get_derivative_names(name)), set(derivatives.DERIVATIVE_SPECS))
+        derivatives.delete_derivatives(name)
+        self.assertEqual(derivatives.get_derivative_names(name), {})
+
+    def test_bulk_create_builds_derivatives(self):
+        names = [self.save_image('a.png', 'red'), self.save_image('b.png', 'blue')]
+        payload = delivery_payload(self.references)
+        serializer = DeliveryCreateUpdateSerializer(data=[payload, payload], many=True)
+        self.assertTrue(serializer.is_valid(), serializer.errors)
+        for item, name in zip(serializer.validated_data, names):
+            item['media_file'] = name
+
+        with self.captureOnCommitCallbacks(execute=True):
+            serializer.save()
+
+        for name in names:
+            self.assertTrue(derivatives.has_derivatives(name))
+
+
+class UploadTests(MediaStorageTestMixin, TestCase):
+    """
+    Возобновляемая загрузка медиа-файлов
+    """
+    content = b'0123456789' * 10
+
+    def setUp(self):
+        super().setUp()
+        override = override_settings(DELIVERY_UPLOAD_TEMP_DIR=os.path.join(self.media_root, 'uploads'))
+        override.enable()
+        self.addCleanup(override.disable)
+        self.references = create_references()
+        self.delivery = create_delivery(self.references, 'U-1')
+        self.user = User.objects.create_user('upload', password='x')
+        self.client = api_client(self.user)
+
+    def create_session(self, **fields):
+        response = self.client.post('/api/delivery/uploads/', {
+            'filename': 'photo.bin', 'size': len(self.content), **fields,
+        }, format='json')
+        self.assertEqual(response.status_code, 201)
+        return UploadSession.objects.get(pk=response.json()['id'])
+
+    def put_chunk(self, session, offset, data):
+        return self.client.put(
+            f'/api/delivery/uploads/{session.pk}/chunk/?offset={offset}',
+            data, content_type='application/octet-stream',
+        )
+
+    def finalize(self, session, **data):
+        return self.client.post(f'/api/delivery/uploads/{session.pk}/finalize/', data, format='json')
+
+    def test_upload_in_chunks(self):
+        session = self.create_session(checksum=hashlib.sha256(self.content).hexdigest())
+        self.assertEqual(self.put_chunk(session, 0, self.content[:60]).status_code, 200)
+        self.assertEqual(self.put_chunk(session, 0, self.content[:60]).status_code, 409)
+        self.assertEqual(self.put_chunk(session, 60, self.content[60:]).status_code, 200)
+        self.assertEqual(self.finalize(session, delivery=self.delivery.pk).status_code, 200)
+        self.delivery.refresh_from_db()
+        with self.delivery.media_file.open('rb') as media:
+            self.assertEqual(media.read(), self.content)
+
+    def test_concurrent_chunk_is_rejected(self):
+        session = self.create_session()
+        with open(get_session_path(session), 'wb') as part:
+            self.assertTrue(locks.lock(part, locks.LOCK_EX | locks.LOCK_NB))
+            response = self.put_chunk(session, 0, self.content)
+            locks.unlock(part)
+        self.assertEqual(response.status_code, 409)
+        session.refresh_from_db()
+        self.assertEqual(session.received, 0)
+
+    def test_finalize_uses_incremental_hash(self):
+        session = self.create_session(checksum=hashlib.sha256(self.content).hexdigest())
+        self.put_chunk(session, 0, self.content[:60])
+        self.put_chunk(session, 60, self.content[60:])
+        with mock.patch('delivery_core.uploads._hash_file_prefix') as hash_prefix, \
+                mock.patch('delivery_core.storage.ContentAddressedStorage._hash_file') as hash_blob:
+            response = self.finalize(session, delivery=self.delivery.pk)
+        self.assertEqual(response.status_code, 200)
+        hash_prefix.assert_not_called()
+        hash_blob.assert_not_called()
+        self.delivery.refresh_from_db()
+        self.assertEqual(MediaBlob.objects.get(name=self.delivery.media_file.name).size, len(self.content))
+
+    def test_hash_restored_in_other_process(self):
+        session = self.create_session(checksum=hashlib.sha256(self.content).hexdigest())
+        self.put_chunk(session, 0, self.content[:60])
+        # Следующая часть пришла в процесс без состояния хэша
+        uploads._hashers.discard(session.pk)
+        self.put_chunk(session, 60, self.content[60:])
+        self.assertEqual(self.finalize(session, delivery=self.delivery.pk).status_code, 200)
+
+    def test_finalize_rejects_wrong_checksum(self):
+        session = self.create_session(checksum=hashlib.sha256(b'other').hexdigest())
+        self.put_chunk(session, 0, self.content)
+        response = self.finalize(session, delivery=self.delivery.pk)
+        self.assertEqual(response.status_code, 400)
+        self.delivery.refresh_from_db()
+        self.assertFalse(self.delivery.media_file)
+
+    def test_finalize_rejects_non_integer_delivery(self):
+        session = self.create_session()
+        self.put_chunk(session, 0, self.content)
+        self.assertEqual(self.finalize(session, delivery='abc').status_code, 400)
+
+    def test_purge_abandoned_uploads(self):
+        abandoned = self.create_session()
+        self.put_chunk(abandoned, 0, self.content[:10])
+        UploadSession.objects.filter(pk=abandoned.pk).update(updated_at=timezone.now() - timedelta(days=2))
+        active = self.create_session()
+        self.put_chunk(active, 0, self.content[:10])
+        stray = os.path.join(os.path.dirname(get_session_path(active)), 'missing.part')
+        open(stray, 'wb').close()
+        self.age_path(stray)
+
+        call_command('purge_upload_sessions', stdout=mock.Mock())
+
+        self.assertEqual(list(UploadSession.objects.values_list('pk', flat=True)), [active.pk])
+        self.assertFalse(os.path.exists(get_session_path(abandoned)))
+        self.assertFalse(os.path.exists(stray))
+        self.assertTrue(os.path.exists(get_session_path(active)))
+
+
+class MetricsTests(TestCase):
+    """
+    Метрики процесса и доступ к /metrics
+    """
+
+    def test_finished_thread_shards_are_merged(self):
+        registry = MetricsRegistry()
+        for _ in range(5):
+            thread = threading.Thread(target=registry.inc, args=('cache_requests_total', ('test', 'hit')))
+            thread.start()
+            thread.join()
+            del thread
+            gc.collect()
+        self.assertEqual(len(registry._shards), 0)
+        self.assertEqual(registry.snapshot(), {('cache_requests_total', ('test', 'hit')): 5})
+
+    @override_settings(DEBUG=False, METRICS_TOKEN='', METRICS_ALLOWED_IPS=['127.0.0.1'])
+    def test_token_required_without_debug(self):
+        response = self.client.get('/metrics', REMOTE_ADDR='127.0.0.1', HTTP_HOST='localhost')
+        self.assertEqual(response.status_code, 403)
+
+    @override_settings(DEBUG=False, METRICS_TOKEN='secret')
+    def test_token_access(self):
+        response = self.client.get(
+            '/metrics', HTTP_HOST='localhost', headers={'Authorization': 'Bearer secret'}
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertIn(b'http_request_duration_seconds', response.content)
+
+
+class ArchiveTests(TestCase):
+    """
+    Перенос доставок в архив и список с архивом
+    """
+
+    def setUp(self):
+        self.references = create_references()
+        self.completed = DeliveryStatus.objects.create(name='Проведено', code='completed')
+        self.client = api_client(User.objects.create_user('archive', password='x'))
+
+    def create_at(self, number, hours_ago, **fields):
+        delivery = create_delivery(self.references, number, **fields)
+        departure = timezone.now() - timedelta(hours=hours_ago)
+        Delivery.objects.filter(pk=delivery.pk).update(
+            departure_time=departure, arrival_time=departure + timedelta(hours=1)
+        )
+        return delivery
+
+    def archive(self, *deliveries):
+        Delivery.objects.filter(pk__in=[d.pk for d in deliveries]).update(status=self.completed)
+        queryset = Delivery.objects.filter(status=self.completed)
+        return archive_chunk(queryset, [d.pk for d in deliveries])
+
+    def test_changed_delivery_is_not_archived(self):
+        kept = self.create_at('A-1', 10)
+        moved = self.create_at('A-2', 20)
+        self.archive(moved)
+        # Статус изменился после выбора id - условия проверяются повторно
+        queryset = Delivery.objects.filter(status=self.completed)
+        self.assertEqual(archive_chunk(queryset, [kept.pk]), 0)
+        self.assertTrue(Delivery.objects.filter(pk=kept.pk).exists())
+        self.assertTrue(ArchivedDelivery.objects.filter(pk=moved.pk).exists())
+
+    def test_list_merges_hot_and_cold_in_order(self):
+        deliveries = [self.create_at(f'A-{hours}', hours) for hours in (1, 2, 3, 4, 5)]
+        self.archive(deliveries[1], deliveries[3])
+
+        response = self.client.get('/api/delivery/deliveries/', {'include_archive': 'true'})
+        self.assertEqual(
+            [item['number'] for item in response.json()['results']], ['A-1', 'A-2', 'A-3', 'A-4', 'A-5']
+        )
+
+        response = self.client.get('/api/delivery/deliveries/', {
+            'include_archive': 'true', 'ordering': 'departure_time', 'fields': 'number',
+        })
+        self.assertEqual(response.json()['count'], 5)
+        self.assertEqual(
+            [item['number'] for item in response.json()['results']], ['A-5', 'A-4', 'A-3', 'A-2', 'A-1']
+        )
+
+    def test_hot_cold_slices(self):
+        deliveries = [self.create_at(f'A-{hours}', hours) for hours in (1, 2, 3, 4, 5)]
+        self.archive(deliveries[0], deliveries[2])
+        results = HotColdResults(
+            Delivery.objects.order_by('departure_time'), ArchivedDelivery.objects.order_by('departure_time')
+        )
+        self.assertEqual(len(results), 5)
+        self.assertEqual([d.number for d in results[1:3]], ['A-4', 'A-3'])
+        self.assertEqual(results[4].number, 'A-1')
+
+
+class FastSerializerEquivalenceTests(TestCase):
+    """
+    Скомпилированный сериализатор выдает то же, что и ModelSerializer
+    """
+
+    def setUp(self):
+        self.references = create_references()
+        self.user = User.objects.create_user('fast', password='x')
+        self.client = api_client(self.user)
+        cargo = CargoType.objects.create(name='Сборный', code='mixed')
+        create_delivery(self.references, 'F-1', cargo_type=cargo, created_by=self.user, notes='заметка')
+        # Без типа груза, создателя и медиа-файла
+        create_delivery(self.references, 'F-2')
+        create_delivery(self.references, 'F-3', media_file='delivery_files/2024/01/photo.jpg')
+
+    def list_both_ways(self, params):
+        responses = []
+        for fast in (False, True):
+            with override_settings(DELIVERY_FAST_LIST_SERIALIZER=fast):
+                response = self.client.get('/api/delivery/deliveries/', params)
+            self.assertEqual(response.status_code, 200)
+            responses.append(response.json())
+        return responses
+
+    def test_list_responses_match(self):
+        for params in (
+            {},
+            {'fields': 'number,status_name,travel_time'},
+            {'fields': 'id,media_derivatives'},
+            {'exclude': 'transport_model_name,departure_time'},
+            {'ordering': 'number', 'status': self.references['status'].pk},
+        ):
+            with self.subTest(params=params):
+                slow, fast = self.list_both_ways(params)
+                self.assertEqual(fast, slow)
+
+    def assert_compiled_matches(self, serializer, queryset):
+        compiled = compile_serializer(serializer)
+        expected = [serializer.to_representation(obj) for obj in queryset]
+        actual = compiled.serialize(queryset.values_list(*compiled.columns), serializer)
+        self.assertEqual(actual, expected)
+
+    def test_null_foreign_keys(self):
+        serializer = DeliveryDetailSerializer(fields=[
+            'id', 'number', 'cargo_type', 'cargo_type_name', 'created_by', 'created_by_name', 'notes',
+        ])
+        self.assert_compiled_matches(serializer, Delivery.objects.order_by('id'))
+
+    def test_archived_rows(self):
+        completed = DeliveryStatus.objects.create(name='Проведено', code='completed')
+        Delivery.objects.update(status=completed)
+        archive_chunk(Delivery.objects.all(), list(Delivery.objects.values_list('id', flat=True)))
+        self.assertEqual(ArchivedDelivery.objects.count(), 3)
+        self.assert_compiled_matches(DeliveryListSerializer(), ArchivedDelivery.objects.order_by('id'))
+
+
+class ProfilingTests(TestCase):
+    """
+    Профилирование запросов сотрудников
+    """
+
+    def setUp(self):
+        self.profiles = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.profiles, ignore_errors=True)
+        override = override_settings(PROFILING_DIR=self.profiles, PROFILING_REDACT_PARAMS=True)
+        override.enable()
+        self.addCleanup(override.disable)
+        create_delivery(create_references(), 'P-1')
+        self.staff = User.objects.create_user('staff', password='x', is_staff=True)
+
+    def profiling_wrappers(self, wrappers):
+        return [wrapper for wrapper in wrappers if getattr(wrapper, '__module__', None) == 'delivery_project.profiling']
+
+    def read_report(self, response):
+        with open(get_report_path(response['X-Profile-Id']), encoding='utf-8') as report_file:
+            return json.load(report_file)
+
+    def test_report_redacts_params(self):
+        self.client.force_login(self.staff)
+        response = self.client.get(
+            '/api/delivery/deliveries/', {'search': 'P-1', 'profile': '1'}, HTTP_HOST='localhost'
+        )
+        self.assertEqual(response.status_code, 200)
+        report = self.read_report(response)
+        params = [param for query in report['queries'] for param in (query['params'] or [])]
+        self.assertTrue(params)
+        self.assertTrue(all(param.startswith('<') for param in params))
+        # Обертка отключается вместе с профилированием
+        self.assertFalse(self.profiling_wrappers(connection.execute_wrappers))
+
+    def test_unprofiled_request_is_not_wrapped(self):
+        self.client.force_login(self.staff)
+        wrappers = []
+        original = DeliveryViewSet.list
+
+        def list_view(viewset, request, *args, **kwargs):
+            wrappers.extend(connection.execute_wrappers)
+            return original(viewset, request, *args, **kwargs)
+
+        with mock.patch.object(DeliveryViewSet, 'list', list_view):
+            response = self.client.get('/api/delivery/deliveries/', HTTP_HOST='localhost')
+        self.assertEqual(response.status_code, 200)
+        self.assertFalse(self.profiling_wrappers(wrappers))
+
+    async def test_asgi_profiles_view_thread(self):
+        client = AsyncClient(headers={'host': 'localhost'})
+        await client.aforce_login(self.staff)
+        response = await client.get(
+            '/api/delivery/deliveries/', {'profile': 'cprofile'}
+        )
+        self.assertEqual(response.status_code, 200)
+        report = await sync_to_async(self.read_report)(response)
+        self.assertIn('viewsets.py', report['profile']['text'])
+        self.assertGreater(report['query_count'], 0)
+
+    async def test_asgi_async_view_is_refused(self):
+        client = AsyncClient(headers={'host': 'localhost'})
+        await client.aforce_login(self.staff)
+        with mock.patch('delivery_project.profiling.is_async_view', return_value=True):
+            response = await client.get(
+                '/api/delivery/deliveries/', {'profile': 'cprofile'}
+            )
+        self.assertEqual(response.status_code, 400)
+        self.assertNotIn('X-Profile-Id', response)
+
+
+class FastJSONRendererTests(TestCase):
+    """
+    Быстрый рендерер выдает те же байты, что и JSONRenderer DRF
+    """
+
+    def assertSameOutput(self, data):
+        expected = JSONRenderer().render(data)
+        self.assertEqual(FastJSONRenderer().render(data), expected)
+        self.assertEqual(b''.join(FastJSONRenderer().stream([data, data], chunk_size=1)), JSONRenderer().render([data, data]))
+
+    def test_floats(self):
+        for value in (0.0, -0.0, 0.1, 1 / 3, 1e-4, 1e-5, 2.5e-7, 1e15 + 0.3, 1e16, 1e20, -3e30, 5e-324):
+            with self.subTest(value=value):
+                self.assertSameOutput({'travel_time': value, 'values': [value, (value,)]})
+
+    def test_decimals(self):
+        for value in ('0', '120.50', '0.00001', '1E+20', '12345678901234567890.5'):
+            with self.subTest(value=value):
+                self.assertSameOutput({'distance': Decimal(value)})
+
+    def test_dates_and_separators(self):
+        self.assertSameOutput({
+            'departure_time': datetime(2026, 1, 2, 3, 4, 5, 678901, tzinfo=dt_timezone.utc),
+            'local_time': datetime(2026, 1, 2, 3, 4, 5, tzinfo=dt_timezone(timedelta(hours=3))),
+            'date': date(2026, 1, 2),
+            'notes': 'строка\u2028с\u2029разделителями',
+        })
+
+    def test_non_finite_floats_respect_strict(self):
+        for value in (float('nan'), float('inf'), Decimal('NaN')):
+            with self.subTest(value=value):
+                with self.assertRaises(ValueError):
+                    JSONRenderer().render({'value': value})
+                with self.assertRaises(ValueError):
+                    FastJSONRenderer().render({'value': value})
+
+
+@override_settings(SLOW_QUERY_THRESHOLD_MS=0)
+class SlowQueryLogTests(TestCase):
+    """
+    В журнал медленных запросов попадают только успешные запросы
+    """
+
+    def log(self, execute):
+        context = {'connection': mock.Mock(alias='default')}
+        with mock.patch('delivery_project.slow_queries.record_slow_query') as record:
+            try:
+                log_slow_queries(execute, 'SELECT 1', (), False, context)
+            except ValueError:
+                pass
+        return record
+
+    def test_successful_query_is_recorded(self):
+        self.log(mock.Mock(return_value=None)).assert_called_once()
+
+    def test_failed_query_is_not_recorded(self):
+        self.log(mock.Mock(side_effect=ValueError)).assert_not_called()
+
+
+class DatabaseProfileTests(TestCase):
+    """
+    Профили подключения к базе данных
+    """
+
+    def test_pooled_profile_requires_psycopg_pool(self):
+        with mock.patch.dict(sys.modules, {'psycopg_pool': None}):
+            with self.assertRaises(ImproperlyConfigured):
+                build_database('postgres_pooled', settings.BASE_DIR)
+
+
+class FacetTests(TestCase):
+    """
+    Фасетные счетчики списка доставок
+    """
+    facets = ['status', 'transport_model', 'condition']
+
+    def setUp(self):
+        cache.clear()
+        self.addCleanup(cache.clear)
+        self.references = create_references()
+        self.delivered = DeliveryStatus.objects.create(name='Доставлена', code='delivered')
+        self.truck = TransportModel.objects.create(name='Фура', code='truck')
+        self.services = [Service.objects.create(name=f'Услуга {index}', code=f's{index}') for index in range(2)]
+        layout = [
+            (self.references['status'], self.references['transport_model'], 'Исправно'),
+            (self.references['status'], self.truck, 'Неисправно'),
+            (self.delivered, self.truck, 'Исправно'),
+            (self.delivered, self.truck, 'Исправно'),
+            (self.delivered, self.references['transport_model'], 'Неисправно'),
+        ]
+        for index, (status, transport_model, condition) in enumerate(layout):
+            delivery = create_delivery(
+                {**self.references, 'status': status, 'transport_model': transport_model},
+                f'F-{index}', condition=condition,
+            )
+            delivery.services.set(self.services if index % 2 == 0 else self.services[:1])
+        self.client = api_client(User.objects.create_user('facets', password='x'))
+
+    def expected(self, queryset):
+        expected = {}
+        for facet in self.facets:
+            column = facet if facet == 'condition' else f'{facet}_id'
+            rows = queryset.order_by().values(column).annotate(total=Count('pk', distinct=True))
+            expected[facet] = {row[column]: row['total'] for row in rows}
+        return expected
+
+    def actual(self, counts):
+        return {
+            facet: {item.get('id', item.get('value')): item['count'] for item in items}
+            for facet, items in counts.items()
+        }
+
+    def test_counts_match_filtered_list(self):
+        response = self.client.get('/api/delivery/deliveries/', {
+            'condition': 'Исправно', 'facets': ','.join(self.facets),
+        })
+        self.assertEqual(response.status_code, 200)
+        expected = self.expected(Delivery.objects.filter(condition='Исправно'))
+        self.assertEqual(self.actual(response.json()['facets']), expected)
+        self.assertEqual(expected['status'], {self.references['status'].pk: 1, self.delivered.pk: 2})
+
+    def test_counts_with_distinct_services_filter(self):
+        response = self.client.get('/api/delivery/deliveries/', {
+            'services': ','.join(str(service.pk) for service in self.services),
+            'facets': ','.join(self.facets),
+        })
+        self.assertEqual(response.status_code, 200)
+        expected = self.expected(Delivery.objects.filter(services__in=self.services))
+        self.assertEqual(self.actual(response.json()['facets']), expected)
+        self.assertEqual(sum(expected['condition'].values()), Delivery.objects.count())
+
+    def test_single_group_by_query(self):
+        queryset = Delivery.objects.filter(transport_model=self.truck)
+        # Названия справочников берутся из кэша
+        count_facets(self.facets, queryset)
+        with self.assertNumQueries(1):
+            counts = count_facets(self.facets, queryset)
+        self.assertEqual(self.actual(counts), self.expected(queryset))
+
+
+class DeliveryAdminTests(TestCase):
+    """
+    Список доставок в админ-панели
+    """
+    url = '/admin/delivery_core/delivery/'
+
+    def setUp(self):
+        cache.clear()
+        self.addCleanup(cache.clear)
+        self.references = create_references()
+        self.deliveries = {}
+        for number, departure in [
+            ('A-1', datetime(2025, 12, 31, 12, tzinfo=dt_timezone.utc)),
+            ('A-2', datetime(2026, 1, 15, 12, tzinfo=dt_timezone.utc)),
+            ('A-3', datetime(2026, 1, 31, 12, tzinfo=dt_timezone.utc)),
+            ('A-4', datetime(2026, 2, 1, 12, tzinfo=dt_timezone.utc)),
+        ]:
+            self.deliveries[number] = Delivery.objects.create(
+                number=number, departure_time=departure, arrival_time=departure + timedelta(hours=2),
+                distance=10, **self.references,
+            )
+        admin_user = User.objects.create_superuser('admin', 'admin@example.com', 'x')
+        self.client.force_login(admin_user)
+
+    def changelist(self, **params):
+        response = self.client.get(self.url, params, HTTP_HOST='localhost')
+        self.assertEqual(response.status_code, 200)
+        return sorted(delivery.number for delivery in response.context['cl'].result_list)
+
+    def test_departure_filter_narrows_results(self):
+        self.assertEqual(self.changelist(departure='2026-01'), ['A-2', 'A-3'])
+        self.assertEqual(self.changelist(departure='2026'), ['A-2', 'A-3', 'A-4'])
+        self.assertEqual(self.changelist(departure='2025'), ['A-1'])
+        self.assertEqual(self.changelist(), ['A-1', 'A-2', 'A-3', 'A-4'])
+
+    def test_changelist_query_count(self):
+        # Первое открытие заполняет кэши количества, годов и справочников
+        self.changelist()
+        # Сессия, пользователь и одна выборка страницы со справочниками через JOIN
+        with self.assertNumQueries(3):
+            self.changelist()
+        # Для нового фильтра добавляется только подсчет строк
+        with self.assertNumQueries(4):
+            self.changelist(departure='2026-01')
+
+
+class ColumnarRendererTests(TestCase):
+    """
+    Колоночный формат восстанавливается в исходные строки
+    """
+
+    def setUp(self):
+        references = create_references()
+        for index in range(5):
+            create_delivery(references, f'C-{index}')
+        self.view = DeliveryViewSet(action='list')
+        self.rows = json.loads(JSONRenderer().render(DeliveryListSerializer(Delivery.objects.all(), many=True).data))
+
+    def from_columnar(self, payload):
+        rows = []
+        for block in payload['blocks']:
+            for index in range(len(block[0]) if block else 0):
+                rows.append({column: values[index] for column, values in zip(payload['columns'], block)})
+        for name_field, id_field in self.view.columnar_references.items():
+            if id_field not in payload['references']:
+                continue
+            names = payload['references'][id_field]
+            for row in rows:
+                # Ключи словаря references в JSON - строки
+                row[name_field] = names.get(str(row[id_field])) if row[id_field] is not None else None
+        return rows
+
+    def test_render_round_trip(self):
+        renderer = ColumnarJSONRenderer()
+        payload = json.loads(renderer.render(self.rows, renderer_context={'view': self.view}))
+        self.assertEqual(set(payload['references']), {'transport_model', 'status', 'packaging'})
+        self.assertNotIn('status_name', payload['columns'])
+        self.assertEqual(self.from_columnar(payload), self.rows)
+
+        page = {'count': len(self.rows), 'next': None, 'previous': None, 'results': self.rows}
+        payload = json.loads(renderer.render(page, renderer_context={'view': self.view}))
+        self.assertEqual(payload['count'], len(self.rows))
+        self.assertEqual(self.from_columnar(payload), self.rows)
+
+    def test_stream_round_trip(self):
+        renderer = ColumnarJSONRenderer()
+        streamed = b''.join(renderer.stream(iter(self.rows), chunk_size=2, view=self.view))
+        payload = json.loads(streamed)
+        self.assertEqual(len(payload['blocks']), 3)
+        self.assertEqual(self.from_columnar(payload), self.rows)
+        rendered = json.loads(renderer.render(self.rows, renderer_context={'view': self.view}))
+        self.assertEqual(payload['references'], rendered['references'])
+
+    def test_empty_list(self):
+        renderer = ColumnarJSONRenderer()
+        empty = {'columns': [], 'blocks': [], 'references': {}}
+        self.assertEqual(json.loads(b''.join(renderer.stream(iter([]), view=self.view))), empty)
+        self.assertEqual(json.loads(renderer.render([], renderer_context={'view': self.view})), empty)
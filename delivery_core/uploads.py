@@ -0,0 +1,297 @@
+"""
+Возобновляемая загрузка медиа-файлов доставок
+
+Клиент создает сессию загрузки (имя, размер, необязательная SHA-256),
+затем передает файл частями: PUT с телом части и смещением, равным
+количеству уже принятых байт. Части пишутся прямо в файл сессии на диске
+без буферизации в памяти, SHA-256 считается по мере записи.
+
+Состояние хэша хранится в памяти процесса вместе со смещением, до
+которого оно посчитано. Если часть пришла в другой процесс (или после
+перезапуска), хэш восстанавливается однократным чтением уже принятой
+части файла.
+
+Запись части и завершение выполняются под блокировкой файла сессии
+(flock), поэтому параллельные запросы с тем же смещением - в том числе
+из разных процессов - не пишут в файл одновременно: второй запрос
+получает 409. При завершении сервер проверяет размер и SHA-256 и только
+после этого прикрепляет файл к доставке; на одной файловой системе файл
+перемещается без копирования, а посчитанный хэш передается хранилищу,
+которое не читает файл повторно.
+
+Брошенные сессии и их временные файлы удаляет команда
+purge_upload_sessions (см. purge_abandoned).
+"""
+import hashlib
+import os
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.core.files import File, locks
+from django.db import transaction
+from django.utils import timezone
+
+from .models import UploadSession
+
+
+READ_BLOCK_SIZE = 64 * 1024
+MAX_CACHED_HASHERS = 256
+PART_SUFFIX = '.part'
+
+
+class UploadError(Exception):
+    """
+    Ошибка загрузки с HTTP-статусом для ответа клиенту
+    """
+
+    def __init__(self, message, status_code=400):
+        super().__init__(message)
+        self.status_code = status_code
+
+
+class _HasherCache:
+    """
+    Ограниченный кэш состояний SHA-256 по сессиям: id -> (смещение, хэш)
+    """
+
+    def __init__(self, max_size):
+        self.max_size = max_size
+        self._items = OrderedDict()
+        self._lock = threading.Lock()
+
+    def pop(self, session_id, offset):
+        with self._lock:
+            item = self._items.pop(session_id, None)
+        if item is not None and item[0] == offset:
+            return item[1]
+        return None
+
+    def put(self, session_id, offset, hasher):
+        with self._lock:
+            self._items[session_id] = (offset, hasher)
+            self._items.move_to_end(session_id)
+            while len(self._items) > self.max_size:
+                self._items.popitem(last=False)
+
+    def discard(self, session_id):
+        with self._lock:
+            self._items.pop(session_id, None)
+
+
+_hashers = _HasherCache(MAX_CACHED_HASHERS)
+
+
+def get_max_upload_size():
+    return getattr(settings, 'DELIVERY_UPLOAD_MAX_SIZE', 500 * 1024 * 1024)
+
+
+def get_session_path(session):
+    """
+    Возвращает путь к временному файлу сессии загрузки
+    """
+    upload_dir = settings.DELIVERY_UPLOAD_TEMP_DIR
+    os.makedirs(upload_dir, exist_ok=True)
+    return os.path.join(upload_dir, f'{session.pk}{PART_SUFFIX}')
+
+
+def _hash_file_prefix(path, length):
+    """
+    Восстанавливает состояние хэша по первым length байтам файла
+    """
+    hasher = hashlib.sha256()
+    remaining = length
+    with open(path, 'rb') as part:
+        while remaining > 0:
+            block = part.read(min(READ_BLOCK_SIZE, remaining))
+            if not block:
+                break
+            hasher.update(block)
+            remaining -= len(block)
+    if remaining:
+        raise UploadError('Временный файл загрузки поврежден', status_code=409)
+    return hasher
+
+
+def _get_hasher(session, path, offset):
+    # Вызывается под блокировкой файла: принятые до offset байты не меняются
+    hasher = _hashers.pop(session.pk, offset)
+    if hasher is None:
+        hasher = _hash_file_prefix(path, offset) if offset else hashlib.sha256()
+    return hasher
+
+
+@contextmanager
+def _locked_part(session):
+    """
+    Открывает файл сессии и держит на нем исключительную блокировку
+
+    Если файл уже заблокирован другим запросом, сразу возвращает 409.
+    Состояние сессии перечитывается из базы уже под блокировкой.
+    """
+    path = get_session_path(session)
+    with open(path, 'ab'):
+        # Файл создается при первой части и не обрезается при повторных
+        pass
+    with open(path, 'r+b') as part:
+        if not locks.lock(part, locks.LOCK_EX | locks.LOCK_NB):
+            raise UploadError('Загрузка уже обрабатывается другим запросом', status_code=409)
+        try:
+            session.refresh_from_db(fields=['received', 'status'])
+            yield path, part
+        finally:
+            locks.unlock(part)
+
+
+def write_chunk(session, offset, stream, length):
+    """
+    Записывает часть файла со смещения offset и возвращает новое смещение
+
+    Смещение должно совпадать с количеством уже принятых байт: повтор
+    принятой части или пропуск данных отклоняются с кодом 409, и клиент
+    продолжает с актуального смещения из ответа.
+    """
+    if session.status != UploadSession.STATUS_ACTIVE:
+        raise UploadError('Загрузка уже завершена', status_code=409)
+    if length <= 0:
+        raise UploadError('Пустая часть файла')
+    if offset + length > session.size:
+        raise UploadError('Часть выходит за пределы заявленного размера файла', status_code=413)
+
+    with _locked_part(session) as (path, part):
+        if session.status != UploadSession.STATUS_ACTIVE:
+            raise UploadError('Загрузка уже завершена', status_code=409)
+        if offset != session.received:
+            raise UploadError(
+                f'Ожидалось смещение {session.received}, получено {offset}', status_code=409
+            )
+
+        hasher = _get_hasher(session, path, offset)
+        written = 0
+        part.seek(offset)
+        while written < length:
+            block = stream.read(min(READ_BLOCK_SIZE, length - written))
+            if not block:
+                break
+            part.write(block)
+            hasher.update(block)
+            written += len(block)
+        part.truncate()
+
+        if written != length:
+            raise UploadError('Тело запроса короче заявленного Content-Length')
+
+        new_offset = offset + written
+        updated = UploadSession.objects.filter(
+            pk=session.pk, received=offset, status=UploadSession.STATUS_ACTIVE
+        ).update(received=new_offset, updated_at=timezone.now())
+        if not updated:
+            raise UploadError('Часть уже принята другим запросом', status_code=409)
+        _hashers.put(session.pk, new_offset, hasher)
+
+    session.received = new_offset
+    return new_offset
+
+
+class _SessionFile(File):
+    """
+    Файл сессии загрузки, который хранилище может переместить без копирования
+
+    sha256 - уже посчитанный хэш содержимого (см. ContentAddressedStorage).
+    """
+
+    def __init__(self, path, name, sha256):
+        super().__init__(open(path, 'rb'), name=name)
+        self._path = path
+        self.sha256 = sha256
+
+    def temporary_file_path(self):
+        return self._path
+
+
+def finalize(session, delivery, user=None):
+    """
+    Проверяет загруженный файл и прикрепляет его к доставке
+    """
+    with _locked_part(session) as (path, part):
+        if session.status != UploadSession.STATUS_ACTIVE:
+            raise UploadError('Загрузка уже завершена', status_code=409)
+        if session.received != session.size:
+            raise UploadError(
+                f'Файл загружен не полностью: {session.received} из {session.size} байт', status_code=409
+            )
+        if os.path.getsize(path) != session.size:
+            raise UploadError('Размер временного файла не совпадает с заявленным', status_code=409)
+
+        digest = _get_hasher(session, path, session.size).hexdigest()
+        if session.checksum and digest != session.checksum:
+            raise UploadError('Контрольная сумма файла не совпадает')
+
+        upload = _SessionFile(path, session.filename, digest)
+        try:
+            with transaction.atomic():
+                delivery.media_file.save(session.filename, upload, save=False)
+                delivery.updated_by = user
+                delivery.save()
+                session.delivery = delivery
+                session.checksum = digest
+                session.status = UploadSession.STATUS_COMPLETED
+                session.save(update_fields=['delivery', 'checksum', 'status', 'updated_at'])
+        finally:
+            upload.close()
+
+    return delivery
+
+
+def _remove_part(path):
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+
+
+def abort(session):
+    """
+    Удаляет сессию загрузки и ее временный файл
+    """
+    _hashers.discard(session.pk)
+    _remove_part(get_session_path(session))
+    session.delete()
+
+
+def purge_abandoned(max_age):
+    """
+    Удаляет брошенные загрузки: активные сессии без изменений дольше
+    max_age (timedelta) и временные файлы без сессии старше max_age
+
+    Возвращает (количество сессий, количество файлов).
+    """
+    cutoff = timezone.now() - max_age
+    sessions = 0
+    for session in UploadSession.objects.filter(
+        status=UploadSession.STATUS_ACTIVE, updated_at__lt=cutoff
+    ).iterator():
+        abort(session)
+        sessions += 1
+
+    upload_dir = settings.DELIVERY_UPLOAD_TEMP_DIR
+    if not os.path.isdir(upload_dir):
+        return sessions, 0
+
+    active = {
+        str(pk) for pk in UploadSession.objects.filter(
+            status=UploadSession.STATUS_ACTIVE
+        ).values_list('pk', flat=True).iterator()
+    }
+    files = 0
+    for entry in os.scandir(upload_dir):
+        session_id = entry.name[:-len(PART_SUFFIX)]
+        if (
+            entry.is_file() and entry.name.endswith(PART_SUFFIX)
+            and session_id not in active
+            and entry.stat().st_mtime < cutoff.timestamp()
+        ):
+            _remove_part(entry.path)
+            files += 1
+    return sessions, files
@@ -1,10 +1,30 @@
+from django.conf import settings
 from django.urls import path, include
 from rest_framework.routers import DefaultRouter
-from .views import DeliveryViewSet
+from .views import (
+    DeliveryViewSet, UploadSessionViewSet, AsyncDeliveryListView, AsyncDeliveryDetailView,
+    delivery_events, signed_media_download,
+)
 
 router = DefaultRouter()
 router.register(r'deliveries', DeliveryViewSet)
+router.register(r'uploads', UploadSessionViewSet)
 
 urlpatterns = [
     path('', include(router.urls)),
-] 
\ No newline at end of file
+    path('media/<path:name>', signed_media_download, name='delivery-media-signed'),
+    path('events/', delivery_events, name='delivery-events'),
+]
+
+if settings.API_ASYNC_VIEWS:
+    # Чтение списка и карточки доставки асинхронными представлениями (ASGI)
+    urlpatterns = [
+        path('deliveries/', AsyncDeliveryListView.as_view(
+            fallback_view=DeliveryViewSet.as_view({'get': 'list', 'post': 'create'}),
+        ), name='delivery-list'),
+        path('deliveries/<int:pk>/', AsyncDeliveryDetailView.as_view(
+            fallback_view=DeliveryViewSet.as_view({
+                'get': 'retrieve', 'put': 'update', 'patch': 'partial_update', 'delete': 'destroy',
+            }),
+        ), name='delivery-detail'),
+    ] + urlpatterns
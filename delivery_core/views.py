@@ -1,16 +1,37 @@
+import os
+import time
+
 from django.shortcuts import render
-from rest_framework import viewsets, status, filters
+from rest_framework import viewsets, mixins, status, filters
 from rest_framework.decorators import action
 from rest_framework.response import Response
 from rest_framework.permissions import IsAuthenticated
+from rest_framework.settings import api_settings
 from django_filters.rest_framework import DjangoFilterBackend
+from django.conf import settings
+from django.db import router
 from django.db.models import Q
+from django.core.handlers.asgi import ASGIRequest
+from django.http import Http404, HttpResponseForbidden, JsonResponse, StreamingHttpResponse
+from django.shortcuts import get_object_or_404
 from django.utils import timezone
+from django.views.decorators.http import require_safe
 
-from .models import Delivery
+from .archive import HotColdResults
+from .facets import count_facets, parse_facets
+from .fast_serializers import NotCompilable, get_compiled_serializer
+from .projection import apply_projection, parse_field_list
+from .renderers import ColumnarJSONRenderer
+from .models import Delivery, ArchivedDelivery, UploadSession
 from .serializers import (
-    DeliveryListSerializer, DeliveryDetailSerializer, DeliveryCreateUpdateSerializer
+    DeliveryListSerializer, DeliveryDetailSerializer, DeliveryCreateUpdateSerializer,
+    UploadSessionSerializer
 )
+from . import downloads, streaming, sync, uploads
+from .events import parse_id_list
+from .write_queue import run_write
+from delivery_project.async_views import AsyncListView, AsyncRetrieveView
+from delivery_project.renderers import FastJSONRenderer
 from references.models import DeliveryStatus
 
 
@@ -34,6 +55,18 @@ class DeliveryViewSet(viewsets.ModelViewSet):
         'distance', 'created_at', 'updated_at'
     ]
     ordering = ['-departure_time']
+    # Курсор синхронизации не должен обгонять основную базу: отстающая
+    # реплика пропустила бы изменения, которые курсор уже прошел
+    primary_db_actions = {'sync'}
+    renderer_classes = [*api_settings.DEFAULT_RENDERER_CLASSES, ColumnarJSONRenderer]
+    # Поля с названиями справочников, которые колоночный формат передает
+    # словарем по id (см. delivery_core.renderers)
+    columnar_references = {
+        'transport_model_name': 'transport_model',
+        'status_name': 'status',
+        'packaging_name': 'packaging',
+        'cargo_type_name': 'cargo_type',
+    }
     
     def get_serializer_class(self):
         """
@@ -50,6 +83,47 @@ class DeliveryViewSet(viewsets.ModelViewSet):
         else:
             return DeliveryListSerializer
     
+    # Действия, для которых поддерживаются выборочные поля (?fields=, ?exclude=)
+    sparse_field_actions = ('list', 'retrieve', 'export', 'sync')
+    export_chunk_size = 2000
+    
+    def get_serializer(self, *args, **kwargs):
+        """
+        Включает массовое создание, если в теле запроса передан список доставок,
+        и передает сериализатору запрошенные поля для чтения
+        """
+        if self.action == 'create' and isinstance(kwargs.get('data'), list):
+            kwargs['many'] = True
+        if self.action in self.sparse_field_actions:
+            kwargs.setdefault('fields', parse_field_list(self.request.query_params.get('fields')))
+            kwargs.setdefault('exclude', parse_field_list(self.request.query_params.get('exclude')))
+        return super().get_serializer(*args, **kwargs)
+    
+    def apply_projection(self, queryset, include=()):
+        """
+        Загружает только столбцы и связи, нужные полям ответа
+        """
+        if self.action not in self.sparse_field_actions:
+            return queryset
+        if self.action == 'list' and self.include_archive():
+            # Оперативные и архивные доставки сливаются по полям сортировки
+            ordering = filters.OrderingFilter().get_ordering(self.request, queryset, self) or ()
+            include = (*include, *(name.lstrip('-') for name in ordering))
+        allow_joins = router.db_for_read(queryset.model) == router.db_for_read(Delivery)
+        return apply_projection(queryset, self.get_serializer(), allow_joins=allow_joins, include=include)
+    
+    def perform_create(self, serializer):
+        """
+        Сохраняет новую доставку (через group commit, если он включен)
+        """
+        run_write(serializer.save)
+    
+    def perform_update(self, serializer):
+        """
+        Сохраняет изменения доставки (через group commit, если он включен)
+        """
+        run_write(serializer.save)
+    
     def get_queryset(self):
         """
         Фильтрация доставок по параметрам запроса
@@ -58,9 +132,30 @@ class DeliveryViewSet(viewsets.ModelViewSet):
         - min_distance, max_distance: диапазон расстояний
         - services: список ID предоставляемых услуг
         - time_filter: фильтр по времени (today, week)
-        """
-        queryset = super().get_queryset()
         
+        Для чтения загружаются только столбцы и связи запрошенных полей.
+        """
+        return self.apply_projection(self.apply_query_filters(super().get_queryset()))
+    
+    def get_archive_queryset(self):
+        """
+        Архивные доставки с теми же фильтрами по параметрам запроса
+        """
+        return self.apply_projection(self.apply_query_filters(
+            ArchivedDelivery.objects.all(), services_lookup='service_links__service_id__in'
+        ))
+    
+    def include_archive(self):
+        """
+        Проверяет, запрошены ли архивные доставки (?include_archive=true)
+        """
+        value = self.request.query_params.get('include_archive', '')
+        return value.lower() in ('1', 'true', 'yes')
+    
+    def apply_query_filters(self, queryset, services_lookup='services__id__in'):
+        """
+        Применяет фильтры по параметрам запроса к оперативным или архивным доставкам
+        """
         # Фильтр по диапазону дистанций
         min_distance = self.request.query_params.get('min_distance', None)
         max_distance = self.request.query_params.get('max_distance', None)
@@ -74,7 +169,7 @@ class DeliveryViewSet(viewsets.ModelViewSet):
         services = self.request.query_params.get('services', None)
         if services:
             service_ids = [int(s) for s in services.split(',')]
-            queryset = queryset.filter(services__id__in=service_ids).distinct()
+            queryset = queryset.filter(**{services_lookup: service_ids}).distinct()
         
         # Фильтр по времени
         time_filter = self.request.query_params.get('time_filter', None)
@@ -89,6 +184,87 @@ class DeliveryViewSet(viewsets.ModelViewSet):
         
         return queryset
     
+    def list(self, request, *args, **kwargs):
+        """
+        Список доставок
+        
+        По умолчанию возвращает только оперативные доставки. С параметром
+        include_archive=true к ним добавляются архивные доставки,
+        отфильтрованные по тем же параметрам, в общем порядке сортировки.
+        
+        С параметром facets=status,transport_model,... ответ дополняется
+        полем facets - счетчиками по всем доставкам, подходящим под фильтры
+        (см. delivery_core.facets).
+        """
+        facets = parse_facets(request.query_params.get('facets'))
+        response = self.list_deliveries(request, *args, **kwargs)
+        if facets:
+            querysets = [self.filter_queryset(self.get_queryset())]
+            if self.include_archive():
+                querysets.append(self.filter_queryset(self.get_archive_queryset()))
+            counts = count_facets(facets, *querysets)
+            if isinstance(response.data, dict):
+                response.data['facets'] = counts
+            else:
+                response.data = {'results': response.data, 'facets': counts}
+        return response
+    
+    def list_deliveries(self, request, *args, **kwargs):
+        """
+        Страница оперативных (и при include_archive=true архивных) доставок
+        """
+        if not self.include_archive():
+            if settings.DELIVERY_FAST_LIST_SERIALIZER:
+                return self.fast_list(request)
+            return super().list(request, *args, **kwargs)
+        
+        results = HotColdResults(
+            self.filter_queryset(self.get_queryset()),
+            self.filter_queryset(self.get_archive_queryset()),
+        )
+        page = self.paginate_queryset(results)
+        if page is not None:
+            serializer = self.get_serializer(page, many=True)
+            return self.get_paginated_response(serializer.data)
+        
+        serializer = self.get_serializer(results[:], many=True)
+        return Response(serializer.data)
+    
+    def fast_list(self, request):
+        """
+        Список доставок через скомпилированный сериализатор
+        
+        Строки читаются через values_list() и преобразуются в словари той же
+        формы, что и у DeliveryListSerializer (см. delivery_core.fast_serializers).
+        Если запрошенные поля не поддерживаются, используется обычный путь.
+        """
+        serializer = self.get_serializer()
+        try:
+            compiled = get_compiled_serializer(serializer)
+        except NotCompilable:
+            return super().list(request)
+        
+        queryset = self.filter_queryset(self.get_queryset()).values_list(*compiled.columns)
+        page = self.paginate_queryset(queryset)
+        if page is not None:
+            return self.get_paginated_response(compiled.serialize(page, serializer))
+        
+        return Response(compiled.serialize(queryset, serializer))
+    
+    def retrieve(self, request, *args, **kwargs):
+        """
+        Получение доставки; с include_archive=true ищет также в архиве
+        """
+        if not self.include_archive():
+            return super().retrieve(request, *args, **kwargs)
+        
+        try:
+            instance = self.get_object()
+        except Http404:
+            instance = get_object_or_404(self.get_archive_queryset(), pk=kwargs['pk'])
+        serializer = self.get_serializer(instance)
+        return Response(serializer.data)
+    
     @action(detail=True, methods=['post'])
     def mark_completed(self, request, pk=None):
         """
@@ -115,11 +291,133 @@ class DeliveryViewSet(viewsets.ModelViewSet):
         
         delivery.status = completed_status
         delivery.updated_by = request.user
-        delivery.save()
+        run_write(delivery.save)
         
         serializer = DeliveryDetailSerializer(delivery)
         return Response(serializer.data)
 
+    def get_media_filename(self, delivery):
+        """
+        Имя файла для сохранения: номер доставки с исходным расширением
+        """
+        return delivery.number + os.path.splitext(delivery.media_file.name)[1]
+    
+    @action(detail=True, methods=['get'])
+    def download(self, request, pk=None):
+        """
+        Скачать медиа-файл доставки
+        
+        Поддерживает Range и условные заголовки; при настроенном
+        DELIVERY_MEDIA_ACCEL отдача передается веб-серверу.
+        """
+        delivery = self.get_object()
+        if not delivery.media_file:
+            return Response({
+                "error": "У доставки нет медиа-файла"
+            }, status=status.HTTP_404_NOT_FOUND)
+        
+        try:
+            return downloads.serve_media(request, delivery.media_file.name, self.get_media_filename(delivery))
+        except FileNotFoundError:
+            return Response({
+                "error": "Медиа-файл не найден в хранилище"
+            }, status=status.HTTP_404_NOT_FOUND)
+    
+    @action(detail=True, methods=['get'])
+    def download_link(self, request, pk=None):
+        """
+        Получить подписанную ссылку на медиа-файл доставки
+        
+        По ссылке файл скачивается без аутентификации до истечения срока
+        действия (DELIVERY_MEDIA_URL_TTL секунд).
+        """
+        delivery = self.get_object()
+        if not delivery.media_file:
+            return Response({
+                "error": "У доставки нет медиа-файла"
+            }, status=status.HTTP_404_NOT_FOUND)
+        
+        url, expires = downloads.sign_media_url(delivery.media_file.name, self.get_media_filename(delivery))
+        return Response({
+            'url': request.build_absolute_uri(url),
+            'expires': expires,
+        })
+    
+    @action(detail=False, methods=['get'])
+    def export(self, request):
+        """
+        Выгрузить все доставки, подходящие под фильтры, одним JSON-массивом
+        
+        Элементы совпадают с элементами списка доставок (поддерживаются
+        фильтры, сортировка и ?fields=). Ответ формируется и отправляется
+        частями, без пагинации и без сборки всего массива в памяти;
+        поддерживается и колоночный формат.
+        """
+        serializer = self.get_serializer()
+        queryset = self.filter_queryset(self.get_queryset())
+        try:
+            compiled = get_compiled_serializer(serializer)
+        except NotCompilable:
+            items = (
+                self.get_serializer(delivery).data
+                for delivery in queryset.iterator(chunk_size=self.export_chunk_size)
+            )
+        else:
+            rows = queryset.values_list(*compiled.columns).iterator(chunk_size=self.export_chunk_size)
+            items = compiled.iterate(rows, serializer)
+        
+        renderer = request.accepted_renderer
+        if not hasattr(renderer, 'stream'):
+            renderer = FastJSONRenderer()
+        return StreamingHttpResponse(
+            renderer.stream(items, chunk_size=self.export_chunk_size, view=self),
+            content_type=renderer.media_type,
+        )
+    
+    @action(detail=False, methods=['get'])
+    def sync(self, request):
+        """
+        Получить изменения доставок с момента предыдущей синхронизации
+        
+        Параметры: cursor - курсор из предыдущего ответа (без него выдаются
+        все доставки), limit - максимальное количество записей каждого вида.
+        Возвращает измененные и созданные доставки (в формате списка,
+        поддерживается ?fields=), отметки об удалении, новый курсор и
+        признак has_more - есть ли еще изменения. Фильтры списка не применяются.
+        """
+        try:
+            limit = int(request.query_params.get('limit', settings.DELIVERY_SYNC_MAX_LIMIT))
+        except ValueError:
+            return Response({
+                "error": "Параметр limit должен быть числом"
+            }, status=status.HTTP_400_BAD_REQUEST)
+        limit = min(max(limit, 1), settings.DELIVERY_SYNC_MAX_LIMIT)
+        
+        queryset = self.apply_projection(Delivery.objects.all(), include=('updated_at',))
+        try:
+            deliveries, tombstones, cursor, has_more = sync.fetch_changes(
+                queryset, request.query_params.get('cursor'), limit
+            )
+        except sync.InvalidCursor as e:
+            return Response({
+                "error": str(e)
+            }, status=status.HTTP_410_GONE)
+        
+        return Response({
+            'deliveries': self.get_serializer(deliveries, many=True).data,
+            'deleted': [
+                {
+                    'id': tombstone.delivery_id,
+                    'number': tombstone.number,
+                    'reason': tombstone.reason,
+                    'deleted_at': tombstone.deleted_at,
+                }
+                for tombstone in tombstones
+            ],
+            'cursor': cursor,
+            'has_more': has_more,
+        })
+    
     @action(detail=False, methods=['get'])
     def stats(self, request):
         """
@@ -149,3 +447,199 @@ class DeliveryViewSet(viewsets.ModelViewSet):
             'pending_deliveries': pending_deliveries,
             'avg_distance': round(float(avg_distance), 2),
         })
+
+
+class UploadSessionViewSet(mixins.CreateModelMixin,
+                           mixins.RetrieveModelMixin,
+                           mixins.DestroyModelMixin,
+                           viewsets.GenericViewSet):
+    """
+    API возобновляемой загрузки медиа-файлов доставок
+    
+    - POST /uploads/ - создать сессию (filename, size, checksum, delivery)
+    - GET /uploads/{id}/ - узнать, сколько байт уже принято
+    - PUT /uploads/{id}/chunk/?offset=N - передать часть файла в теле запроса
+    - POST /uploads/{id}/finalize/ - проверить файл и прикрепить к доставке
+    - DELETE /uploads/{id}/ - отменить загрузку
+    """
+    queryset = UploadSession.objects.all()
+    serializer_class = UploadSessionSerializer
+    permission_classes = [IsAuthenticated]
+    
+    def get_queryset(self):
+        """
+        Пользователь видит только свои сессии загрузки
+        """
+        return super().get_queryset().filter(created_by=self.request.user)
+    
+    def perform_create(self, serializer):
+        serializer.save(created_by=self.request.user)
+    
+    def perform_destroy(self, instance):
+        uploads.abort(instance)
+    
+    @action(detail=True, methods=['put'])
+    def chunk(self, request, pk=None):
+        """
+        Принять часть файла
+        
+        Смещение передается параметром offset или заголовком Upload-Offset
+        и должно совпадать с количеством уже принятых байт. Тело запроса
+        читается потоком и сразу пишется на диск.
+        """
+        session = self.get_object()
+        offset = request.query_params.get('offset', request.headers.get('Upload-Offset'))
+        try:
+            offset = int(offset)
+            length = int(request.headers.get('Content-Length') or 0)
+        except (TypeError, ValueError):
+            return Response({
+                "error": "Необходимо передать смещение (offset) и Content-Length"
+            }, status=status.HTTP_400_BAD_REQUEST)
+        
+        try:
+            uploads.write_chunk(session, offset, request.stream, length)
+        except uploads.UploadError as e:
+            session.refresh_from_db(fields=['received'])
+            return Response({
+                "error": str(e), "received": session.received
+            }, status=e.status_code)
+        
+        return Response(self.get_serializer(session).data)
+    
+    @action(detail=True, methods=['post'])
+    def finalize(self, request, pk=None):
+        """
+        Завершить загрузку и прикрепить файл к доставке
+        
+        Доставка берется из параметра delivery или из сессии загрузки.
+        """
+        session = self.get_object()
+        delivery_id = request.data.get('delivery') or session.delivery_id
+        if not delivery_id:
+            return Response({
+                "error": "Не указана доставка для прикрепления файла"
+            }, status=status.HTTP_400_BAD_REQUEST)
+        try:
+            delivery_id = int(delivery_id)
+        except (TypeError, ValueError):
+            return Response({
+                "error": "Параметр delivery должен быть числом"
+            }, status=status.HTTP_400_BAD_REQUEST)
+        delivery = get_object_or_404(Delivery, pk=delivery_id)
+        
+        try:
+            uploads.finalize(session, delivery, user=request.user)
+        except uploads.UploadError as e:
+            return Response({"error": str(e)}, status=e.status_code)
+        
+        return Response(DeliveryDetailSerializer(delivery, context={'request': request}).data)
+
+
+@require_safe
+def signed_media_download(request, name):
+    """
+    Скачивание медиа-файла по подписанной ссылке
+    
+    Проверяется только подпись и срок действия ссылки - без аутентификации
+    и запросов к базе.
+    """
+    expires = request.GET.get('expires')
+    filename = request.GET.get('filename', '')
+    if not downloads.check_signature(name, expires, filename, request.GET.get('signature')):
+        return HttpResponseForbidden('Ссылка недействительна или устарела')
+    
+    try:
+        return downloads.serve_media(request, name, filename, cache_seconds=int(expires) - time.time())
+    except FileNotFoundError:
+        raise Http404('Файл не найден')
+
+
+@require_safe
+async def delivery_events(request):
+    """
+    Поток событий изменения доставок (Server-Sent Events)
+    
+    Параметры status и transport_model (id через запятую) ограничивают
+    события. Требует ASGI-сервера; аутентификация - токен JWT в заголовке
+    Authorization или в параметре token, либо сессия.
+    """
+    if not isinstance(request, ASGIRequest):
+        return JsonResponse({
+            "error": "Поток событий доступен только при запуске через ASGI"
+        }, status=status.HTTP_501_NOT_IMPLEMENTED)
+    
+    token = request.GET.get('token') or streaming.bearer_token(request.headers.get('Authorization'))
+    if token:
+        user = await streaming.authenticate_token(token)
+    else:
+        user = await request.auser()
+    if user is None or not user.is_authenticated:
+        return JsonResponse({
+            "error": "Требуется аутентификация"
+        }, status=status.HTTP_401_UNAUTHORIZED)
+    
+    try:
+        statuses = parse_id_list(request.GET.get('status'))
+        transport_models = parse_id_list(request.GET.get('transport_model'))
+    except ValueError:
+        return JsonResponse({
+            "error": "Параметры status и transport_model должны быть списками id через запятую"
+        }, status=status.HTTP_400_BAD_REQUEST)
+    
+    if not streaming.has_free_slot():
+        return JsonResponse({
+            "error": "Превышено количество подключений к потоку событий"
+        }, status=status.HTTP_503_SERVICE_UNAVAILABLE)
+    
+    response = StreamingHttpResponse(
+        streaming.sse_stream(statuses, transport_models), content_type='text/event-stream'
+    )
+    response['Cache-Control'] = 'no-cache'
+    # Отключает буферизацию ответа в nginx
+    response['X-Accel-Buffering'] = 'no'
+    return response
+
+
+def _include_archive(request):
+    return request.GET.get('include_archive', '').lower() in ('1', 'true', 'yes')
+
+
+class AsyncDeliveryListView(AsyncListView):
+    """
+    Асинхронный список доставок (при API_ASYNC_VIEWS=True)
+    
+    Повторяет DeliveryViewSet.list, включая ?fields= и быстрый сериализатор.
+    Запросы с include_archive=true или facets и создание доставок выполняет
+    DeliveryViewSet.
+    """
+    viewset_class = DeliveryViewSet
+    
+    def needs_fallback(self, request):
+        return super().needs_fallback(request) or _include_archive(request) or 'facets' in request.GET
+    
+    async def serialize(self, viewset, queryset):
+        if settings.DELIVERY_FAST_LIST_SERIALIZER:
+            serializer = viewset.get_serializer()
+            try:
+                compiled = get_compiled_serializer(serializer)
+            except NotCompilable:
+                pass
+            else:
+                # aiterator() для values_list() выполняет запрос в цикле событий,
+                # поэтому строки выбираются целиком через асинхронный обход
+                rows = [row async for row in queryset.values_list(*compiled.columns)]
+                return compiled.serialize(rows, serializer)
+        return await super().serialize(viewset, queryset)
+
+
+class AsyncDeliveryDetailView(AsyncRetrieveView):
+    """
+    Асинхронное получение доставки (при API_ASYNC_VIEWS=True)
+    
+    Изменение, удаление и поиск в архиве (include_archive=true) выполняет DeliveryViewSet.
+    """
+    viewset_class = DeliveryViewSet
+    
+    def needs_fallback(self, request):
+        return super().needs_fallback(request) or _include_archive(request)
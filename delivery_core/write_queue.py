@@ -0,0 +1,188 @@
+"""
+Групповая фиксация операций записи (group commit)
+
+На SQLite каждая запись открывает собственную транзакцию, и при параллельных
+запросах писатели упираются в ошибку "database is locked". В режиме
+объединения записи (DELIVERY_WRITE_COALESCING) операции создания и обновления
+доставок передаются в очередь единственного потока-писателя, который
+выполняет их небольшими пачками в одной транзакции.
+
+Каждая операция выполняется в собственной точке сохранения (savepoint),
+поэтому ошибка одной операции не откатывает остальные операции пачки.
+Результат или исключение возвращаются вызывающему потоку только после
+успешной фиксации всей транзакции.
+
+Если операция не дождалась своей пачки за DELIVERY_WRITE_TIMEOUT, она
+отменяется и писатель ее пропускает, а клиент получает 503 - повтор
+запроса не создаст дубликат. Операция из уже начатой пачки не отменяется:
+вызывающий поток дожидается фиксации и возвращает ее настоящий результат.
+"""
+import queue
+import threading
+import time
+from concurrent.futures import Future, TimeoutError as FutureTimeoutError
+
+from django.conf import settings
+from django.db import close_old_connections, transaction
+from rest_framework import status
+from rest_framework.exceptions import APIException
+
+
+class WriteTimeout(APIException):
+    """
+    Операция записи не начала выполняться за отведенное время и отменена
+    """
+    status_code = status.HTTP_503_SERVICE_UNAVAILABLE
+    default_detail = 'Запись не выполнена: сервер перегружен, повторите запрос'
+    default_code = 'write_timeout'
+
+
+class _WriteOperation:
+    """
+    Операция записи, ожидающая выполнения в потоке-писателе
+    """
+    __slots__ = ('func', 'args', 'kwargs', 'future', 'result', 'exception')
+
+    def __init__(self, func, args, kwargs):
+        self.func = func
+        self.args = args
+        self.kwargs = kwargs
+        self.future = Future()
+        self.result = None
+        self.exception = None
+
+
+class GroupCommitWriter:
+    """
+    Поток-писатель, фиксирующий операции записи пачками
+
+    Пачка закрывается, когда в ней набирается max_batch операций или когда
+    с момента получения первой операции прошло max_delay секунд.
+    """
+
+    def __init__(self, max_batch=32, max_delay=0.002, using=None):
+        self.max_batch = max_batch
+        self.max_delay = max_delay
+        self.using = using
+        self._queue = queue.Queue()
+        self._thread = None
+        self._start_lock = threading.Lock()
+
+    def submit(self, func, *args, timeout=None, **kwargs):
+        """
+        Ставит операцию в очередь и ждет результата ее фиксации
+
+        Исключение, возникшее при выполнении операции или фиксации пачки,
+        пробрасывается в вызывающий поток. Если за timeout секунд операция
+        не попала в пачку, она отменяется и поднимается WriteTimeout.
+        """
+        self._ensure_started()
+        operation = _WriteOperation(func, args, kwargs)
+        self._queue.put(operation)
+        try:
+            return operation.future.result(timeout=timeout)
+        except FutureTimeoutError:
+            if operation.future.cancel():
+                raise WriteTimeout
+        # Пачка с операцией уже выполняется - ее результат определен
+        return operation.future.result()
+
+    def _ensure_started(self):
+        if self._thread is not None and self._thread.is_alive():
+            return
+        with self._start_lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(
+                    target=self._run, name='delivery-group-commit', daemon=True
+                )
+                self._thread.start()
+
+    def _run(self):
+        while True:
+            batch = [self._queue.get()]
+            deadline = time.monotonic() + self.max_delay
+            while len(batch) < self.max_batch:
+                remaining = deadline - time.monotonic()
+                try:
+                    if remaining > 0:
+                        batch.append(self._queue.get(timeout=remaining))
+                    else:
+                        batch.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            self._commit(batch)
+
+    def _commit(self, batch):
+        """
+        Выполняет пачку операций в одной транзакции
+        """
+        # Отмененные по таймауту операции пропускаются, остальные больше
+        # нельзя отменить
+        batch = [operation for operation in batch if operation.future.set_running_or_notify_cancel()]
+        if not batch:
+            return
+        close_old_connections()
+        try:
+            with transaction.atomic(using=self.using):
+                for operation in batch:
+                    try:
+                        with transaction.atomic(using=self.using):
+                            operation.result = operation.func(
+                                *operation.args, **operation.kwargs
+                            )
+                    except Exception as exc:
+                        operation.exception = exc
+        except Exception as exc:
+            # Не удалось зафиксировать транзакцию - ошибка у всей пачки
+            for operation in batch:
+                operation.future.set_exception(exc)
+            return
+
+        for operation in batch:
+            if operation.exception is not None:
+                operation.future.set_exception(operation.exception)
+            else:
+                operation.future.set_result(operation.result)
+
+
+_writer = None
+_writer_lock = threading.Lock()
+
+
+def is_write_coalescing_enabled():
+    """
+    Проверяет, включен ли режим объединения записи
+    """
+    return getattr(settings, 'DELIVERY_WRITE_COALESCING', False)
+
+
+def get_writer():
+    """
+    Возвращает общий для процесса поток-писатель
+    """
+    global _writer
+    if _writer is None:
+        with _writer_lock:
+            if _writer is None:
+                _writer = GroupCommitWriter(
+                    max_batch=getattr(settings, 'DELIVERY_WRITE_BATCH_SIZE', 32),
+                    max_delay=getattr(settings, 'DELIVERY_WRITE_BATCH_DELAY_MS', 2) / 1000,
+                )
+    return _writer
+
+
+def run_write(func, *args, **kwargs):
+    """
+    Выполняет операцию записи напрямую или через поток-писатель
+
+    В обычном режиме операция выполняется в текущем потоке, как и раньше,
+    в режиме объединения - ставится в очередь group commit. Внутри
+    транзакции вызывающего кода (атомарный пакет, ATOMIC_REQUESTS) операция
+    всегда выполняется в текущем потоке: иначе откат транзакции не отменил
+    бы запись потока-писателя, а на SQLite писатель ждал бы блокировку,
+    которую держит эта транзакция.
+    """
+    if is_write_coalescing_enabled() and not transaction.get_connection().in_atomic_block:
+        timeout = getattr(settings, 'DELIVERY_WRITE_TIMEOUT', 30)
+        return get_writer().submit(func, *args, timeout=timeout, **kwargs)
+    return func(*args, **kwargs)
@@ -13,4 +13,21 @@ from django.core.asgi import get_asgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'delivery_project.settings')
 
-application = get_asgi_application()
+django_application = get_asgi_application()
+
+# Импорт после get_asgi_application(): модулю нужны загруженные приложения
+from delivery_core.streaming import WEBSOCKET_PATH, websocket_application
+
+
+async def application(scope, receive, send):
+    """
+    Передает WebSocket-подключения к потоку событий доставок в
+    websocket_application, остальные запросы - в Django
+    """
+    if scope['type'] == 'websocket':
+        if scope['path'] == WEBSOCKET_PATH:
+            return await websocket_application(scope, receive, send)
+        await receive()
+        await send({'type': 'websocket.close'})
+        return
+    return await django_application(scope, receive, send)
@@ -0,0 +1,278 @@
+"""
+Асинхронные представления API для чтения
+
+Под ASGI синхронное представление DRF занимает поток из пула sync_to_async
+на все время запроса, поэтому медленные запросы ограничивают количество
+одновременно обслуживаемых клиентов размером пула. Асинхронные
+представления выполняют запросы к базе через асинхронный ORM (acount,
+aiterator, aget), а аутентификацию, сериализацию и рендеринг - в цикле
+событий.
+
+Представления подключаются вместо маршрутов роутера при API_ASYNC_VIEWS=True
+и повторяют ответы соответствующих ViewSet: фильтры, поиск, сортировку,
+пагинацию и формат ответа. Для построения запроса создается экземпляр
+ViewSet, поэтому поведение задается в одном месте. Методы, отличные от GET
+и HEAD, передаются синхронному представлению fallback_view.
+"""
+from asgiref.sync import sync_to_async
+from django.contrib.auth import get_user_model
+from django.core.paginator import InvalidPage, Page, Paginator
+from django.http import HttpResponse
+from django.shortcuts import aget_object_or_404
+from django.utils.decorators import classonlymethod
+from django.utils.translation import gettext_lazy as _
+from django.views import View
+from django.views.decorators.csrf import csrf_exempt
+from rest_framework import exceptions
+from rest_framework.negotiation import DefaultContentNegotiation
+from rest_framework.renderers import JSONRenderer
+from rest_framework.request import Request
+from rest_framework.response import Response
+from rest_framework.views import exception_handler
+from rest_framework_simplejwt.authentication import AUTH_HEADER_TYPE_BYTES, JWTAuthentication
+from rest_framework_simplejwt.exceptions import InvalidToken
+from rest_framework_simplejwt.settings import api_settings as jwt_settings
+
+from .renderers import FastJSONRenderer
+
+
+def bearer_token(authorization):
+    """
+    Извлекает токен из значения заголовка Authorization
+    """
+    parts = (authorization or '').split()
+    if len(parts) == 2 and parts[0].encode() in AUTH_HEADER_TYPE_BYTES:
+        return parts[1]
+    return None
+
+
+async def aget_token_user(raw_token):
+    """
+    Возвращает активного пользователя по токену доступа JWT
+
+    Проверка подписи выполняется в цикле событий, пользователь загружается
+    асинхронным запросом. Ошибки - те же, что у JWTAuthentication.
+    """
+    validated_token = JWTAuthentication().get_validated_token(raw_token)
+    try:
+        user_id = validated_token[jwt_settings.USER_ID_CLAIM]
+    except KeyError:
+        raise InvalidToken(_('Token contained no recognizable user identification'))
+
+    try:
+        user = await get_user_model().objects.aget(**{jwt_settings.USER_ID_FIELD: user_id})
+    except get_user_model().DoesNotExist:
+        raise exceptions.AuthenticationFailed(_('User not found'), code='user_not_found')
+    if not user.is_active:
+        raise exceptions.AuthenticationFailed(_('User is inactive'), code='user_inactive')
+    return user
+
+
+async def aauthenticate(request):
+    """
+    Аутентифицирует запрос токеном JWT из заголовка Authorization или сессией
+    """
+    # Пользователь, заданный force_authenticate тестового клиента DRF
+    force_user = getattr(request, '_force_auth_user', None)
+    if force_user is not None:
+        return force_user
+    token = bearer_token(request.headers.get('Authorization'))
+    if token:
+        return await aget_token_user(token)
+    return await request.auser()
+
+
+class AsyncAPIView(View):
+    """
+    Базовое асинхронное представление API только для чтения
+
+    Наследники реализуют async get(request, ...) и возвращают Response DRF.
+    Для рендеринга используются только JSON-рендереры (без Browsable API,
+    которому нужен синхронный контекст).
+    """
+    renderer_classes = (FastJSONRenderer,)
+    throttle_classes = ()
+    fallback_view = None
+
+    @classonlymethod
+    def as_view(cls, **initkwargs):
+        # Проверка CSRF для сессий выполняется DRF в синхронном представлении
+        return csrf_exempt(super().as_view(**initkwargs))
+
+    def needs_fallback(self, request):
+        """
+        Проверяет, нужно ли передать запрос синхронному представлению
+        """
+        return request.method not in ('GET', 'HEAD')
+
+    async def dispatch(self, request, *args, **kwargs):
+        if self.needs_fallback(request):
+            if self.fallback_view is None:
+                return self.http_method_not_allowed(request, *args, **kwargs)
+            return await sync_to_async(self.fallback_view)(request, *args, **kwargs)
+
+        drf_request = Request(request)
+        self.request = drf_request
+        try:
+            user = await aauthenticate(request)
+            if not user.is_authenticated:
+                raise exceptions.NotAuthenticated()
+            drf_request.user = user
+            drf_request.auth = None
+            if self.throttle_classes:
+                # Ограничители обращаются к кэшу синхронно
+                await sync_to_async(self.check_throttles)(drf_request)
+            response = await self.get(drf_request, *args, **kwargs)
+        except Exception as exc:
+            response = self.handle_exception(exc)
+        return self.finalize_response(drf_request, response)
+
+    def check_throttles(self, request):
+        """
+        Проверяет ограничения throttle_classes, как APIView.check_throttles
+        """
+        durations = []
+        for throttle_class in self.throttle_classes:
+            throttle = throttle_class()
+            if not throttle.allow_request(request, self):
+                durations.append(throttle.wait())
+        if durations:
+            waits = [duration for duration in durations if duration is not None]
+            raise exceptions.Throttled(max(waits) if waits else None)
+
+    def handle_exception(self, exc):
+        if isinstance(exc, (exceptions.NotAuthenticated, exceptions.AuthenticationFailed)):
+            exc.auth_header = f'{jwt_settings.AUTH_HEADER_TYPES[0]} realm="api"'
+        response = exception_handler(exc, {'view': self, 'request': self.request})
+        if response is None:
+            raise exc
+        return response
+
+    def get_renderers(self):
+        return [renderer() for renderer in self.renderer_classes if issubclass(renderer, JSONRenderer)]
+
+    def get_renderer_context(self, response):
+        return {'view': self, 'request': self.request, 'response': response}
+
+    def finalize_response(self, request, response):
+        """
+        Рендерит Response в обычный HttpResponse, чтобы обработчик Django
+        не вызывал render() в отдельном потоке
+        """
+        try:
+            renderer, media_type = DefaultContentNegotiation().select_renderer(request, self.get_renderers())
+        except exceptions.NotAcceptable as exc:
+            renderer, media_type = FastJSONRenderer(), FastJSONRenderer.media_type
+            response = Response({'detail': exc.detail}, status=exc.status_code)
+
+        content = renderer.render(response.data, media_type, self.get_renderer_context(response))
+        content_type = media_type
+        if renderer.charset:
+            content_type = f'{media_type}; charset={renderer.charset}'
+        rendered = HttpResponse(content, status=response.status_code, content_type=content_type)
+        for header, value in response.items():
+            if header.lower() != 'content-type':
+                rendered[header] = value
+        rendered['Vary'] = 'Accept'
+        return rendered
+
+
+class AsyncViewSetMixin:
+    """
+    Построение запроса, сериализатора и пагинации через экземпляр ViewSet
+    """
+    viewset_class = None
+    action = None
+
+    def get_viewset(self, request, **kwargs):
+        viewset = self.viewset_class(
+            request=request, args=(), kwargs=kwargs, format_kwarg=None, action=self.action
+        )
+        viewset.headers = {}
+        return viewset
+
+    def get_renderers(self):
+        return [
+            renderer() for renderer in self.viewset_class.renderer_classes if issubclass(renderer, JSONRenderer)
+        ]
+
+    def get_renderer_context(self, response):
+        # Рендереры берут настройки из представления (например, columnar_references)
+        context = super().get_renderer_context(response)
+        context['view'] = getattr(self, 'viewset', self)
+        return context
+
+    def uses_sync_filters(self, viewset):
+        """
+        Проверяет, переданы ли фильтры django-filter по связям
+
+        Проверка значения такого фильтра выполняет синхронный запрос к базе,
+        поэтому queryset с ним строится в потоке.
+        """
+        return any(name in self.request.query_params for name in getattr(viewset, 'filterset_fields', ()))
+
+    async def get_filtered_queryset(self, viewset):
+        if self.uses_sync_filters(viewset):
+            return await sync_to_async(lambda: viewset.filter_queryset(viewset.get_queryset()))()
+        return viewset.filter_queryset(viewset.get_queryset())
+
+
+class AsyncListView(AsyncViewSetMixin, AsyncAPIView):
+    """
+    Асинхронный список объектов ViewSet с пагинацией
+    """
+    action = 'list'
+
+    async def get(self, request, *args, **kwargs):
+        self.viewset = viewset = self.get_viewset(request, **kwargs)
+        queryset = await self.get_filtered_queryset(viewset)
+        paginator = viewset.paginator
+        if paginator is None:
+            return Response(await self.serialize(viewset, queryset))
+
+        page_size = paginator.get_page_size(request)
+        if not page_size:
+            return Response(await self.serialize(viewset, queryset))
+        page = await self.apaginate(queryset, page_size)
+        paginator.request = request
+        paginator.page = page
+        return paginator.get_paginated_response(await self.serialize(viewset, page.object_list))
+
+    async def apaginate(self, queryset, page_size):
+        """
+        Страница PageNumberPagination с подсчетом количества через acount()
+        """
+        django_paginator = Paginator(queryset, page_size)
+        # Paginator.count кэшируется в __dict__ - подставляем значение заранее
+        django_paginator.__dict__['count'] = await queryset.acount()
+        number = self.request.query_params.get(self.viewset.paginator.page_query_param) or 1
+        if number in self.viewset.paginator.last_page_strings:
+            number = django_paginator.num_pages
+        try:
+            number = django_paginator.validate_number(number)
+        except InvalidPage as exc:
+            raise exceptions.NotFound(self.viewset.paginator.invalid_page_message.format(
+                page_number=number, message=str(exc)
+            ))
+        bottom = (number - 1) * page_size
+        return Page(queryset[bottom:bottom + page_size], number, django_paginator)
+
+    async def serialize(self, viewset, queryset):
+        chunk_size = getattr(viewset, 'export_chunk_size', 2000)
+        objects = [obj async for obj in queryset.aiterator(chunk_size=chunk_size)]
+        return viewset.get_serializer(objects, many=True).data
+
+
+class AsyncRetrieveView(AsyncViewSetMixin, AsyncAPIView):
+    """
+    Асинхронное получение объекта ViewSet по первичному ключу
+    """
+    action = 'retrieve'
+
+    async def get(self, request, *args, **kwargs):
+        self.viewset = viewset = self.get_viewset(request, **kwargs)
+        lookup_url_kwarg = viewset.lookup_url_kwarg or viewset.lookup_field
+        instance = await aget_object_or_404(
+            viewset.get_queryset(), **{viewset.lookup_field: kwargs[lookup_url_kwarg]}
+        )
+        return Response(viewset.get_serializer(instance).data)
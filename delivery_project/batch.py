@@ -0,0 +1,238 @@
+"""
+Пакетные запросы к API: POST /api/batch/
+
+Клиент передает список вложенных запросов и получает все ответы одним
+ответом, вместо отдельного HTTP-запроса на каждый эндпоинт:
+
+    {
+        "requests": [
+            {"method": "GET", "path": "/api/delivery/deliveries/stats/"},
+            {"method": "GET", "path": "/api/references/services/?page=2"},
+            {"method": "PATCH", "path": "/api/delivery/deliveries/5/", "body": {"status": 2}}
+        ],
+        "atomic": false
+    }
+
+Вложенные запросы выполняются по порядку внутри процесса через URLconf
+проекта, без повторного прохождения middleware. Пользователь определяется
+один раз для пакета и передается вложенным запросам как уже
+аутентифицированный (как force_authenticate тестового клиента DRF).
+
+Ответ: {"responses": [{"status": 200, "body": {...}}, ...]}. Тело каждого
+ответа вставляется уже отрендеренным, без повторного разбора JSON.
+Поддерживаются только эндпоинты API (/api/...) на представлениях DRF и
+асинхронных представлениях API. Потоковые ответы (экспорт, поток событий),
+вложенные пакеты и отчеты профилирования не поддерживаются - для них
+возвращается ошибка 400 в ответе элемента. Исключение во вложенном
+запросе также становится ответом элемента (404, 403 или 500), а не
+ошибкой всего пакета.
+
+При "atomic": true пакет выполняется в одной транзакции: после первого
+ответа с ошибкой (статус 400 и выше) остальные запросы не выполняются,
+изменения откатываются, а в ответе добавляется "rolled_back": true.
+"""
+import json
+import logging
+from contextlib import nullcontext
+from io import BytesIO
+from urllib.parse import urlsplit
+
+from asgiref.sync import async_to_sync, iscoroutinefunction
+from django.conf import settings
+from django.core.exceptions import PermissionDenied
+from django.core.handlers.wsgi import WSGIRequest
+from django.db import transaction
+from django.http import HttpResponse, Http404
+from django.urls import resolve
+from rest_framework import status
+from rest_framework.decorators import api_view, permission_classes
+from rest_framework.permissions import IsAuthenticated
+from rest_framework.response import Response
+from rest_framework.views import APIView
+
+from .async_views import AsyncAPIView
+from .db_routing import SAFE_METHODS, request_routing
+
+
+logger = logging.getLogger(__name__)
+
+BATCH_METHODS = ('GET', 'HEAD', 'POST', 'PUT', 'PATCH', 'DELETE')
+
+# Вложенные запросы допускаются только к API
+BATCH_PATH_PREFIX = '/api/'
+
+# Маршруты API, недоступные из пакета: сам пакет и отчеты профилирования
+BATCH_EXCLUDED_URL_NAMES = ('api-batch', 'profile-list', 'profile-detail')
+
+# Заголовки исходного запроса, которые не передаются вложенным запросам
+_SKIPPED_META = ('CONTENT_TYPE', 'CONTENT_LENGTH', 'HTTP_CONTENT_TYPE', 'HTTP_CONTENT_LENGTH')
+
+
+def _encode(data):
+    return json.dumps(data, ensure_ascii=False, separators=(',', ':')).encode()
+
+
+def parse_batch(data):
+    """
+    Проверяет тело пакетного запроса и возвращает список вложенных запросов
+    (method, path, query_string, body); ValueError при ошибке
+    """
+    if not isinstance(data, dict) or not isinstance(data.get('requests'), list):
+        raise ValueError('Ожидается объект с полем requests - списком запросов')
+    items = data['requests']
+    if not items:
+        raise ValueError('Список запросов пуст')
+    if len(items) > settings.API_BATCH_MAX_REQUESTS:
+        raise ValueError(f'Не более {settings.API_BATCH_MAX_REQUESTS} запросов в пакете')
+
+    parsed = []
+    for index, item in enumerate(items):
+        if not isinstance(item, dict) or not isinstance(item.get('path'), str):
+            raise ValueError(f'Запрос {index}: укажите path')
+        method = str(item.get('method', 'GET')).upper()
+        if method not in BATCH_METHODS:
+            raise ValueError(f'Запрос {index}: метод {method} не поддерживается')
+        url = urlsplit(item['path'])
+        if url.scheme or url.netloc or not url.path.startswith('/'):
+            raise ValueError(f'Запрос {index}: path должен быть путем от корня сайта')
+        if not url.path.startswith(BATCH_PATH_PREFIX):
+            raise ValueError(f'Запрос {index}: поддерживаются только пути {BATCH_PATH_PREFIX}...')
+        parsed.append((method, url.path, url.query, item.get('body')))
+    return parsed
+
+
+def build_subrequest(request, method, path, query_string, body):
+    """
+    Создает вложенный запрос с заголовками и пользователем пакетного запроса
+    """
+    environ = {key: value for key, value in request.META.items() if key not in _SKIPPED_META}
+    content = b'' if body is None else _encode(body)
+    environ.update({
+        'REQUEST_METHOD': method,
+        'PATH_INFO': path,
+        'QUERY_STRING': query_string,
+        'CONTENT_LENGTH': str(len(content)),
+        'HTTP_ACCEPT': 'application/json',
+        'wsgi.input': BytesIO(content),
+    })
+    if body is not None:
+        environ['CONTENT_TYPE'] = 'application/json'
+    environ.setdefault('SCRIPT_NAME', '')
+    environ.setdefault('wsgi.url_scheme', request.scheme)
+
+    subrequest = WSGIRequest(environ)
+    subrequest.user = request.user
+    if hasattr(request._request, 'session'):
+        subrequest.session = request._request.session
+    # DRF пропускает аутентификацию для уже известного пользователя
+    subrequest._force_auth_user = request.user
+    subrequest._force_auth_token = request.auth
+    return subrequest
+
+
+def _error(status_code, message):
+    return status_code, _encode({'error': message})
+
+
+def _release(response):
+    """
+    Освобождает ресурсы ответа (например, открытый файл)
+
+    response.close() отправляет сигнал request_finished, который закрыл бы
+    соединения с базой посреди пакета, в том числе внутри транзакции.
+    """
+    for closer in response._resource_closers:
+        closer()
+    response._resource_closers.clear()
+
+
+def is_batchable(match):
+    """
+    Проверяет, можно ли выполнить найденное представление в пакете
+    """
+    if match.url_name in BATCH_EXCLUDED_URL_NAMES:
+        return False
+    view_class = getattr(match.func, 'cls', None) or getattr(match.func, 'view_class', None)
+    return isinstance(view_class, type) and issubclass(view_class, (APIView, AsyncAPIView))
+
+
+def execute_subrequest(subrequest):
+    """
+    Выполняет вложенный запрос; возвращает статус и тело ответа в JSON
+    """
+    try:
+        match = resolve(subrequest.path_info)
+    except Http404:
+        return _error(status.HTTP_404_NOT_FOUND, 'Эндпоинт не найден')
+    if not is_batchable(match):
+        return _error(status.HTTP_400_BAD_REQUEST, 'Эндпоинт не поддерживается в пакетном запросе')
+
+    try:
+        if iscoroutinefunction(match.func):
+            response = async_to_sync(match.func)(subrequest, *match.args, **match.kwargs)
+        else:
+            response = match.func(subrequest, *match.args, **match.kwargs)
+    except Http404:
+        return _error(status.HTTP_404_NOT_FOUND, 'Не найдено')
+    except PermissionDenied:
+        return _error(status.HTTP_403_FORBIDDEN, 'Доступ запрещен')
+    except Exception:
+        logger.exception('Ошибка вложенного запроса %s %s', subrequest.method, subrequest.path)
+        return _error(status.HTTP_500_INTERNAL_SERVER_ERROR, 'Внутренняя ошибка сервера')
+    try:
+        if response.streaming:
+            return _error(status.HTTP_400_BAD_REQUEST, 'Потоковые ответы не поддерживаются в пакете')
+        if hasattr(response, 'render'):
+            response.render()
+        content = response.content
+    finally:
+        _release(response)
+
+    if not content or subrequest.method == 'HEAD':
+        return response.status_code, b'null'
+    if response.get('Content-Type', '').startswith('application/json'):
+        return response.status_code, content
+    return response.status_code, _encode(content.decode(response.charset, errors='replace'))
+
+
+@api_view(['POST'])
+@permission_classes([IsAuthenticated])
+def batch(request):
+    """
+    Выполнение нескольких запросов к API одним запросом
+
+    Тело запроса:
+    - requests: список запросов {"method", "path", "body"} (method по умолчанию GET)
+    - atomic: выполнить пакет в одной транзакции (по умолчанию false)
+
+    Возвращает ответы вложенных запросов в том же порядке.
+    """
+    try:
+        items = parse_batch(request.data)
+    except ValueError as e:
+        return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+
+    atomic = bool(request.data.get('atomic'))
+    read_only = not atomic and all(method in SAFE_METHODS for method, *_ in items)
+    results = []
+    rolled_back = False
+
+    with transaction.atomic() if atomic else nullcontext():
+        for method, path, query_string, body in items:
+            subrequest = build_subrequest(request, method, path, query_string, body)
+            # Пакет только из чтений может читать из реплики; при записи все
+            # вложенные запросы читают из основной базы
+            with request_routing(subrequest, use_primary=not read_only):
+                status_code, content = execute_subrequest(subrequest)
+            results.append(b'{"status":%d,"body":%s}' % (status_code, content))
+            if atomic and status_code >= 400:
+                transaction.set_rollback(True)
+                rolled_back = True
+                break
+
+    payload = b'{"responses":[' + b','.join(results) + b']'
+    if rolled_back:
+        payload += b',"rolled_back":true'
+    response = HttpResponse(payload + b'}', content_type='application/json')
+    response.db_read_only = read_only
+    return response
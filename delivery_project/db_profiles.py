@@ -0,0 +1,105 @@
+"""
+Профили подключения к базе данных
+
+Профиль выбирается переменной окружения DB_PROFILE (через decouple):
+
+- sqlite          - SQLite с настройками по умолчанию (поведение до профилей)
+- sqlite_tuned    - SQLite в режиме WAL с PRAGMA synchronous=NORMAL, mmap_size,
+                    cache_size и busy_timeout на каждом подключении,
+                    постоянные подключения и BEGIN IMMEDIATE для записи
+- postgres        - PostgreSQL с постоянными подключениями (CONN_MAX_AGE)
+                    и проверкой их состояния перед повторным использованием
+- postgres_pooled - PostgreSQL с пулом подключений Django
+                    (требуется psycopg 3 и psycopg_pool, см.
+                    requirements-postgres-pooled.txt)
+"""
+from decouple import config
+from django.core.exceptions import ImproperlyConfigured
+
+
+SQLITE_PROFILES = ('sqlite', 'sqlite_tuned')
+POSTGRES_PROFILES = ('postgres', 'postgres_pooled')
+
+
+def sqlite_pragmas():
+    """
+    Возвращает PRAGMA, выполняемые при открытии подключения к SQLite
+    """
+    return [
+        'PRAGMA journal_mode=WAL',
+        'PRAGMA synchronous=NORMAL',
+        f"PRAGMA mmap_size={config('SQLITE_MMAP_SIZE', default=268435456, cast=int)}",
+        # Отрицательное значение задает размер кэша в КиБ
+        f"PRAGMA cache_size={config('SQLITE_CACHE_SIZE', default=-65536, cast=int)}",
+        f"PRAGMA busy_timeout={config('SQLITE_BUSY_TIMEOUT', default=5000, cast=int)}",
+    ]
+
+
+def _check_pool_dependencies():
+    # Без проверки ошибка появилась бы только при первом подключении
+    try:
+        import psycopg  # noqa: F401
+        import psycopg_pool  # noqa: F401
+    except ImportError:
+        raise ImproperlyConfigured(
+            "Профиль DB_PROFILE='postgres_pooled' требует psycopg 3 и psycopg_pool: "
+            "pip install -r requirements-postgres-pooled.txt"
+        )
+
+
+def build_database(profile, base_dir, name=None, host=None):
+    """
+    Формирует описание базы данных для settings.DATABASES по профилю
+
+    Параметры name и host позволяют описать дополнительную базу (например,
+    реплику) с тем же профилем, но другим файлом SQLite или сервером PostgreSQL.
+    """
+    if profile in SQLITE_PROFILES:
+        database = {
+            'ENGINE': 'django.db.backends.sqlite3',
+            'NAME': str(base_dir / name) if name else config('DB_NAME', default=str(base_dir / 'db.sqlite3')),
+        }
+        if profile == 'sqlite_tuned':
+            database['CONN_MAX_AGE'] = config('DB_CONN_MAX_AGE', default=600, cast=int)
+            database['OPTIONS'] = {
+                'init_command': ';'.join(sqlite_pragmas()),
+                'transaction_mode': 'IMMEDIATE',
+            }
+        return database
+
+    if profile in POSTGRES_PROFILES:
+        database = {
+            'ENGINE': 'django.db.backends.postgresql',
+            'NAME': name or config('DB_NAME', default='delivery_db'),
+            'USER': config('DB_USER', default='postgres'),
+            'PASSWORD': config('DB_PASSWORD', default='postgres'),
+            'HOST': host or config('DB_HOST', default='localhost'),
+            'PORT': config('DB_PORT', default='5432'),
+            'CONN_HEALTH_CHECKS': True,
+        }
+        if profile == 'postgres_pooled':
+            _check_pool_dependencies()
+            # С пулом подключения возвращаются в пул после каждого запроса
+            database['CONN_MAX_AGE'] = 0
+            database['OPTIONS'] = {
+                'pool': {
+                    'min_size': config('DB_POOL_MIN_SIZE', default=2, cast=int),
+                    'max_size': config('DB_POOL_MAX_SIZE', default=10, cast=int),
+                    'timeout': config('DB_POOL_TIMEOUT', default=10, cast=int),
+                },
+            }
+        else:
+            database['CONN_MAX_AGE'] = config('DB_CONN_MAX_AGE', default=600, cast=int)
+        return database
+
+    raise ValueError(
+        f"Неизвестный профиль базы данных DB_PROFILE='{profile}'. "
+        f"Допустимые значения: {', '.join(SQLITE_PROFILES + POSTGRES_PROFILES)}"
+    )
+
+
+def get_db_profile():
+    """
+    Возвращает имя профиля базы данных из окружения
+    """
+    return config('DB_PROFILE', default='sqlite')
@@ -0,0 +1,283 @@
+"""
+Маршрутизация запросов между основной базой и репликой для чтения
+
+Безопасные запросы (GET, HEAD, OPTIONS) читают данные из реплики
+(settings.DB_REPLICA_ALIAS), все остальные запросы и любые записи идут
+в основную базу. После успешной записи пользователь на короткое время
+(DB_PRIMARY_STICKY_SECONDS) "прилипает" к основной базе, чтобы сразу
+видеть свои изменения, даже если реплика еще не догнала основную базу.
+
+Эндпоинт может отказаться от чтения из реплики:
+- функция-представление - декоратором use_primary_db (применяется последним);
+- класс представления - атрибутом use_primary_db = True;
+- отдельные действия ViewSet - атрибутом primary_db_actions = {'stats', ...}.
+
+Пакетный запрос (delivery_project.batch) задает маршрутизацию вложенных
+запросов через request_routing; ответ пакета только из чтений отмечается
+атрибутом db_read_only, чтобы POST пакета не включал "липкость".
+
+Вне HTTP-запросов (management-команды, фоновые потоки) все запросы
+выполняются в основной базе.
+
+Архивные модели доставок (delivery_core.ArchivedDelivery*) при настроенной
+архивной базе (settings.DB_ARCHIVE_ALIAS) читаются и пишутся только в нее.
+"""
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.core.cache import cache
+from django.db import DEFAULT_DB_ALIAS
+from django.utils.functional import SimpleLazyObject, empty
+
+
+SAFE_METHODS = ('GET', 'HEAD', 'OPTIONS')
+
+_routing_state = ContextVar('db_routing_state', default=None)
+
+
+def get_replica_alias():
+    """
+    Возвращает псевдоним реплики или None, если реплика не настроена
+    """
+    alias = getattr(settings, 'DB_REPLICA_ALIAS', 'replica')
+    return alias if alias in settings.DATABASES else None
+
+
+def get_archive_alias():
+    """
+    Возвращает псевдоним архивной базы или None, если архив хранится в основной
+    """
+    alias = getattr(settings, 'DB_ARCHIVE_ALIAS', 'archive')
+    return alias if alias in settings.DATABASES else None
+
+
+def is_archive_model(app_label, model_name):
+    """
+    Проверяет, относится ли модель к архиву доставок
+    """
+    return app_label == 'delivery_core' and model_name.startswith('archiveddelivery')
+
+
+def get_sticky_seconds():
+    return getattr(settings, 'DB_PRIMARY_STICKY_SECONDS', 10)
+
+
+def _sticky_cache_key(user_id):
+    return f'db_routing:primary_sticky:{user_id}'
+
+
+def _known_user_id(request):
+    """
+    Возвращает id пользователя, если он уже определен, не выполняя запросов
+
+    DRF после аутентификации записывает пользователя в request.user исходного
+    запроса, а ленивый пользователь сессии проверяется только если он уже
+    был вычислен.
+    """
+    user = request.__dict__.get('user')
+    if isinstance(user, SimpleLazyObject):
+        user = user._wrapped
+        if user is empty:
+            return None
+    if user is None or not user.is_authenticated:
+        return None
+    return user.pk
+
+
+class RoutingState:
+    """
+    Состояние маршрутизации для текущего запроса
+    """
+    __slots__ = ('request', 'use_primary', 'user_checked')
+
+    def __init__(self, request, use_primary=False):
+        self.request = request
+        self.use_primary = use_primary
+        self.user_checked = False
+
+    def prefers_primary(self):
+        """
+        Проверяет, нужно ли читать из основной базы
+
+        Пользовательская "липкость" проверяется один раз - как только
+        пользователь запроса становится известен.
+        """
+        if self.use_primary:
+            return True
+        if not self.user_checked:
+            user_id = _known_user_id(self.request)
+            if user_id is not None:
+                self.user_checked = True
+                if cache.get(_sticky_cache_key(user_id)):
+                    self.use_primary = True
+        return self.use_primary
+
+
+def has_sticky_cookie(request):
+    """
+    Проверяет, действует ли у запроса cookie "липкости" к основной базе
+    """
+    value = request.COOKIES.get(settings.DB_PRIMARY_STICKY_COOKIE)
+    try:
+        return value is not None and float(value) > time.time()
+    except ValueError:
+        return False
+
+
+@contextmanager
+def request_routing(request, use_primary=False):
+    """
+    Задает маршрутизацию чтения для запроса, выполняемого внутри другого
+    """
+    if get_replica_alias() is None:
+        yield
+        return
+    token = _routing_state.set(RoutingState(request, use_primary=use_primary or has_sticky_cookie(request)))
+    try:
+        yield
+    finally:
+        _routing_state.reset(token)
+
+
+def use_primary_db(view_func):
+    """
+    Декоратор, отключающий чтение из реплики для функции-представления
+    """
+    view_func.use_primary_db = True
+    return view_func
+
+
+def _view_uses_primary(view_func, request):
+    if getattr(view_func, 'use_primary_db', False):
+        return True
+    view_class = getattr(view_func, 'cls', None)
+    if view_class is None:
+        return False
+    if getattr(view_class, 'use_primary_db', False):
+        return True
+    actions = getattr(view_func, 'actions', None) or {}
+    action = actions.get(request.method.lower())
+    return action in getattr(view_class, 'primary_db_actions', ())
+
+
+class PrimaryReplicaRouter:
+    """
+    Роутер баз данных: запись в основную базу, чтение - по состоянию запроса
+
+    Всегда возвращает конкретную базу, чтобы связанные объекты архивной
+    доставки (справочники, пользователи) не искались в архивной базе.
+    """
+
+    def _archive_db(self, model):
+        archive = get_archive_alias()
+        if archive and is_archive_model(model._meta.app_label, model._meta.model_name):
+            return archive
+        return None
+
+    def db_for_read(self, model, **hints):
+        archive = self._archive_db(model)
+        if archive:
+            return archive
+        replica = get_replica_alias()
+        if replica is None:
+            return DEFAULT_DB_ALIAS
+        state = _routing_state.get()
+        if state is None or state.prefers_primary():
+            return DEFAULT_DB_ALIAS
+        return replica
+
+    def db_for_write(self, model, **hints):
+        return self._archive_db(model) or DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # Реплика содержит те же данные, что и основная база, а связи
+        # архивных доставок объявлены без ограничений в базе
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        archive = get_archive_alias()
+        if archive is None:
+            return None
+        if model_name is not None and is_archive_model(app_label, model_name):
+            return db == archive
+        if db == archive:
+            # В архивной базе нет остальных таблиц, в том числе для RunPython
+            return False
+        return None
+
+
+class ReplicaRoutingMiddleware:
+    """
+    Middleware, определяющее базу для чтения в рамках запроса
+
+    Небезопасные методы, запросы с действующей cookie "липкости" и эндпоинты,
+    отказавшиеся от реплики, читают из основной базы. После успешной записи
+    выставляются cookie и отметка в кэше для пользователя.
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.async_mode = iscoroutinefunction(get_response)
+        if self.async_mode:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.async_mode:
+            return self.__acall__(request)
+        if get_replica_alias() is None:
+            return self.get_response(request)
+
+        state, is_write = self._start(request)
+        token = _routing_state.set(state)
+        try:
+            response = self.get_response(request)
+        finally:
+            _routing_state.reset(token)
+        return self._finish(request, response, is_write)
+
+    async def __acall__(self, request):
+        # Под ASGI асинхронные представления выполняются без перехода в поток
+        if get_replica_alias() is None:
+            return await self.get_response(request)
+
+        state, is_write = self._start(request)
+        token = _routing_state.set(state)
+        try:
+            response = await self.get_response(request)
+        finally:
+            _routing_state.reset(token)
+        return self._finish(request, response, is_write)
+
+    def _start(self, request):
+        is_write = request.method not in SAFE_METHODS
+        return RoutingState(request, use_primary=is_write or has_sticky_cookie(request)), is_write
+
+    def _finish(self, request, response, is_write):
+        if is_write and response.status_code < 400 and not getattr(response, 'db_read_only', False):
+            self._mark_sticky(request, response)
+        return response
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        state = _routing_state.get()
+        if state is not None and _view_uses_primary(view_func, request):
+            state.use_primary = True
+        return None
+
+    def _mark_sticky(self, request, response):
+        seconds = get_sticky_seconds()
+        response.set_cookie(
+            settings.DB_PRIMARY_STICKY_COOKIE,
+            str(time.time() + seconds),
+            max_age=seconds,
+            httponly=True,
+            samesite='Lax',
+        )
+        user_id = _known_user_id(request)
+        if user_id is not None:
+            cache.set(_sticky_cache_key(user_id), True, seconds)
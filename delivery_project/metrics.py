@@ -0,0 +1,401 @@
+"""
+Метрики запросов в формате Prometheus (GET /metrics)
+
+MetricsMiddleware записывает для каждого запроса по имени маршрута
+(resolver_match.view_name, например delivery-list, delivery-stats,
+delivery-reports):
+- http_request_duration_seconds - время обработки запроса (route, method, status);
+- http_request_db_queries - количество запросов к базе за запрос;
+- http_request_db_duration_seconds - время запросов к базе за запрос;
+- http_response_size_bytes - размер ответа (для потоковых ответов - только
+  при заголовке Content-Length).
+Попадания и промахи кэшей приложения (record_cache) считаются в
+cache_requests_total (cache, result).
+
+Запросы к базе считает обертка execute_wrapper, которая добавляется к
+каждому соединению при создании и пишет в счетчики текущего запроса
+(ContextVar, поэтому учитываются и запросы из sync_to_async, в том числе
+параллельные разделы отчетов - их время суммируется). Время запроса к
+базе - время execute; строки, которые драйвер получает позже при чтении
+курсора (SQLite), в него не входят.
+
+Значения накапливаются в процессе без блокировок: у каждого потока своя
+часть счетчиков, которые складываются только при выдаче /metrics. Когда
+объект завершившегося потока удаляется, его часть переносится в общие
+значения процесса, поэтому число частей не растет вместе с числом потоков.
+При нескольких процессах (gunicorn, uvicorn --workers) нужно задать
+METRICS_MULTIPROCESS_DIR: каждый процесс не чаще раза в
+METRICS_FLUSH_SECONDS записывает свои значения в файл metrics_<pid>.json,
+а /metrics складывает файлы всех процессов. Файлы завершившихся процессов
+остаются (счетчики не уменьшаются), каталог очищается перед запуском сервера.
+
+Доступ к /metrics - по токену METRICS_TOKEN (Authorization: Bearer).
+Без токена метрики доступны только при DEBUG и только с адресов
+METRICS_ALLOWED_IPS: за обратным прокси все запросы приходят с его адреса
+(обычно 127.0.0.1), и проверка адреса ничего бы не ограничивала.
+"""
+import glob
+import hmac
+import json
+import os
+import threading
+import time
+import weakref
+from bisect import bisect_left
+from contextvars import ContextVar
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.db import connections
+from django.db.backends.signals import connection_created
+from django.http import HttpResponse, JsonResponse
+from django.views.decorators.http import require_safe
+from rest_framework import status
+
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+QUERY_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100)
+SIZE_BUCKETS = (256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304)
+
+# Имя -> (тип, описание, метки, границы гистограммы)
+METRICS = {
+    'http_request_duration_seconds': (
+        'histogram', 'Время обработки запроса', ('route', 'method', 'status'), LATENCY_BUCKETS,
+    ),
+    'http_request_db_queries': (
+        'histogram', 'Количество запросов к базе за запрос', ('route',), QUERY_BUCKETS,
+    ),
+    'http_request_db_duration_seconds': (
+        'histogram', 'Время запросов к базе за запрос', ('route',), LATENCY_BUCKETS,
+    ),
+    'http_response_size_bytes': (
+        'histogram', 'Размер ответа', ('route',), SIZE_BUCKETS,
+    ),
+    'cache_requests_total': (
+        'counter', 'Обращения к кэшам приложения', ('cache', 'result'), None,
+    ),
+}
+
+# Маршрут запросов, не сопоставленных ни одному URL (ограничивает число меток)
+UNMATCHED_ROUTE = 'unmatched'
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+
+class MetricsRegistry:
+    """
+    Накопление метрик процесса: у каждого потока своя часть значений
+
+    Поток меняет только свой словарь, поэтому запись не берет блокировок;
+    блокировка нужна только при появлении и удалении потока. Часть
+    удаленного потока прибавляется к общим значениям _retired. Значение
+    гистограммы - список [количество в каждой границе..., в +Inf, сумма].
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        # ключ части -> значения потока
+        self._shards = {}
+        self._retired = {}
+        self._pid = os.getpid()
+        self._flushed_at = 0.0
+
+    def _shard(self):
+        shard = getattr(self._local, 'values', None)
+        if shard is None or self._pid != os.getpid():
+            with self._lock:
+                if self._pid != os.getpid():
+                    # Процесс создан fork - значения родителя не учитываются
+                    self._pid = os.getpid()
+                    self._shards = {}
+                    self._retired = {}
+                    self._local = threading.local()
+                shard = {}
+                key = object()
+                self._shards[key] = shard
+            self._local.values = shard
+            # Объект потока удаляется только после его завершения, поэтому
+            # перенос части не пересекается с записью в нее
+            weakref.finalize(threading.current_thread(), self._retire, key)
+        return shard
+
+    def _retire(self, key):
+        with self._lock:
+            shard = self._shards.pop(key, None)
+            if shard is not None:
+                for item, value in shard.items():
+                    _merge_value(self._retired, item, value)
+
+    def observe(self, name, labels, value):
+        buckets = METRICS[name][3]
+        shard = self._shard()
+        key = (name, labels)
+        counts = shard.get(key)
+        if counts is None:
+            counts = shard[key] = [0] * (len(buckets) + 2)
+        counts[bisect_left(buckets, value)] += 1
+        counts[-1] += value
+
+    def inc(self, name, labels, value=1):
+        shard = self._shard()
+        key = (name, labels)
+        shard[key] = shard.get(key, 0) + value
+
+    def snapshot(self):
+        """
+        Сумма значений всех потоков: {(имя, метки): значение}
+        """
+        result = {}
+        with self._lock:
+            shards = list(self._shards.values())
+            for key, value in self._retired.items():
+                _merge_value(result, key, value)
+        for shard in shards:
+            for key, value in list(shard.items()):
+                _merge_value(result, key, value)
+        return result
+
+    def flush(self, force=False):
+        """
+        Записывает значения процесса в METRICS_MULTIPROCESS_DIR (не чаще
+        раза в METRICS_FLUSH_SECONDS)
+        """
+        directory = settings.METRICS_MULTIPROCESS_DIR
+        now = time.monotonic()
+        if not directory or (not force and now - self._flushed_at < settings.METRICS_FLUSH_SECONDS):
+            return
+        self._flushed_at = now
+        data = [[name, list(labels), value] for (name, labels), value in self.snapshot().items()]
+        path = os.path.join(directory, f'metrics_{os.getpid()}.json')
+        temp_path = f'{path}.{threading.get_ident()}.tmp'
+        with open(temp_path, 'w', encoding='utf-8') as metrics_file:
+            json.dump(data, metrics_file)
+        os.replace(temp_path, path)
+
+    def collect(self):
+        """
+        Значения для выдачи: процесса или всех процессов каталога
+        """
+        directory = settings.METRICS_MULTIPROCESS_DIR
+        if not directory:
+            return self.snapshot()
+        own_path = os.path.join(directory, f'metrics_{os.getpid()}.json')
+        result = self.snapshot()
+        for path in glob.glob(os.path.join(directory, 'metrics_*.json')):
+            if path == own_path:
+                continue
+            try:
+                with open(path, encoding='utf-8') as metrics_file:
+                    data = json.load(metrics_file)
+            except (OSError, ValueError):
+                continue
+            for name, labels, value in data:
+                if name in METRICS:
+                    _merge_value(result, (name, tuple(labels)), value)
+        return result
+
+
+def _merge_value(result, key, value):
+    current = result.get(key)
+    if current is None:
+        result[key] = list(value) if isinstance(value, list) else value
+    elif isinstance(value, list):
+        result[key] = [a + b for a, b in zip(current, value)]
+    else:
+        result[key] = current + value
+
+
+registry = MetricsRegistry()
+
+
+def record_cache(cache_name, hit):
+    """
+    Учитывает обращение к кэшу приложения (попадание или промах)
+    """
+    if settings.METRICS_ENABLED:
+        registry.inc('cache_requests_total', (cache_name, 'hit' if hit else 'miss'))
+
+
+class RequestStats:
+    """
+    Запросы к базе текущего HTTP-запроса
+    """
+    __slots__ = ('queries', 'db_time')
+
+    def __init__(self):
+        self.queries = 0
+        self.db_time = 0.0
+
+
+_request_stats = ContextVar('metrics_request_stats', default=None)
+
+
+def count_queries(execute, sql, params, many, context):
+    """
+    execute_wrapper соединения: время и количество запросов текущего запроса
+    """
+    stats = _request_stats.get()
+    if stats is None:
+        return execute(sql, params, many, context)
+    started = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        stats.queries += 1
+        stats.db_time += time.perf_counter() - started
+
+
+def install_query_counter(connection, **kwargs):
+    if count_queries not in connection.execute_wrappers:
+        connection.execute_wrappers.append(count_queries)
+
+
+connection_created.connect(install_query_counter, dispatch_uid='metrics_query_counter')
+
+
+def _route(request):
+    match = getattr(request, 'resolver_match', None)
+    if match is None:
+        return UNMATCHED_ROUTE
+    return match.view_name or match._func_path
+
+
+def _response_size(response):
+    if response.has_header('Content-Length'):
+        try:
+            return int(response['Content-Length'])
+        except ValueError:
+            return None
+    if getattr(response, 'streaming', False):
+        return None
+    return len(response.content)
+
+
+class MetricsMiddleware:
+    """
+    Middleware, записывающее метрики каждого запроса
+
+    Стоит первым в MIDDLEWARE, чтобы время включало остальные middleware.
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.async_mode = iscoroutinefunction(get_response)
+        if self.async_mode:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.async_mode:
+            return self.__acall__(request)
+        if not settings.METRICS_ENABLED:
+            return self.get_response(request)
+
+        stats, token, started = self._start()
+        try:
+            response = self.get_response(request)
+        finally:
+            _request_stats.reset(token)
+        self._finish(request, response, stats, started)
+        return response
+
+    async def __acall__(self, request):
+        if not settings.METRICS_ENABLED:
+            return await self.get_response(request)
+
+        stats, token, started = self._start()
+        try:
+            response = await self.get_response(request)
+        finally:
+            _request_stats.reset(token)
+        self._finish(request, response, stats, started)
+        return response
+
+    def _start(self):
+        # Соединения, открытые до подключения обработчика сигнала
+        for connection in connections.all(initialized_only=True):
+            install_query_counter(connection)
+        stats = RequestStats()
+        return stats, _request_stats.set(stats), time.perf_counter()
+
+    def _finish(self, request, response, stats, started):
+        elapsed = time.perf_counter() - started
+        route = _route(request)
+        registry.observe(
+            'http_request_duration_seconds', (route, request.method, str(response.status_code)), elapsed,
+        )
+        registry.observe('http_request_db_queries', (route,), stats.queries)
+        registry.observe('http_request_db_duration_seconds', (route,), stats.db_time)
+        size = _response_size(response)
+        if size is not None:
+            registry.observe('http_response_size_bytes', (route,), size)
+        registry.flush()
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _format_labels(names, values, extra=None):
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+def _format_number(value):
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return repr(value) if isinstance(value, float) else str(value)
+
+
+def render_metrics(values):
+    """
+    Текстовый формат Prometheus для значений registry.collect()
+    """
+    lines = []
+    for name, (kind, description, label_names, buckets) in METRICS.items():
+        series = sorted((labels, value) for (metric, labels), value in values.items() if metric == name)
+        lines.append(f'# HELP {name} {description}')
+        lines.append(f'# TYPE {name} {kind}')
+        for labels, value in series:
+            if kind == 'counter':
+                lines.append(f'{name}{_format_labels(label_names, labels)} {_format_number(value)}')
+                continue
+            cumulative = 0
+            for bound, count in zip(list(buckets) + ['+Inf'], value[:-1]):
+                cumulative += count
+                le = f'le="{_format_number(bound) if bound != "+Inf" else bound}"'
+                lines.append(f'{name}_bucket{_format_labels(label_names, labels, le)} {cumulative}')
+            lines.append(f'{name}_sum{_format_labels(label_names, labels)} {_format_number(value[-1])}')
+            lines.append(f'{name}_count{_format_labels(label_names, labels)} {cumulative}')
+    return '\n'.join(lines) + '\n'
+
+
+def _is_allowed(request):
+    token = settings.METRICS_TOKEN
+    if token:
+        scheme, _, value = request.headers.get('Authorization', '').partition(' ')
+        return scheme.lower() == 'bearer' and hmac.compare_digest(value.strip(), token)
+    # Без токена - только при разработке: за прокси REMOTE_ADDR всегда его адрес
+    return settings.DEBUG and request.META.get('REMOTE_ADDR') in settings.METRICS_ALLOWED_IPS
+
+
+@require_safe
+def metrics_view(request):
+    """
+    Метрики процесса (или всех процессов) в формате Prometheus
+    """
+    if not settings.METRICS_ENABLED:
+        return JsonResponse({
+            "error": "Метрики отключены"
+        }, status=status.HTTP_404_NOT_FOUND)
+    if not _is_allowed(request):
+        return JsonResponse({
+            "error": "Доступ к метрикам запрещен"
+        }, status=status.HTTP_403_FORBIDDEN)
+    registry.flush(force=True)
+    return HttpResponse(render_metrics(registry.collect()), content_type=CONTENT_TYPE)
@@ -0,0 +1,460 @@
+"""
+Профилирование отдельных запросов по требованию сотрудника (is_staff)
+
+Запрос профилируется, если в нем есть заголовок X-Profile или параметр
+?profile= со значением:
+- cprofile (или 1) - детерминированный профиль cProfile, в отчет попадают
+  PROFILING_TOP_FUNCTIONS функций с наибольшим суммарным временем;
+- sample - выборочный профиль: фоновый поток раз в
+  PROFILING_SAMPLE_INTERVAL_MS снимает стек потока запроса, в отчет
+  попадают самые частые стеки в свернутом формате (flamegraph.pl).
+
+Пользователь проверяется до выполнения запроса: сессия или любой класс
+DEFAULT_AUTHENTICATION_CLASSES DRF (токен JWT). Для остальных
+пользователей переключатель молча игнорируется.
+
+В отчет записываются все SQL-запросы (база, текст, параметры, время) и
+план EXPLAIN для первых PROFILING_EXPLAIN_LIMIT различных SELECT. При
+PROFILING_REDACT_PARAMS вместо параметров записываются только их типы
+(EXPLAIN все равно снимается с настоящими параметрами). Отчет
+сохраняется JSON-файлом в PROFILING_DIR (хранятся последние
+PROFILING_MAX_REPORTS), его id возвращается в заголовке X-Profile-Id.
+Просмотр: GET /api/profiles/ и GET /api/profiles/<id>/ (только is_staff).
+
+При PROFILING_ENABLED=False middleware не подключается. При включенном
+профилировании запрос без переключателя стоит одну проверку заголовка:
+обертка execute_wrapper подключается к соединениям потока запроса только
+на время профилируемого запроса, остальные запросы к базе не оборачиваются.
+Под ASGI синхронное представление выполняется не в потоке цикла событий,
+а в потоке sync_to_async запроса, поэтому профилировщик запускается и
+останавливается в этом потоке. Асинхронные представления выполняются в
+цикле событий вместе с другими запросами, и профиль потока был бы
+недостоверен - для них переключатель отклоняется ответом 400.
+"""
+import cProfile
+import io
+import json
+import os
+import pstats
+import re
+import sys
+import threading
+import time
+import uuid
+from collections import Counter
+from contextlib import ExitStack
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction, sync_to_async
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import DatabaseError, connections, transaction
+from django.http import JsonResponse
+from django.urls import Resolver404, resolve
+from django.utils import timezone
+from rest_framework import status
+from rest_framework.decorators import api_view, permission_classes
+from rest_framework.exceptions import APIException
+from rest_framework.permissions import IsAdminUser
+from rest_framework.request import Request
+from rest_framework.response import Response
+from rest_framework.settings import api_settings
+
+
+PROFILE_HEADER = 'HTTP_X_PROFILE'
+PROFILE_PARAM = 'profile'
+PROFILERS = {'1': 'cprofile', 'cprofile': 'cprofile', 'sample': 'sample'}
+
+# Id отчета - имя файла, поэтому допускаются только символы из new_report_id
+REPORT_ID_RE = re.compile(r'^[0-9]{8}T[0-9]{6}-[0-9a-f]{8}$')
+
+
+def explain_sql(alias, sql, params):
+    """
+    План выполнения SELECT-запроса: список строк или None, если план недоступен
+    """
+    connection = connections[alias]
+    if connection.vendor == 'sqlite':
+        prefix = 'EXPLAIN QUERY PLAN '
+    elif connection.vendor == 'postgresql':
+        prefix = 'EXPLAIN '
+    else:
+        return None
+    try:
+        # Внутри транзакции EXPLAIN выполняется в точке сохранения: ошибка
+        # не прерывает транзакцию вызывающего кода
+        with transaction.atomic(using=alias), connection.cursor() as cursor:
+            cursor.execute(prefix + sql, params)
+            rows = cursor.fetchall()
+    except DatabaseError as e:
+        return [f'EXPLAIN не выполнен: {e}']
+    # SQLite: (id, parent, notused, detail), PostgreSQL: (строка плана,)
+    return [row[-1] for row in rows]
+
+
+def redact_params(params):
+    """
+    Типы параметров запроса вместо значений
+    """
+    if params is None:
+        return None
+    if isinstance(params, dict):
+        return {name: f'<{type(value).__name__}>' for name, value in params.items()}
+    return [f'<{type(value).__name__}>' for value in params]
+
+
+def is_select(sql):
+    return sql.lstrip().split(None, 1)[0].upper() in ('SELECT', 'WITH') if sql.strip() else False
+
+
+class ProfileSession:
+    """
+    Данные профилируемого запроса: SQL-запросы и их время
+    """
+
+    def __init__(self):
+        self.queries = []
+        self.lock = threading.Lock()
+
+    def add_query(self, alias, sql, params, many, duration):
+        query = {
+            'alias': alias,
+            'sql': sql,
+            'params': None if params is None or many else (params if isinstance(params, dict) else list(params)),
+            'many': many,
+            'duration_ms': round(duration * 1000, 3),
+        }
+        with self.lock:
+            self.queries.append(query)
+
+    def capture(self, execute, sql, params, many, context):
+        """
+        execute_wrapper соединения: записывает запрос и его время
+        """
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.add_query(context['connection'].alias, sql, params, many, time.perf_counter() - started)
+
+
+def capture_queries(session):
+    """
+    Подключает запись запросов session ко всем соединениям текущего потока
+
+    Возвращает ExitStack, закрытие которого (в том же потоке) отключает запись.
+    """
+    stack = ExitStack()
+    for alias in connections:
+        stack.enter_context(connections[alias].execute_wrapper(session.capture))
+    return stack
+
+
+class SamplingProfiler:
+    """
+    Выборочный профиль потока: стеки снимаются фоновым потоком по таймеру
+    """
+
+    def __init__(self, thread_id, interval):
+        self.thread_id = thread_id
+        self.interval = interval
+        self.stacks = Counter()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name='profiling-sampler', daemon=True)
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append(f'{code.co_name} ({os.path.basename(code.co_filename)}:{frame.f_lineno})')
+                frame = frame.f_back
+            if stack:
+                self.stacks[';'.join(reversed(stack))] += 1
+
+    def report(self, limit):
+        return {
+            'interval_ms': round(self.interval * 1000, 3),
+            'samples': sum(self.stacks.values()),
+            'stacks': [f'{stack} {count}' for stack, count in self.stacks.most_common(limit)],
+        }
+
+
+class Profiler:
+    """
+    Запуск выбранного профилировщика на время обработки запроса
+    """
+
+    def __init__(self, kind):
+        self.kind = kind
+        self._profile = None
+        self._sampler = None
+        self._started = None
+        self.duration = None
+
+    def start(self):
+        if self.kind == 'sample':
+            self._sampler = SamplingProfiler(
+                threading.get_ident(), settings.PROFILING_SAMPLE_INTERVAL_MS / 1000,
+            )
+            self._sampler.start()
+        else:
+            self._profile = cProfile.Profile()
+            self._profile.enable()
+        self._started = time.perf_counter()
+
+    def stop(self):
+        self.duration = time.perf_counter() - self._started
+        if self._sampler is not None:
+            self._sampler.stop()
+        else:
+            self._profile.disable()
+
+    def report(self):
+        if self._sampler is not None:
+            return self._sampler.report(settings.PROFILING_TOP_FUNCTIONS)
+        output = io.StringIO()
+        stats = pstats.Stats(self._profile, stream=output)
+        stats.sort_stats('cumulative').print_stats(settings.PROFILING_TOP_FUNCTIONS)
+        return {'total_calls': stats.total_calls, 'text': output.getvalue()}
+
+
+def get_profiler_kind(request):
+    """
+    Профилировщик, запрошенный переключателем, или None
+    """
+    value = request.META.get(PROFILE_HEADER)
+    if value is None:
+        value = request.GET.get(PROFILE_PARAM)
+        if value is None:
+            return None
+    return PROFILERS.get(value.strip().lower())
+
+
+def get_staff_user(request):
+    """
+    Сотрудник, выполняющий запрос (по сессии или аутентификации DRF), или None
+    """
+    user = getattr(request, 'user', None)
+    if user is not None and user.is_authenticated and user.is_staff:
+        return user
+    drf_request = Request(request)
+    for authentication_class in api_settings.DEFAULT_AUTHENTICATION_CLASSES:
+        try:
+            result = authentication_class().authenticate(drf_request)
+        except APIException:
+            return None
+        if result is not None:
+            user = result[0]
+            return user if user.is_staff else None
+    return None
+
+
+def is_async_view(request):
+    """
+    Проверяет, обслуживается ли запрос асинхронным представлением
+    """
+    try:
+        match = resolve(request.path_info, getattr(request, 'urlconf', None))
+    except Resolver404:
+        return False
+    return iscoroutinefunction(match.func)
+
+
+def new_report_id():
+    return f"{timezone.now():%Y%m%dT%H%M%S}-{uuid.uuid4().hex[:8]}"
+
+
+def get_report_path(report_id):
+    return os.path.join(settings.PROFILING_DIR, f'{report_id}.json')
+
+
+def build_report(request, response, user, profiler, session):
+    """
+    Отчет профилирования: профиль, SQL-запросы и планы EXPLAIN
+    """
+    explained = {}
+    for query in session.queries:
+        key = (query['alias'], query['sql'])
+        if query['many'] or not is_select(query['sql']):
+            continue
+        if key not in explained and len(explained) < settings.PROFILING_EXPLAIN_LIMIT:
+            explained[key] = explain_sql(query['alias'], query['sql'], query['params'])
+        query['explain'] = explained.get(key)
+    if settings.PROFILING_REDACT_PARAMS:
+        for query in session.queries:
+            query['params'] = redact_params(query['params'])
+
+    match = getattr(request, 'resolver_match', None)
+    return {
+        'id': new_report_id(),
+        'created_at': timezone.now().isoformat(),
+        'method': request.method,
+        'path': request.path,
+        'query_string': request.META.get('QUERY_STRING', ''),
+        'route': match.view_name if match is not None else None,
+        'user': user.get_username(),
+        'status': response.status_code,
+        'duration_ms': round(profiler.duration * 1000, 3),
+        'profiler': profiler.kind,
+        'profile': profiler.report(),
+        'query_count': len(session.queries),
+        'db_time_ms': round(sum(query['duration_ms'] for query in session.queries), 3),
+        'queries': session.queries,
+    }
+
+
+def save_report(report):
+    """
+    Сохраняет отчет и удаляет самые старые сверх PROFILING_MAX_REPORTS
+    """
+    os.makedirs(settings.PROFILING_DIR, exist_ok=True)
+    path = get_report_path(report['id'])
+    with open(f'{path}.tmp', 'w', encoding='utf-8') as report_file:
+        # Параметры запросов (даты, Decimal, bytes) записываются строками
+        json.dump(report, report_file, ensure_ascii=False, default=str)
+    os.replace(f'{path}.tmp', path)
+
+    reports = sorted(name for name in os.listdir(settings.PROFILING_DIR) if name.endswith('.json'))
+    for name in reports[:-settings.PROFILING_MAX_REPORTS]:
+        try:
+            os.remove(os.path.join(settings.PROFILING_DIR, name))
+        except FileNotFoundError:
+            pass
+
+
+class ProfilingMiddleware:
+    """
+    Middleware, профилирующее запросы сотрудников с переключателем X-Profile
+
+    Стоит после AuthenticationMiddleware, чтобы пользователь сессии был известен.
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        if not settings.PROFILING_ENABLED:
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+        self.async_mode = iscoroutinefunction(get_response)
+        if self.async_mode:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.async_mode:
+            return self.__acall__(request)
+        kind = get_profiler_kind(request)
+        if kind is None:
+            return self.get_response(request)
+        user = get_staff_user(request)
+        if user is None:
+            return self.get_response(request)
+
+        profiler = self._start(kind)
+        if profiler is None:
+            return self.get_response(request)
+        session = ProfileSession()
+        with capture_queries(session):
+            try:
+                response = self.get_response(request)
+            finally:
+                profiler.stop()
+        return self._finish(request, response, user, profiler, session)
+
+    async def __acall__(self, request):
+        kind = get_profiler_kind(request)
+        if kind is None:
+            return await self.get_response(request)
+        user = await sync_to_async(get_staff_user)(request)
+        if user is None:
+            return await self.get_response(request)
+
+        if is_async_view(request):
+            return JsonResponse({
+                "error": "Профилирование асинхронных представлений не поддерживается"
+            }, status=status.HTTP_400_BAD_REQUEST)
+
+        # Синхронное представление выполнится в потоке sync_to_async этого
+        # запроса (thread_sensitive) - профилировщик работает в том же потоке
+        profiler = await sync_to_async(self._start)(kind)
+        if profiler is None:
+            return await self.get_response(request)
+        session = ProfileSession()
+        # Соединения принадлежат потоку, поэтому обертка подключается
+        # и отключается в потоке представления
+        capture = await sync_to_async(capture_queries)(session)
+        try:
+            response = await self.get_response(request)
+        finally:
+            await sync_to_async(profiler.stop)()
+            await sync_to_async(capture.close)()
+        return await sync_to_async(self._finish)(request, response, user, profiler, session)
+
+    def _start(self, kind):
+        profiler = Profiler(kind)
+        try:
+            profiler.start()
+        except ValueError:
+            # В потоке уже работает другой профилировщик - запрос
+            # выполняется без профилирования
+            return None
+        return profiler
+
+    def _finish(self, request, response, user, profiler, session):
+        report = build_report(request, response, user, profiler, session)
+        save_report(report)
+        response['X-Profile-Id'] = report['id']
+        return response
+
+
+def _read_report(report_id):
+    with open(get_report_path(report_id), encoding='utf-8') as report_file:
+        return json.load(report_file)
+
+
+@api_view(['GET'])
+@permission_classes([IsAdminUser])
+def profile_list(request):
+    """
+    Список сохраненных отчетов профилирования (новые первыми)
+    """
+    try:
+        names = sorted(os.listdir(settings.PROFILING_DIR), reverse=True)
+    except FileNotFoundError:
+        names = []
+    reports = []
+    for name in names:
+        if not name.endswith('.json'):
+            continue
+        try:
+            report = _read_report(name[:-len('.json')])
+        except (OSError, ValueError):
+            continue
+        reports.append({
+            key: report.get(key)
+            for key in ('id', 'created_at', 'method', 'path', 'query_string', 'route',
+                        'user', 'status', 'duration_ms', 'profiler', 'query_count', 'db_time_ms')
+        })
+    return Response({'results': reports})
+
+
+@api_view(['GET'])
+@permission_classes([IsAdminUser])
+def profile_detail(request, report_id):
+    """
+    Полный отчет профилирования
+    """
+    if not REPORT_ID_RE.match(report_id):
+        return Response({"error": "Некорректный id отчета"}, status=status.HTTP_400_BAD_REQUEST)
+    try:
+        return Response(_read_report(report_id))
+    except FileNotFoundError:
+        return Response({"error": "Отчет не найден"}, status=status.HTTP_404_NOT_FOUND)
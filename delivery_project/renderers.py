@@ -0,0 +1,149 @@
+"""
+Быстрый JSON-рендерер для API
+
+FastJSONRenderer выдает те же байты, что и JSONRenderer DRF (компактные
+разделители, UTF-8 без экранирования, \\u2028/\\u2029 экранируются), но
+кодирует данные через orjson, если он установлен. Даты и время передаются
+в тот же обработчик, что и в DRF (isoformat, "+00:00" заменяется на "Z"),
+Decimal - в float, как в JSONEncoder DRF.
+
+Если orjson не установлен, запрошен отступ (indent) или включен
+ensure_ascii, используется стандартный путь DRF. Число float или Decimal,
+которое orjson записал бы в другой форме, чем json (экспонента, NaN и
+бесконечность - их DRF при strict не пропускает), или целое вне 64 бит
+также переводят рендеринг на стандартный путь.
+
+Метод stream() выдает JSON-массив частями, не собирая весь ответ в памяти.
+"""
+import datetime
+import decimal
+
+from rest_framework.renderers import JSONRenderer
+from rest_framework.utils import encoders
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+STREAM_CHUNK_SIZE = 1000
+
+
+class _Fallback(Exception):
+    """
+    Значение, которое нельзя закодировать побайтно совместимо с DRF
+    """
+
+
+def _encode_datetime(value):
+    representation = value.isoformat()
+    if representation.endswith('+00:00'):
+        representation = representation[:-6] + 'Z'
+    return representation
+
+
+def _is_compatible_float(number):
+    # Вне этого диапазона repr(float) использует экспоненту "1e+16" и
+    # "1e-05", а orjson - "1e16" и "0.00001"; NaN и бесконечность тоже вне его
+    return number == 0 or 1e-4 <= abs(number) < 1e16
+
+
+def _encode_decimal(value):
+    number = float(value)
+    if _is_compatible_float(number):
+        return number
+    raise _Fallback
+
+
+def _check_floats(data):
+    """
+    Проверяет числа float, которые orjson кодирует сам, без default
+    """
+    stack = [data]
+    while stack:
+        value = stack.pop()
+        if isinstance(value, dict):
+            stack.extend(value.values())
+        elif isinstance(value, (list, tuple)):
+            stack.extend(value)
+        elif type(value) is float and not _is_compatible_float(value):
+            raise _Fallback
+
+
+_TYPE_ENCODERS = {
+    datetime.datetime: _encode_datetime,
+    datetime.date: datetime.date.isoformat,
+    decimal.Decimal: _encode_decimal,
+}
+_drf_encoder = encoders.JSONEncoder()
+
+
+def _default(value):
+    encoder = _TYPE_ENCODERS.get(type(value))
+    if encoder is not None:
+        return encoder(value)
+    return _drf_encoder.default(value)
+
+
+def _escape_separators(content):
+    if b'\xe2\x80' in content:
+        content = content.replace('\u2028'.encode(), b'\\u2028').replace('\u2029'.encode(), b'\\u2029')
+    return content
+
+
+class FastJSONRenderer(JSONRenderer):
+    """
+    JSON-рендерер с кодированием через orjson и потоковой выдачей списков
+    """
+    options = (orjson.OPT_PASSTHROUGH_DATETIME | orjson.OPT_NON_STR_KEYS) if orjson else 0
+
+    def can_use_fast_path(self, accepted_media_type, renderer_context):
+        return (
+            orjson is not None
+            and self.compact
+            and not self.ensure_ascii
+            and self.get_indent(accepted_media_type, renderer_context or {}) is None
+        )
+
+    def encode(self, data):
+        """
+        Кодирует данные через orjson; None, если нужен стандартный путь
+        """
+        try:
+            _check_floats(data)
+            return _escape_separators(orjson.dumps(data, default=_default, option=self.options))
+        except (_Fallback, orjson.JSONEncodeError):
+            return None
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return b''
+        if self.can_use_fast_path(accepted_media_type, renderer_context):
+            content = self.encode(data)
+            if content is not None:
+                return content
+        return super().render(data, accepted_media_type, renderer_context)
+
+    def stream(self, items, chunk_size=STREAM_CHUNK_SIZE, view=None):
+        """
+        Выдает JSON-массив элементов частями по chunk_size элементов
+
+        Результат совпадает с render(list(items)).
+        """
+        yield b'['
+        chunk = []
+        first = True
+        for item in items:
+            chunk.append(item)
+            if len(chunk) >= chunk_size:
+                yield (b'' if first else b',') + self._render_items(chunk)
+                first = False
+                chunk = []
+        if chunk:
+            yield (b'' if first else b',') + self._render_items(chunk)
+        yield b']'
+
+    def _render_items(self, items):
+        # Элементы пачки без окружающих скобок массива
+        return FastJSONRenderer.render(self, items)[1:-1]
@@ -1,8 +1,10 @@
 import os
 from pathlib import Path
-from decouple import config
+from decouple import config, Csv
 from datetime import timedelta
 
+from .db_profiles import build_database, get_db_profile
+
 BASE_DIR = Path(__file__).resolve().parent.parent
 
 SECRET_KEY = config('DJANGO_SECRET_KEY')
@@ -39,12 +41,16 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'delivery_project.metrics.MetricsMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'corsheaders.middleware.CorsMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
+    'delivery_project.profiling.ProfilingMiddleware',
+    'delivery_project.slow_queries.SlowQueryMiddleware',
+    'delivery_project.db_routing.ReplicaRoutingMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
 ]
@@ -69,25 +75,50 @@ TEMPLATES = [
 
 WSGI_APPLICATION = 'delivery_project.wsgi.application'
 
-# Настройки для PostgreSQL
-"""
+# Профиль подключения к базе данных выбирается переменной DB_PROFILE:
+# sqlite (по умолчанию), sqlite_tuned, postgres, postgres_pooled.
+# Параметры PostgreSQL задаются переменными DB_NAME, DB_USER, DB_PASSWORD,
+# DB_HOST, DB_PORT (см. delivery_project.db_profiles)
+DB_PROFILE = get_db_profile()
+
 DATABASES = {
-    'default': {
-        'ENGINE': 'django.db.backends.postgresql',
-        'NAME': 'delivery_db', 
-        'USER': 'postgres',
-        'PASSWORD': 'postgres',
-        'HOST': 'localhost',
-        'PORT': '5432',
-    }
+    'default': build_database(DB_PROFILE, BASE_DIR),
 }
-"""
 
-# Для упрощения запуска используем SQLite
-DATABASES = {
+# Реплика для чтения (см. delivery_project.db_routing). Для локальной проверки
+# достаточно второго файла SQLite: DB_REPLICA_NAME=replica.sqlite3
+DB_REPLICA_ALIAS = 'replica'
+DB_REPLICA_NAME = config('DB_REPLICA_NAME', default='')
+if DB_REPLICA_NAME:
+    DATABASES[DB_REPLICA_ALIAS] = build_database(
+        DB_PROFILE, BASE_DIR,
+        name=DB_REPLICA_NAME,
+        host=config('DB_REPLICA_HOST', default=None),
+    )
+    DATABASES[DB_REPLICA_ALIAS]['TEST'] = {'MIRROR': 'default'}
+
+# Отдельная база для архива доставок (см. archive_deliveries). Если не задана,
+# архивные таблицы хранятся в основной базе
+DB_ARCHIVE_ALIAS = 'archive'
+DB_ARCHIVE_NAME = config('DB_ARCHIVE_NAME', default='')
+if DB_ARCHIVE_NAME:
+    DATABASES[DB_ARCHIVE_ALIAS] = build_database(
+        DB_PROFILE, BASE_DIR,
+        name=DB_ARCHIVE_NAME,
+        host=config('DB_ARCHIVE_HOST', default=None),
+    )
+
+DATABASE_ROUTERS = ['delivery_project.db_routing.PrimaryReplicaRouter']
+
+# Время, в течение которого после записи пользователь читает из основной базы
+DB_PRIMARY_STICKY_SECONDS = config('DB_PRIMARY_STICKY_SECONDS', default=10, cast=int)
+DB_PRIMARY_STICKY_COOKIE = 'db_primary_until'
+
+# Общий кэш процессов (например, django.core.cache.backends.redis.RedisCache)
+CACHES = {
     'default': {
-        'ENGINE': 'django.db.backends.sqlite3',
-        'NAME': BASE_DIR / 'db.sqlite3',
+        'BACKEND': config('CACHE_BACKEND', default='django.core.cache.backends.locmem.LocMemCache'),
+        'LOCATION': config('CACHE_LOCATION', default=''),
     }
 }
 
@@ -120,8 +151,144 @@ STATIC_ROOT = os.path.join(BASE_DIR, 'static')
 MEDIA_URL = '/media/'
 MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
 
+# Хранилища файлов. Медиа-файлы доставок по умолчанию хранятся с адресацией
+# по содержимому и дедупликацией (см. delivery_core.storage)
+STORAGES = {
+    'default': {
+        'BACKEND': 'django.core.files.storage.FileSystemStorage',
+    },
+    'staticfiles': {
+        'BACKEND': 'django.contrib.staticfiles.storage.StaticFilesStorage',
+    },
+    'delivery_media': {
+        'BACKEND': config('DELIVERY_MEDIA_STORAGE', default='delivery_core.storage.ContentAddressedStorage'),
+    },
+}
+
+# Возобновляемая загрузка медиа-файлов (см. delivery_core.uploads)
+DELIVERY_UPLOAD_TEMP_DIR = config('DELIVERY_UPLOAD_TEMP_DIR', default=os.path.join(BASE_DIR, 'uploads_tmp'))
+DELIVERY_UPLOAD_MAX_SIZE = config('DELIVERY_UPLOAD_MAX_SIZE', default=500 * 1024 * 1024, cast=int)
+# Незавершенные загрузки без новых частей дольше DELIVERY_UPLOAD_SESSION_TTL_HOURS
+# часов удаляет команда purge_upload_sessions
+DELIVERY_UPLOAD_SESSION_TTL_HOURS = config('DELIVERY_UPLOAD_SESSION_TTL_HOURS', default=24, cast=int)
+
+# Выдача медиа-файлов доставок (см. delivery_core.downloads).
+# DELIVERY_MEDIA_ACCEL: пусто - файл отдает приложение, x-accel - nginx
+# (internal location по DELIVERY_MEDIA_ACCEL_PREFIX), x-sendfile - Apache
+DELIVERY_MEDIA_URL_TTL = config('DELIVERY_MEDIA_URL_TTL', default=3600, cast=int)
+DELIVERY_MEDIA_ACCEL = config('DELIVERY_MEDIA_ACCEL', default='')
+DELIVERY_MEDIA_ACCEL_PREFIX = config('DELIVERY_MEDIA_ACCEL_PREFIX', default='/protected-media/')
+
+# Уменьшенные копии изображений (см. delivery_core.derivatives). При
+# DELIVERY_DERIVATIVES_ASYNC=False копии строятся сразу после сохранения
+DELIVERY_DERIVATIVES_ASYNC = config('DELIVERY_DERIVATIVES_ASYNC', default=True, cast=bool)
+DELIVERY_DERIVATIVE_QUALITY = config('DELIVERY_DERIVATIVE_QUALITY', default=80, cast=int)
+DELIVERY_DERIVATIVE_QUEUE_SIZE = config('DELIVERY_DERIVATIVE_QUEUE_SIZE', default=1000, cast=int)
+
+# Быстрый путь списка доставок без ModelSerializer (см. delivery_core.fast_serializers)
+DELIVERY_FAST_LIST_SERIALIZER = config('DELIVERY_FAST_LIST_SERIALIZER', default=False, cast=bool)
+
+# Синхронизация изменений доставок (см. delivery_core.sync). Изменения
+# моложе DELIVERY_SYNC_LAG_SECONDS выдаются в следующей синхронизации;
+# задержка должна превышать самую долгую транзакцию записи доставок,
+# иначе изменения такой транзакции могут быть пропущены курсором.
+# Отметки об удалении хранятся DELIVERY_TOMBSTONE_RETENTION_DAYS дней
+DELIVERY_SYNC_LAG_SECONDS = config('DELIVERY_SYNC_LAG_SECONDS', default=30, cast=float)
+DELIVERY_SYNC_MAX_LIMIT = config('DELIVERY_SYNC_MAX_LIMIT', default=500, cast=int)
+DELIVERY_TOMBSTONE_RETENTION_DAYS = config('DELIVERY_TOMBSTONE_RETENTION_DAYS', default=30, cast=int)
+
+# Поток событий доставок по SSE и WebSocket (см. delivery_core.events).
+# DELIVERY_EVENTS_BACKEND: local - внутри процесса, database - рассылка
+# между процессами через таблицу событий с опросом раз в POLL_INTERVAL секунд
+DELIVERY_EVENTS_BACKEND = config('DELIVERY_EVENTS_BACKEND', default='local')
+DELIVERY_EVENTS_POLL_INTERVAL = config('DELIVERY_EVENTS_POLL_INTERVAL', default=1.0, cast=float)
+DELIVERY_EVENTS_RETENTION_SECONDS = config('DELIVERY_EVENTS_RETENTION_SECONDS', default=3600, cast=int)
+DELIVERY_EVENTS_QUEUE_SIZE = config('DELIVERY_EVENTS_QUEUE_SIZE', default=1000, cast=int)
+DELIVERY_EVENTS_HEARTBEAT = config('DELIVERY_EVENTS_HEARTBEAT', default=15, cast=float)
+DELIVERY_EVENTS_MAX_CONNECTIONS = config('DELIVERY_EVENTS_MAX_CONNECTIONS', default=10000, cast=int)
+
+# Асинхронные представления чтения (см. delivery_project.async_views): список
+# и карточка доставки, списки справочников и отчеты. Включается для запуска
+# под ASGI; REPORTS_QUERY_WORKERS - потоки для параллельных разделов отчета,
+# каждый раздел занимает соединение с базой только на время своих запросов
+API_ASYNC_VIEWS = config('API_ASYNC_VIEWS', default=False, cast=bool)
+REPORTS_QUERY_WORKERS = config('REPORTS_QUERY_WORKERS', default=8, cast=int)
+
+# Ограничение нагрузки от отчетов (см. reports.throttling): стоимость отчета
+# растет с шириной периода и количеством групп по времени; токены списываются
+# из корзины пользователя и общей корзины, хранящихся в кэше. Отчеты
+# стоимостью от REPORTS_EXPENSIVE_COST выполняются не более чем
+# REPORTS_MAX_CONCURRENT_EXPENSIVE одновременно
+REPORTS_THROTTLE_ENABLED = config('REPORTS_THROTTLE_ENABLED', default=True, cast=bool)
+REPORTS_COST_DAYS_PER_TOKEN = config('REPORTS_COST_DAYS_PER_TOKEN', default=30, cast=float)
+REPORTS_COST_GROUPS_PER_TOKEN = config('REPORTS_COST_GROUPS_PER_TOKEN', default=100, cast=float)
+REPORTS_USER_BUCKET_CAPACITY = config('REPORTS_USER_BUCKET_CAPACITY', default=60, cast=float)
+REPORTS_USER_REFILL_PER_SECOND = config('REPORTS_USER_REFILL_PER_SECOND', default=0.5, cast=float)
+REPORTS_GLOBAL_BUCKET_CAPACITY = config('REPORTS_GLOBAL_BUCKET_CAPACITY', default=600, cast=float)
+REPORTS_GLOBAL_REFILL_PER_SECOND = config('REPORTS_GLOBAL_REFILL_PER_SECOND', default=5, cast=float)
+REPORTS_EXPENSIVE_COST = config('REPORTS_EXPENSIVE_COST', default=10, cast=float)
+REPORTS_MAX_CONCURRENT_EXPENSIVE = config('REPORTS_MAX_CONCURRENT_EXPENSIVE', default=2, cast=int)
+REPORTS_SLOT_TIMEOUT = config('REPORTS_SLOT_TIMEOUT', default=300, cast=int)
+REPORTS_SLOT_RETRY_AFTER = config('REPORTS_SLOT_RETRY_AFTER', default=5, cast=int)
+
+# Админ-панель доставок (см. delivery_core.admin): список без фильтров в
+# PostgreSQL показывает оценку количества строк из статистики, если она больше
+# порога; остальные подсчеты и диапазон лет кэшируются на заданное время
+DELIVERY_ADMIN_ESTIMATE_THRESHOLD = config('DELIVERY_ADMIN_ESTIMATE_THRESHOLD', default=100000, cast=int)
+DELIVERY_ADMIN_COUNT_CACHE_SECONDS = config('DELIVERY_ADMIN_COUNT_CACHE_SECONDS', default=300, cast=int)
+
+# Пакетные запросы (POST /api/batch/): максимальное количество вложенных
+# запросов в одном пакете
+API_BATCH_MAX_REQUESTS = config('API_BATCH_MAX_REQUESTS', default=20, cast=int)
+
+# Метрики запросов в формате Prometheus (GET /metrics, см. delivery_project.metrics).
+# Доступ - по токену METRICS_TOKEN; без токена только при DEBUG с METRICS_ALLOWED_IPS.
+# При нескольких процессах сервера METRICS_MULTIPROCESS_DIR - общий каталог,
+# куда процессы раз в METRICS_FLUSH_SECONDS записывают свои значения
+METRICS_ENABLED = config('METRICS_ENABLED', default=True, cast=bool)
+METRICS_TOKEN = config('METRICS_TOKEN', default='')
+METRICS_ALLOWED_IPS = config('METRICS_ALLOWED_IPS', default='127.0.0.1,::1', cast=Csv())
+METRICS_MULTIPROCESS_DIR = config('METRICS_MULTIPROCESS_DIR', default='')
+METRICS_FLUSH_SECONDS = config('METRICS_FLUSH_SECONDS', default=5, cast=float)
+
+# Профилирование запросов сотрудников по заголовку X-Profile или параметру
+# ?profile= (см. delivery_project.profiling). Отчеты с SQL-запросами и планами
+# EXPLAIN хранятся в PROFILING_DIR, последние PROFILING_MAX_REPORTS.
+# PROFILING_REDACT_PARAMS - писать в отчет только типы параметров SQL
+PROFILING_ENABLED = config('PROFILING_ENABLED', default=True, cast=bool)
+PROFILING_DIR = config('PROFILING_DIR', default=os.path.join(BASE_DIR, 'profiles'))
+PROFILING_MAX_REPORTS = config('PROFILING_MAX_REPORTS', default=100, cast=int)
+PROFILING_TOP_FUNCTIONS = config('PROFILING_TOP_FUNCTIONS', default=60, cast=int)
+PROFILING_SAMPLE_INTERVAL_MS = config('PROFILING_SAMPLE_INTERVAL_MS', default=2, cast=float)
+PROFILING_EXPLAIN_LIMIT = config('PROFILING_EXPLAIN_LIMIT', default=20, cast=int)
+PROFILING_REDACT_PARAMS = config('PROFILING_REDACT_PARAMS', default=True, cast=bool)
+
+# Журнал медленных SQL-запросов (см. delivery_project.slow_queries): запросы
+# дольше порога записываются в файл с ротацией, план EXPLAIN снимается один
+# раз на вид запроса. SLOW_QUERY_REDACT_PARAMS - писать только типы параметров.
+# По умолчанию выключен: обертка добавляется ко всем соединениям процесса
+# и влияет на замеры bench_endpoints
+SLOW_QUERY_LOG_ENABLED = config('SLOW_QUERY_LOG_ENABLED', default=False, cast=bool)
+SLOW_QUERY_THRESHOLD_MS = config('SLOW_QUERY_THRESHOLD_MS', default=100, cast=float)
+SLOW_QUERY_REDACT_PARAMS = config('SLOW_QUERY_REDACT_PARAMS', default=True, cast=bool)
+SLOW_QUERY_LOG_FILE = config('SLOW_QUERY_LOG_FILE', default=os.path.join(BASE_DIR, 'logs', 'slow_queries.log'))
+SLOW_QUERY_LOG_MAX_BYTES = config('SLOW_QUERY_LOG_MAX_BYTES', default=10 * 1024 * 1024, cast=int)
+SLOW_QUERY_LOG_BACKUPS = config('SLOW_QUERY_LOG_BACKUPS', default=5, cast=int)
+
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
+# Нумерация доставок (см. delivery_core.numbering)
+DELIVERY_NUMBER_PREFIX = config('DELIVERY_NUMBER_PREFIX', default='D')
+DELIVERY_NUMBER_WIDTH = config('DELIVERY_NUMBER_WIDTH', default=5, cast=int)
+DELIVERY_NUMBER_BLOCK_SIZE = config('DELIVERY_NUMBER_BLOCK_SIZE', default=50, cast=int)
+
+# Групповая фиксация записей доставок (см. delivery_core.write_queue).
+# Операция, не начатая за DELIVERY_WRITE_TIMEOUT секунд, отменяется (ответ 503)
+DELIVERY_WRITE_COALESCING = config('DELIVERY_WRITE_COALESCING', default=False, cast=bool)
+DELIVERY_WRITE_BATCH_SIZE = config('DELIVERY_WRITE_BATCH_SIZE', default=32, cast=int)
+DELIVERY_WRITE_BATCH_DELAY_MS = config('DELIVERY_WRITE_BATCH_DELAY_MS', default=2, cast=float)
+DELIVERY_WRITE_TIMEOUT = config('DELIVERY_WRITE_TIMEOUT', default=30, cast=float)
+
 REST_FRAMEWORK = {
     'DEFAULT_AUTHENTICATION_CLASSES': [
         'rest_framework_simplejwt.authentication.JWTAuthentication',
@@ -130,6 +297,10 @@ REST_FRAMEWORK = {
     'DEFAULT_PERMISSION_CLASSES': [
         'rest_framework.permissions.IsAuthenticated',
     ],
+    'DEFAULT_RENDERER_CLASSES': [
+        'delivery_project.renderers.FastJSONRenderer',
+        'rest_framework.renderers.BrowsableAPIRenderer',
+    ],
     'DEFAULT_PAGINATION_CLASS': 'rest_framework.pagination.PageNumberPagination',
     'PAGE_SIZE': 20,
 }
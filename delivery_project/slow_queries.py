@@ -0,0 +1,214 @@
+"""
+Журнал медленных SQL-запросов с планами EXPLAIN
+
+При SLOW_QUERY_LOG_ENABLED=True SlowQueryMiddleware при создании
+добавляет обертку execute_wrapper ко всем соединениям процесса, в том
+числе создаваемым позже. Поэтому журналируются и запросы вне HTTP
+(фоновые потоки, management-команды, создающие обработчик запросов -
+например, bench_endpoints через тестовый клиент); команды, которые не
+создают middleware, не журналируются. Записываются только выполненные
+без ошибки запросы дольше SLOW_QUERY_THRESHOLD_MS в файл SLOW_QUERY_LOG_FILE
+(JSON-строки, ротация по SLOW_QUERY_LOG_MAX_BYTES с
+SLOW_QUERY_LOG_BACKUPS старыми файлами). Запись содержит:
+- fingerprint и normalized_sql - текст запроса, в котором литералы и
+  параметры заменены на ?, а списки IN (...) и VALUES свернуты, поэтому
+  запросы отчетов и фильтров с разными параметрами попадают в одну группу;
+- params - параметры, при SLOW_QUERY_REDACT_PARAMS только их типы;
+- view, method, path - представление (resolver_match.view_name) и запрос,
+  во время которого выполнен SQL (вне HTTP-запросов - пусто);
+- alias, duration_ms и explain - план EXPLAIN (EXPLAIN QUERY PLAN в
+  SQLite), который снимается для SELECT один раз на fingerprint в процессе.
+
+Время запроса - время execute: для SQLite строки, читаемые из курсора
+позже, в него не входят. RotatingFileHandler не согласует ротацию между
+процессами - при нескольких процессах сервера нужен отдельный файл на
+процесс или внешняя ротация. Сводка по журналу - команда slow_queries_report.
+"""
+import hashlib
+import json
+import logging
+import os
+import re
+import threading
+import time
+from contextvars import ContextVar
+from logging.handlers import RotatingFileHandler
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import connections
+from django.db.backends.signals import connection_created
+from django.utils import timezone
+
+from .profiling import explain_sql, is_select, redact_params
+
+
+logger = logging.getLogger(__name__)
+
+# Ограничение количества fingerprint, для которых запомнено, что план снят
+EXPLAINED_LIMIT = 10000
+
+_STRING_RE = re.compile(r"'(?:[^']|'')*'")
+_NUMBER_RE = re.compile(r'(?<![\w"$.])-?\d+(?:\.\d+)?\b')
+_PLACEHOLDER_RE = re.compile(r'%s|\?')
+_IN_LIST_RE = re.compile(r'\bIN\s*\(\s*\?(?:\s*,\s*\?)*\s*\)', re.IGNORECASE)
+_VALUES_RE = re.compile(r'\(\s*\?(?:\s*,\s*\?)*\s*\)(?:\s*,\s*\(\s*\?(?:\s*,\s*\?)*\s*\))+')
+_SPACE_RE = re.compile(r'\s+')
+
+_request = ContextVar('slow_queries_request', default=None)
+_explaining = ContextVar('slow_queries_explaining', default=False)
+
+_explained = set()
+_explained_lock = threading.Lock()
+_handler_lock = threading.Lock()
+
+
+def normalize_sql(sql):
+    """
+    Текст запроса без литералов и параметров для группировки
+    """
+    sql = _STRING_RE.sub('?', sql)
+    sql = _NUMBER_RE.sub('?', sql)
+    sql = _PLACEHOLDER_RE.sub('?', sql)
+    sql = _IN_LIST_RE.sub('IN (...)', sql)
+    sql = _VALUES_RE.sub('(...)', sql)
+    return _SPACE_RE.sub(' ', sql).strip()
+
+
+def fingerprint(normalized_sql):
+    return hashlib.sha1(normalized_sql.encode()).hexdigest()[:16]
+
+
+def _get_logger():
+    # Обработчик создается при первой записи, чтобы каталог журнала
+    # не появлялся, пока медленных запросов нет
+    if not logger.handlers:
+        with _handler_lock:
+            if not logger.handlers:
+                directory = os.path.dirname(settings.SLOW_QUERY_LOG_FILE)
+                if directory:
+                    os.makedirs(directory, exist_ok=True)
+                handler = RotatingFileHandler(
+                    settings.SLOW_QUERY_LOG_FILE,
+                    maxBytes=settings.SLOW_QUERY_LOG_MAX_BYTES,
+                    backupCount=settings.SLOW_QUERY_LOG_BACKUPS,
+                    encoding='utf-8',
+                )
+                handler.setFormatter(logging.Formatter('%(message)s'))
+                logger.addHandler(handler)
+                logger.setLevel(logging.INFO)
+                logger.propagate = False
+    return logger
+
+
+def _needs_explain(key):
+    with _explained_lock:
+        if key in _explained:
+            return False
+        if len(_explained) >= EXPLAINED_LIMIT:
+            _explained.clear()
+        _explained.add(key)
+        return True
+
+
+def record_slow_query(alias, sql, params, many, duration):
+    """
+    Записывает медленный запрос в журнал
+    """
+    normalized = normalize_sql(sql)
+    key = fingerprint(normalized)
+    explain = None
+    if not many and is_select(sql) and _needs_explain(key):
+        token = _explaining.set(True)
+        try:
+            explain = explain_sql(alias, sql, params)
+        finally:
+            _explaining.reset(token)
+
+    request = _request.get()
+    match = getattr(request, 'resolver_match', None) if request is not None else None
+    if many:
+        logged_params = None
+    elif settings.SLOW_QUERY_REDACT_PARAMS:
+        logged_params = redact_params(params)
+    else:
+        logged_params = params
+    record = {
+        'ts': timezone.now().isoformat(),
+        'fingerprint': key,
+        'normalized_sql': normalized,
+        'sql': sql,
+        'params': logged_params,
+        'many': many,
+        'alias': alias,
+        'duration_ms': round(duration * 1000, 3),
+        'view': match.view_name if match is not None else None,
+        'method': request.method if request is not None else None,
+        'path': request.path if request is not None else None,
+        'explain': explain,
+    }
+    _get_logger().info(json.dumps(record, ensure_ascii=False, default=str))
+
+
+def log_slow_queries(execute, sql, params, many, context):
+    """
+    execute_wrapper соединения: записывает запросы дольше порога
+    """
+    if _explaining.get():
+        return execute(sql, params, many, context)
+    started = time.perf_counter()
+    # Запрос с ошибкой не записывается: EXPLAIN в прерванной транзакции
+    # бесполезен, а в SQLite с BEGIN IMMEDIATE еще и берет блокировку записи
+    result = execute(sql, params, many, context)
+    duration = time.perf_counter() - started
+    if duration * 1000 >= settings.SLOW_QUERY_THRESHOLD_MS:
+        try:
+            record_slow_query(context['connection'].alias, sql, params, many, duration)
+        except Exception:
+            # Журнал не должен ломать запрос
+            logging.getLogger('django').exception('Не удалось записать медленный запрос')
+    return result
+
+
+def install_slow_query_log(connection, **kwargs):
+    if log_slow_queries not in connection.execute_wrappers:
+        connection.execute_wrappers.append(log_slow_queries)
+
+
+class SlowQueryMiddleware:
+    """
+    Middleware, подключающее журнал и запоминающее запрос для записей журнала
+
+    При SLOW_QUERY_LOG_ENABLED=False (по умолчанию) не подключается.
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        if not settings.SLOW_QUERY_LOG_ENABLED:
+            raise MiddlewareNotUsed
+        connection_created.connect(install_slow_query_log, dispatch_uid='slow_query_log')
+        for connection in connections.all(initialized_only=True):
+            install_slow_query_log(connection)
+        self.get_response = get_response
+        self.async_mode = iscoroutinefunction(get_response)
+        if self.async_mode:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.async_mode:
+            return self.__acall__(request)
+        token = _request.set(request)
+        try:
+            return self.get_response(request)
+        finally:
+            _request.reset(token)
+
+    async def __acall__(self, request):
+        token = _request.set(request)
+        try:
+            return await self.get_response(request)
+        finally:
+            _request.reset(token)
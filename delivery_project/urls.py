@@ -8,6 +8,10 @@ from rest_framework_simplejwt.views import (
     TokenVerifyView,
 )
 
+from .batch import batch
+from .metrics import metrics_view
+from .profiling import profile_detail, profile_list
+
 urlpatterns = [
     path('admin/', admin.site.urls),
     
@@ -21,6 +25,16 @@ urlpatterns = [
     path('api/references/', include('references.urls')),
     path('api/delivery/', include('delivery_core.urls')),
     path('api/reports/', include('reports.urls')),
+    
+    # Пакетные запросы к API
+    path('api/batch/', batch, name='api-batch'),
+    
+    # Метрики в формате Prometheus
+    path('metrics', metrics_view, name='metrics'),
+    
+    # Отчеты профилирования запросов (только сотрудники)
+    path('api/profiles/', profile_list, name='profile-list'),
+    path('api/profiles/<str:report_id>/', profile_detail, name='profile-detail'),
 ]
 
 if settings.DEBUG:
@@ -11,3 +11,14 @@ class ReferencesConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'references'
     verbose_name = 'Справочники'
+    
+    def ready(self):
+        """
+        Подключает сброс кэша названий при изменении справочников
+        """
+        from django.db.models.signals import post_save, post_delete
+        from .cache import REFERENCE_MODELS, invalidate_reference_names
+        
+        for model in REFERENCE_MODELS:
+            post_save.connect(invalidate_reference_names, sender=model)
+            post_delete.connect(invalidate_reference_names, sender=model)
@@ -0,0 +1,44 @@
+"""
+Кэш названий справочников
+
+Отчеты и агрегаты группируют доставки по id справочников, а названия
+подставляют из этого кэша, не выполняя JOIN со справочными таблицами.
+Кэш сбрасывается сигналами при любом изменении записей справочника.
+"""
+from django.core.cache import cache
+
+from delivery_project.metrics import record_cache
+
+from .models import (
+    TransportModel, PackagingType, Service,
+    DeliveryStatus, CargoType
+)
+
+
+REFERENCE_MODELS = (TransportModel, PackagingType, Service, DeliveryStatus, CargoType)
+
+CACHE_TIMEOUT = 60 * 60
+
+
+def _cache_key(model):
+    return f'references:names:{model._meta.label_lower}'
+
+
+def get_reference_names(model):
+    """
+    Возвращает словарь {id: название} для всех записей справочника
+    """
+    key = _cache_key(model)
+    names = cache.get(key)
+    record_cache('reference_names', names is not None)
+    if names is None:
+        names = dict(model.objects.values_list('id', 'name'))
+        cache.set(key, names, CACHE_TIMEOUT)
+    return names
+
+
+def invalidate_reference_names(sender, **kwargs):
+    """
+    Обработчик сигналов: сбрасывает кэш названий измененного справочника
+    """
+    cache.delete(_cache_key(sender))
@@ -9,6 +9,7 @@ from references.models import (
     DeliveryStatus, CargoType
 )
 from delivery_core.models import Delivery
+from delivery_core.numbering import allocate_delivery_numbers
 
 
 class Command(BaseCommand):
@@ -142,8 +143,9 @@ class Command(BaseCommand):
         # Генерация случайных доставок
         deliveries_to_create = []
         num_deliveries = 15  # Создаем 15 доставок
+        numbers = allocate_delivery_numbers(num_deliveries)
         
-        for i in range(1, num_deliveries + 1):
+        for i, number in enumerate(numbers, start=1):
             # Создаем случайное время отправления в диапазоне от 30 дней назад до текущего момента
             departure_time = timezone.now() - timedelta(days=random.randint(0, 30),
                                                        hours=random.randint(0, 23),
@@ -158,7 +160,7 @@ class Command(BaseCommand):
             
             # Создаем доставку
             delivery = Delivery(
-                number=f"D-{2024}-{i:05d}",  # уникальный номер
+                number=number,  # уникальный номер от распределителя
                 transport_model=random.choice(transport_models),
                 departure_time=departure_time,
                 arrival_time=arrival_time,
@@ -1,5 +1,8 @@
+from django.conf import settings
 from django.urls import path, include
 from rest_framework.routers import DefaultRouter
+
+from delivery_project.async_views import AsyncListView
 from .views import (
     TransportModelViewSet, PackagingTypeViewSet, ServiceViewSet,
     DeliveryStatusViewSet, CargoTypeViewSet,
@@ -14,4 +17,14 @@ router.register(r'cargo-types', CargoTypeViewSet)
 
 urlpatterns = [
     path('', include(router.urls)),
-] 
\ No newline at end of file
+]
+
+if settings.API_ASYNC_VIEWS:
+    # Списки справочников асинхронными представлениями (ASGI)
+    urlpatterns = [
+        path(f'{prefix}/', AsyncListView.as_view(
+            viewset_class=viewset,
+            fallback_view=viewset.as_view({'get': 'list', 'post': 'create'}),
+        ), name=f'{basename}-list')
+        for prefix, viewset, basename in router.registry
+    ] + urlpatterns
@@ -0,0 +1,270 @@
+"""
+Построение отчетов по доставкам
+
+Каждый раздел отчета строится отдельной функцией по переданному набору
+доставок. Для оперативных доставок разделы группируются по названиям
+справочников через JOIN, для архивных - по id справочников с подстановкой
+названий из кэша (архив может находиться в отдельной базе). Функция
+merge_reports объединяет оперативную и архивную части в один отчет.
+
+abuild_report строит те же разделы параллельно: каждый раздел выполняется
+в отдельном потоке пула REPORTS_QUERY_WORKERS со своим соединением с базой.
+Соединение закрывается после раздела (при пуле соединений - возвращается
+в пул), поэтому потоки не удерживают соединения между отчетами.
+"""
+import asyncio
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from decimal import Decimal
+from itertools import chain
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import close_old_connections, connections
+from django.db.models import Count, Avg, Sum, Min, Max
+
+from delivery_core.models import ArchivedDeliveryService
+from references.cache import get_reference_names
+from references.models import TransportModel, Service, DeliveryStatus
+
+
+def get_date_grouping(report_type):
+    """
+    Возвращает имя поля и SQL-выражение группировки по времени
+    """
+    if report_type == 'daily':
+        # Группировка по дням
+        return 'day', "DATE(departure_time)"
+    elif report_type == 'monthly':
+        # Группировка по месяцам
+        return 'month', "DATE_TRUNC('month', departure_time)"
+    # Группировка по неделям
+    return 'week', "DATE_TRUNC('week', departure_time)"
+
+
+def build_status_report(deliveries):
+    """
+    Отчет по статусам
+    """
+    return deliveries.values('status__name').annotate(
+        count=Count('id')
+    ).order_by('-count')
+
+
+def build_transport_report(deliveries):
+    """
+    Отчет по моделям транспорта
+    """
+    return deliveries.values('transport_model__name').annotate(
+        count=Count('id'),
+        total_distance=Sum('distance'),
+        avg_distance=Avg('distance')
+    ).order_by('-count')
+
+
+def build_service_report(deliveries):
+    """
+    Отчет по услугам
+    """
+    return deliveries.values('services__name').annotate(
+        count=Count('id')
+    ).order_by('-count')
+
+
+def build_date_report(deliveries, report_type):
+    """
+    Временной отчет
+    """
+    key, sql = get_date_grouping(report_type)
+    return deliveries.extra(
+        select={key: sql}
+    ).values(key).annotate(
+        count=Count('id')
+    ).order_by(key)
+
+
+def build_summary(deliveries):
+    """
+    Общая статистика одним агрегирующим запросом
+    """
+    totals = deliveries.aggregate(
+        total=Count('id'),
+        total_distance=Sum('distance'),
+        avg_distance=Avg('distance'),
+        min_distance=Min('distance'),
+        max_distance=Max('distance'),
+    )
+    return {
+        'total': totals['total'],
+        'total_distance': totals['total_distance'] or 0,
+        'avg_distance': totals['avg_distance'] or 0,
+        'min_distance': totals['min_distance'] or 0,
+        'max_distance': totals['max_distance'] or 0,
+    }
+
+
+def build_delivery_report(deliveries, report_type):
+    """
+    Полный отчет по оперативным доставкам
+    """
+    return {
+        'status_report': build_status_report(deliveries),
+        'transport_report': build_transport_report(deliveries),
+        'service_report': build_service_report(deliveries),
+        'date_report': build_date_report(deliveries, report_type),
+        'summary': build_summary(deliveries),
+    }
+
+
+def build_archive_report(archived, report_type):
+    """
+    Полный отчет по архивным доставкам в формате оперативного отчета
+    """
+    status_names = get_reference_names(DeliveryStatus)
+    transport_names = get_reference_names(TransportModel)
+    service_names = get_reference_names(Service)
+
+    status_report = [
+        {'status__name': status_names.get(row['status_id']), 'count': row['count']}
+        for row in archived.values('status_id').annotate(count=Count('id')).order_by()
+    ]
+
+    transport_report = [
+        {
+            'transport_model__name': transport_names.get(row['transport_model_id']),
+            'count': row['count'],
+            'total_distance': row['total_distance'],
+            'avg_distance': row['avg_distance'],
+        }
+        for row in archived.values('transport_model_id').annotate(
+            count=Count('id'),
+            total_distance=Sum('distance'),
+            avg_distance=Avg('distance'),
+        ).order_by()
+    ]
+
+    service_report = [
+        {'services__name': service_names.get(row['service_id']), 'count': row['count']}
+        for row in ArchivedDeliveryService.objects.filter(
+            delivery__in=archived
+        ).values('service_id').annotate(count=Count('delivery_id')).order_by()
+    ]
+    # Доставки без услуг попадают в группу с пустым названием, как в LEFT JOIN
+    without_services = archived.filter(service_links__isnull=True).count()
+    if without_services:
+        service_report.append({'services__name': None, 'count': without_services})
+
+    return {
+        'status_report': status_report,
+        'transport_report': transport_report,
+        'service_report': service_report,
+        'date_report': list(build_date_report(archived, report_type)),
+        'summary': build_summary(archived),
+    }
+
+
+def _merge_rows(hot_rows, cold_rows, key, sum_fields=('count',)):
+    """
+    Объединяет строки двух отчетов по ключу, суммируя указанные поля
+    """
+    merged = {}
+    for row in chain(hot_rows, cold_rows):
+        item = merged.setdefault(row[key], {key: row[key], **{field: 0 for field in sum_fields}})
+        for field in sum_fields:
+            item[field] += row[field] or 0
+    return list(merged.values())
+
+
+def _average(total, count):
+    if not count:
+        return None
+    return Decimal(total) / count
+
+
+def merge_reports(hot, cold, report_type):
+    """
+    Объединяет оперативный и архивный отчеты за один период
+    """
+    by_count = lambda row: -row['count']
+
+    transport_report = _merge_rows(
+        hot['transport_report'], cold['transport_report'],
+        'transport_model__name', ('count', 'total_distance'),
+    )
+    for row in transport_report:
+        row['avg_distance'] = _average(row['total_distance'], row['count'])
+
+    date_key, _ = get_date_grouping(report_type)
+    date_report = _merge_rows(hot['date_report'], cold['date_report'], date_key)
+
+    hot_summary, cold_summary = hot['summary'], cold['summary']
+    total = hot_summary['total'] + cold_summary['total']
+    total_distance = hot_summary['total_distance'] + cold_summary['total_distance']
+    present = [summary for summary in (hot_summary, cold_summary) if summary['total']]
+
+    return {
+        'status_report': sorted(
+            _merge_rows(hot['status_report'], cold['status_report'], 'status__name'), key=by_count
+        ),
+        'transport_report': sorted(transport_report, key=by_count),
+        'service_report': sorted(
+            _merge_rows(hot['service_report'], cold['service_report'], 'services__name'), key=by_count
+        ),
+        'date_report': sorted(date_report, key=lambda row: str(row[date_key])),
+        'summary': {
+            'total': total,
+            'total_distance': total_distance,
+            'avg_distance': _average(total_distance, total) or 0,
+            'min_distance': min((summary['min_distance'] for summary in present), default=0),
+            'max_distance': max((summary['max_distance'] for summary in present), default=0),
+        },
+    }
+
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def _get_executor():
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(
+                max_workers=settings.REPORTS_QUERY_WORKERS, thread_name_prefix='report-query'
+            )
+        return _executor
+
+
+def _run_section(build):
+    # Потоки пула не проходят через request_started/request_finished, поэтому
+    # соединения проверяются и закрываются здесь, как в конце запроса
+    close_old_connections()
+    try:
+        return build()
+    finally:
+        connections.close_all()
+
+
+async def _section(build):
+    return await sync_to_async(_run_section, thread_sensitive=False, executor=_get_executor())(build)
+
+
+async def abuild_report(deliveries, archived, report_type):
+    """
+    Полный отчет по оперативным и архивным доставкам с параллельным
+    выполнением разделов; результат совпадает с последовательным построением
+    """
+    sections = {
+        'status_report': lambda: list(build_status_report(deliveries)),
+        'transport_report': lambda: list(build_transport_report(deliveries)),
+        'service_report': lambda: list(build_service_report(deliveries)),
+        'date_report': lambda: list(build_date_report(deliveries, report_type)),
+        'summary': lambda: build_summary(deliveries),
+    }
+    archive = lambda: build_archive_report(archived, report_type) if archived.exists() else None
+
+    *values, cold = await asyncio.gather(*(_section(build) for build in [*sections.values(), archive]))
+    result = dict(zip(sections, values))
+    if cold is not None:
+        result = merge_reports(result, cold, report_type)
+    return result
@@ -1,3 +1,98 @@
-from django.test import TestCase
+from concurrent.futures import ThreadPoolExecutor
+from types import SimpleNamespace
+from unittest import mock
 
-# Create your tests here.
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.db import connection, connections
+from django.test import TestCase, override_settings
+from rest_framework.exceptions import Throttled
+
+from .builders import _run_section
+from .throttling import ReportCostThrottle, TokenBucket, acquire_report_slot, release_report_slot
+
+
+@override_settings(
+    REPORTS_THROTTLE_ENABLED=True,
+    REPORTS_USER_BUCKET_CAPACITY=5,
+    REPORTS_USER_REFILL_PER_SECOND=1,
+    REPORTS_GLOBAL_BUCKET_CAPACITY=8,
+    REPORTS_GLOBAL_REFILL_PER_SECOND=1,
+    REPORTS_EXPENSIVE_COST=10,
+    REPORTS_MAX_CONCURRENT_EXPENSIVE=2,
+)
+class ReportThrottleTests(TestCase):
+    """
+    Корзины токенов и слоты дорогих отчетов
+    """
+
+    def setUp(self):
+        cache.clear()
+        self.addCleanup(cache.clear)
+        self.now = 1000.0
+        clock = mock.patch('reports.throttling.time.time', side_effect=lambda: self.now)
+        clock.start()
+        self.addCleanup(clock.stop)
+
+    def report_request(self, username, cost):
+        user = User.objects.get_or_create(username=username)[0]
+        return SimpleNamespace(user=user, query_params={}, report_cost=cost, META={})
+
+    def allow(self, username, cost):
+        throttle = ReportCostThrottle()
+        with mock.patch('reports.throttling.get_request_cost', return_value=cost):
+            return throttle.allow_request(self.report_request(username, cost), None), throttle.wait()
+
+    def test_bucket_refills_over_time(self):
+        bucket = TokenBucket('test:bucket', capacity=5, refill_rate=1)
+        self.assertEqual(bucket.peek(self.now), 5)
+        bucket.take(5, 4, self.now)
+        self.assertEqual(bucket.peek(self.now), 1)
+        self.assertEqual(bucket.peek(self.now + 2), 3)
+        self.assertEqual(bucket.peek(self.now + 100), 5)
+        self.assertEqual(bucket.wait_time(1, 3), 2)
+        # Стоимость больше емкости ограничивается емкостью
+        self.assertEqual(bucket.wait_time(5, 50), 0)
+
+    def test_user_bucket(self):
+        self.assertEqual(self.allow('first', 3), (True, 0))
+        allowed, wait = self.allow('first', 3)
+        self.assertFalse(allowed)
+        self.assertEqual(wait, 1)
+        self.now += 1
+        self.assertTrue(self.allow('first', 3)[0])
+
+    def test_global_bucket_is_shared(self):
+        self.assertTrue(self.allow('first', 5)[0])
+        allowed, wait = self.allow('second', 5)
+        self.assertFalse(allowed)
+        self.assertEqual(wait, 2)
+
+    def test_expensive_report_slots(self):
+        request = SimpleNamespace(report_cost=20, query_params={})
+        self.assertIsNone(acquire_report_slot(SimpleNamespace(report_cost=1, query_params={})))
+        slots = [acquire_report_slot(request), acquire_report_slot(request)]
+        with self.assertRaises(Throttled):
+            acquire_report_slot(request)
+        release_report_slot(slots[0])
+        self.assertIsNotNone(acquire_report_slot(request))
+
+
+class ReportSectionTests(TestCase):
+    """
+    Разделы отчета в потоках пула не удерживают соединения
+    """
+
+    def test_section_releases_connection(self):
+        def build():
+            # Тестовая база SQLite в памяти не закрывается, пока ее держит основной поток
+            mock.patch.object(connection, 'is_in_memory_db', return_value=False).start()
+            with connection.cursor() as cursor:
+                cursor.execute('SELECT 1')
+                opened = connection.connection is not None
+            return opened, connections['default']
+
+        with ThreadPoolExecutor(max_workers=1) as executor:
+            opened, section_connection = executor.submit(_run_section, build).result()
+            self.assertTrue(opened)
+            self.assertIsNone(section_connection.connection)
@@ -0,0 +1,219 @@
+"""
+Ограничение нагрузки от отчетов по доставкам
+
+Стоимость отчета оценивается по параметрам запроса: базовая единица,
+ширина периода (REPORTS_COST_DAYS_PER_TOKEN дней - одна единица) и
+количество групп временного раздела (дней, недель или месяцев периода,
+REPORTS_COST_GROUPS_PER_TOKEN групп - одна единица). Многолетний
+отчет по дням стоит в десятки раз дороже отчета за месяц.
+
+ReportCostThrottle списывает стоимость из двух корзин токенов - корзины
+пользователя и общей корзины всех пользователей. Корзины хранятся в кэше
+(CACHE_BACKEND), поэтому ограничения общие для всех процессов при общем
+кэше. Если токенов не хватает, возвращается 429 с Retry-After - временем
+до накопления нужного количества токенов. Стоимость больше емкости
+корзины ограничивается емкостью: такой отчет расходует всю корзину.
+
+report_slot ограничивает количество одновременно выполняемых дорогих
+отчетов (стоимостью от REPORTS_EXPENSIVE_COST) значением
+REPORTS_MAX_CONCURRENT_EXPENSIVE. Слот - ключ кэша со сроком жизни
+REPORTS_SLOT_TIMEOUT, поэтому слот процесса, завершившегося аварийно,
+освобождается сам. Если свободного слота нет, запрос сразу получает 429,
+а не ждет в очереди к базе.
+"""
+import math
+import time
+import uuid
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.core.cache import cache
+from rest_framework.exceptions import Throttled
+from rest_framework.throttling import BaseThrottle
+
+
+LOCK_ATTEMPTS = 50
+LOCK_DELAY = 0.002
+LOCK_TIMEOUT = 2
+
+# Количество дней в группе временного раздела отчета
+GROUP_DAYS = {'daily': 1, 'weekly': 7, 'monthly': 30}
+
+
+def estimate_report_cost(start_date, end_date, report_type):
+    """
+    Оценивает стоимость отчета в токенах
+    """
+    days = max((end_date - start_date).total_seconds() / 86400, 1)
+    groups = days / GROUP_DAYS.get(report_type, 7)
+    return (
+        1
+        + days / settings.REPORTS_COST_DAYS_PER_TOKEN
+        + groups / settings.REPORTS_COST_GROUPS_PER_TOKEN
+    )
+
+
+def get_request_cost(query_params):
+    """
+    Стоимость отчета по параметрам запроса
+
+    Для некорректных параметров возвращается базовая стоимость: запрос
+    все равно завершится ошибкой 400 без обращения к базе.
+    """
+    from .views import get_report_period
+
+    try:
+        return estimate_report_cost(*get_report_period(query_params))
+    except (TypeError, ValueError):
+        return 1
+
+
+@contextmanager
+def _cache_lock(key):
+    """
+    Короткая блокировка на основе cache.add для изменения корзины
+
+    Если блокировку получить не удалось, корзина меняется без нее:
+    в худшем случае одновременные запросы спишут токены неточно.
+    """
+    lock_key = f'{key}:lock'
+    for _ in range(LOCK_ATTEMPTS):
+        if cache.add(lock_key, 1, LOCK_TIMEOUT):
+            try:
+                yield
+            finally:
+                cache.delete(lock_key)
+            return
+        time.sleep(LOCK_DELAY)
+    yield
+
+
+class TokenBucket:
+    """
+    Корзина токенов в кэше: capacity токенов, пополнение refill_rate в секунду
+    """
+
+    def __init__(self, key, capacity, refill_rate):
+        self.key = key
+        self.capacity = capacity
+        self.refill_rate = refill_rate
+
+    def _timeout(self):
+        # Полная корзина равна отсутствующей - ключ можно не хранить дольше
+        return math.ceil(self.capacity / self.refill_rate) + 1
+
+    def peek(self, now):
+        """
+        Возвращает количество токенов на момент now
+        """
+        state = cache.get(self.key)
+        if state is None:
+            return self.capacity
+        tokens, updated = state
+        return min(self.capacity, tokens + (now - updated) * self.refill_rate)
+
+    def wait_time(self, tokens, cost):
+        """
+        Время до накопления cost токенов, если сейчас их tokens
+        """
+        cost = min(cost, self.capacity)
+        return max(cost - tokens, 0) / self.refill_rate
+
+    def take(self, tokens, cost, now):
+        cost = min(cost, self.capacity)
+        cache.set(self.key, (tokens - cost, now), self._timeout())
+
+
+class ReportCostThrottle(BaseThrottle):
+    """
+    Ограничение отчетов по стоимости: корзина пользователя и общая корзина
+    """
+
+    def __init__(self):
+        self.wait_seconds = None
+
+    def get_buckets(self, request):
+        ident = request.user.pk if request.user and request.user.is_authenticated else self.get_ident(request)
+        return [
+            TokenBucket(
+                f'reports:throttle:user:{ident}',
+                settings.REPORTS_USER_BUCKET_CAPACITY,
+                settings.REPORTS_USER_REFILL_PER_SECOND,
+            ),
+            TokenBucket(
+                'reports:throttle:global',
+                settings.REPORTS_GLOBAL_BUCKET_CAPACITY,
+                settings.REPORTS_GLOBAL_REFILL_PER_SECOND,
+            ),
+        ]
+
+    def allow_request(self, request, view):
+        if not settings.REPORTS_THROTTLE_ENABLED:
+            return True
+        cost = get_request_cost(request.query_params)
+        request.report_cost = cost
+        buckets = self.get_buckets(request)
+
+        # Токены списываются из обеих корзин, только если хватает в каждой
+        with _cache_lock(buckets[0].key), _cache_lock(buckets[1].key):
+            now = time.time()
+            levels = [bucket.peek(now) for bucket in buckets]
+            self.wait_seconds = max(
+                bucket.wait_time(tokens, cost) for bucket, tokens in zip(buckets, levels)
+            )
+            if self.wait_seconds > 0:
+                return False
+            for bucket, tokens in zip(buckets, levels):
+                bucket.take(tokens, cost, now)
+        return True
+
+    def wait(self):
+        return self.wait_seconds
+
+
+def acquire_report_slot(request):
+    """
+    Занимает слот выполнения дорогого отчета
+
+    Возвращает слот или None, если отчет дешевле REPORTS_EXPENSIVE_COST и
+    слот не нужен. Если все слоты заняты, выбрасывает Throttled (429).
+    """
+    cost = getattr(request, 'report_cost', None)
+    if cost is None:
+        cost = get_request_cost(request.query_params)
+    if not settings.REPORTS_THROTTLE_ENABLED or cost < settings.REPORTS_EXPENSIVE_COST:
+        return None
+
+    token = uuid.uuid4().hex
+    for index in range(settings.REPORTS_MAX_CONCURRENT_EXPENSIVE):
+        key = f'reports:slot:{index}'
+        if cache.add(key, token, settings.REPORTS_SLOT_TIMEOUT):
+            return key, token
+    raise Throttled(
+        wait=settings.REPORTS_SLOT_RETRY_AFTER,
+        detail='Слишком много тяжелых отчетов выполняется одновременно, повторите запрос позже.',
+    )
+
+
+def release_report_slot(slot):
+    """
+    Освобождает слот, занятый acquire_report_slot
+    """
+    if slot is None:
+        return
+    key, token = slot
+    # Слот мог истечь и достаться другому запросу
+    if cache.get(key) == token:
+        cache.delete(key)
+
+
+@contextmanager
+def report_slot(request):
+    """
+    Слот выполнения дорогого отчета на время построения
+    """
+    slot = acquire_report_slot(request)
+    try:
+        yield
+    finally:
+        release_report_slot(slot)
@@ -1,6 +1,13 @@
+from django.conf import settings
 from django.urls import path
-from .views import delivery_reports
+from .views import AsyncDeliveryReportView, delivery_reports
 
 urlpatterns = [
     path('delivery-reports/', delivery_reports, name='delivery-reports'),
-] 
\ No newline at end of file
+]
+
+if settings.API_ASYNC_VIEWS:
+    # Отчеты асинхронным представлением с параллельными разделами (ASGI)
+    urlpatterns = [
+        path('delivery-reports/', AsyncDeliveryReportView.as_view(), name='delivery-reports'),
+    ] + urlpatterns